@@ -47,14 +47,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.middleware.cache.UpdateCacheMiddleware',  # Клиентское кеширование
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'mailings.roles.RoleMiddleware',  # Роли пользователя один раз за запрос
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',  # Клиентское кеширование
+    'mailings.page_cache.PageCacheMiddleware',  # Кеш страниц, отмеченных page_cache
 ]
 
 ROOT_URLCONF = 'mailing_service.urls'
@@ -159,6 +159,29 @@ EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
 
+# Доставка рассылок
+# Сколько попыток рассылки копить в памяти перед записью в БД одной транзакцией
+MAILING_ATTEMPT_BATCH_SIZE = int(os.getenv('MAILING_ATTEMPT_BATCH_SIZE', '500'))
+# Сколько SMTP-сессий одновременно держит асинхронный движок отправки
+MAILING_ASYNC_CONCURRENCY = int(os.getenv('MAILING_ASYNC_CONCURRENCY', '100'))
+# По сколько получателей делить задание на части, которые узлы берут в аренду
+MAILING_CHUNK_SIZE = int(os.getenv('MAILING_CHUNK_SIZE', '1000'))
+# Срок аренды части задания в секундах, после него часть может забрать другой узел
+MAILING_LEASE_SECONDS = int(os.getenv('MAILING_LEASE_SECONDS', '300'))
+# Адаптивное ограничение скорости отправки по доменам получателей
+MAILING_THROTTLE = os.getenv('MAILING_THROTTLE', 'True') == 'True'
+# Начальная и предельная скорость отправки в один домен, писем в секунду
+MAILING_THROTTLE_RATE = float(os.getenv('MAILING_THROTTLE_RATE', '10'))
+MAILING_THROTTLE_MAX_RATE = float(os.getenv('MAILING_THROTTLE_MAX_RATE', '200'))
+# Начальное и предельное число одновременных отправок в один домен
+MAILING_THROTTLE_CONCURRENCY = float(os.getenv('MAILING_THROTTLE_CONCURRENCY', '4'))
+MAILING_THROTTLE_MAX_CONCURRENCY = float(os.getenv('MAILING_THROTTLE_MAX_CONCURRENCY', '50'))
+
+# Сколько получателей одного домена отправлять одной SMTP-транзакцией
+# (несколько RCPT TO на одно письмо). 1 - по письму на получателя.
+# Применяется только к сообщениям без подстановок.
+MAILING_ENVELOPE_BATCH = int(os.getenv('MAILING_ENVELOPE_BATCH', '1'))
+
 # Cache settings
 CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'False') == 'True'
 if CACHE_ENABLED and os.getenv('REDIS_HOST'):
@@ -176,12 +199,33 @@ else:
         }
     }
 
-# Клиентское кеширование (HTTP заголовки)
-if not DEBUG:
-    # В продакшене используем более агрессивное кеширование
-    CACHE_MIDDLEWARE_SECONDS = 300
-else:
-    CACHE_MIDDLEWARE_SECONDS = 60
+# Кеш общий для всех процессов: веб-сервера, send_mailings, run_delivery_worker
+# и run_scheduler. Локальный кеш у каждого процесса свой, и сброс поколений
+# (mailings.generations) из обработчика не виден веб-серверу.
+LOCAL_CACHE_BACKENDS = [
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+]
+SHARED_CACHE = CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+# Кеш результатов запросов (mailings.generations). По умолчанию включен только
+# с общим кешем: тогда изменения данных в любом процессе сбрасывают его сразу,
+# а срок хранения лишь ограничивает размер кеша.
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', str(SHARED_CACHE)) == 'True'
+RESULT_CACHE_SECONDS = int(os.getenv('RESULT_CACHE_SECONDS', '600'))
+
+# Кеш страниц для пользователя (mailings.page_cache). Сроки хранения
+# задаются у каждой страницы декоратором page_cache. Как и кеш результатов,
+# по умолчанию включен только с общим кешем.
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', str(SHARED_CACHE)) == 'True'
+
+# Кеш принадлежности пользователя к группе менеджеров (mailings.roles).
+# При изменении групп запись сбрасывается сразу, но с локальным кешем только
+# в том процессе, где группы изменили, а остальные процессы выдавали бы
+# права менеджера до истечения срока. Поэтому по умолчанию он включен только
+# с общим кешем, без него роль считается один раз за запрос.
+ROLE_CACHE_ENABLED = os.getenv('ROLE_CACHE_ENABLED', str(SHARED_CACHE)) == 'True'
+ROLE_CACHE_SECONDS = int(os.getenv('ROLE_CACHE_SECONDS', '300'))
 
 # Login/Logout URLs
 LOGIN_URL = 'users:login'
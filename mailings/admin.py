@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Recipient, Message, Mailing, MailingAttempt
+from .models import Recipient, Message, Mailing, MailingAttempt, DeliveryJob, DeliveryChunk
 
 
 @admin.register(Recipient)
@@ -30,3 +30,18 @@ class MailingAttemptAdmin(admin.ModelAdmin):
     list_filter = ('status', 'attempt_time')
     search_fields = ('mailing__message__subject', 'recipient__email')
     readonly_fields = ('attempt_time',)
+
+
+class DeliveryChunkInline(admin.TabularInline):
+    model = DeliveryChunk
+    extra = 0
+    readonly_fields = ('first_recipient_id', 'last_recipient_id', 'done_at', 'success_count', 'fail_count',
+                       'lease_owner', 'lease_expires_at')
+
+
+@admin.register(DeliveryJob)
+class DeliveryJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'mailing', 'status', 'worker', 'created_at', 'finished_at', 'success_count', 'fail_count')
+    list_filter = ('status', 'created_at')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+    inlines = [DeliveryChunkInline]
@@ -0,0 +1,299 @@
+import asyncio
+import base64
+import queue
+import smtplib
+import ssl
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.mail.utils import DNS_NAME
+
+
+class AsyncSMTPClient:
+    """Минимальный SMTP-клиент на asyncio streams.
+
+    Параметры подключения по умолчанию берутся из настроек EMAIL_*,
+    ошибки поднимаются теми же исключениями smtplib, что и в блокирующем
+    бэкенде Django.
+    """
+
+    def __init__(self, host=None, port=None, use_tls=None, use_ssl=None,
+                 username=None, password=None, timeout=None):
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        self.use_tls = settings.EMAIL_USE_TLS if use_tls is None else use_tls
+        self.use_ssl = getattr(settings, 'EMAIL_USE_SSL', False) if use_ssl is None else use_ssl
+        self.username = settings.EMAIL_HOST_USER if username is None else username
+        self.password = settings.EMAIL_HOST_PASSWORD if password is None else password
+        self.timeout = timeout or getattr(settings, 'EMAIL_TIMEOUT', None) or 60
+        self.reader = None
+        self.writer = None
+        self.extensions = set()
+        self.ready = False
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host, self.port,
+                ssl=ssl.create_default_context() if self.use_ssl else None,
+            ),
+            self.timeout,
+        )
+        await self.expect(220)
+        await self.ehlo()
+        if self.use_tls:
+            await self.command('STARTTLS', 220)
+            await self.writer.start_tls(ssl.create_default_context())
+            await self.ehlo()
+        if self.username:
+            token = base64.b64encode(
+                f'\0{self.username}\0{self.password}'.encode()
+            ).decode()
+            await self.command(f'AUTH PLAIN {token}', 235)
+        self.ready = True
+
+    async def read_reply(self):
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise smtplib.SMTPServerDisconnected('Соединение закрыто сервером')
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                try:
+                    return int(line[:3]), b'\n'.join(lines)
+                except ValueError:
+                    raise smtplib.SMTPServerDisconnected('Некорректный ответ сервера')
+
+    async def expect(self, *codes):
+        code, text = await self.read_reply()
+        if code not in codes:
+            raise smtplib.SMTPResponseException(code, text)
+        return code, text
+
+    async def command(self, line, *codes):
+        self.writer.write(line.encode() + b'\r\n')
+        return await self.expect(*codes)
+
+    async def ehlo(self):
+        _, text = await self.command(f'EHLO {DNS_NAME}', 250)
+        self.extensions = {
+            line.split()[0].upper()
+            for line in text.decode('ascii', 'replace').splitlines()[1:]
+            if line.strip()
+        }
+
+    async def send(self, from_addr, to_addrs, pieces):
+        """Отправить одно письмо. Возвращает словарь отклоненных адресов.
+
+        pieces - готовые к DATA части письма с завершающей точкой
+        (PreparedEmail.pieces), они пишутся в сокет без склейки.
+        Если сервер объявил PIPELINING, MAIL, все RCPT и DATA уходят
+        пачкой, а ответы читаются после.
+        """
+        commands = [f'MAIL FROM:<{from_addr}>'] + [f'RCPT TO:<{address}>' for address in to_addrs]
+        pipelining = 'PIPELINING' in self.extensions
+        if pipelining:
+            self.writer.write(''.join(f'{command}\r\n' for command in commands + ['DATA']).encode())
+        replies = []
+        for command in commands:
+            if not pipelining:
+                self.writer.write(f'{command}\r\n'.encode())
+            replies.append(await self.read_reply())
+
+        code, text = replies[0]
+        refused = {
+            address: reply
+            for address, reply in zip(to_addrs, replies[1:])
+            if reply[0] not in (250, 251)
+        }
+        accepted = code == 250 and len(refused) < len(to_addrs)
+        data_code, data_text = None, b''
+        if pipelining or accepted:
+            if not pipelining:
+                self.writer.write(b'DATA\r\n')
+            data_code, data_text = await self.read_reply()
+        if data_code == 354 and not accepted:
+            # Сервер принял DATA без получателей: завершаем пустое письмо
+            self.writer.write(b'.\r\n')
+            await self.read_reply()
+
+        if code != 250:
+            await self.command('RSET', 250)
+            raise smtplib.SMTPSenderRefused(code, text, from_addr)
+        if not accepted:
+            await self.command('RSET', 250)
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_code != 354:
+            await self.command('RSET', 250)
+            raise smtplib.SMTPDataError(data_code, data_text)
+
+        self.writer.writelines(pieces)
+        await self.expect(250)
+        return refused
+
+    async def quit(self):
+        try:
+            await self.command('QUIT', 221)
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.ready = False
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def deliver_async(prepared, buckets, concurrency, put, stop, throttle=None, max_reconnects=3):
+    """Отправка писем из одного цикла событий.
+
+    prepared - сообщение, заранее собранное в байты (PreparedMessage).
+    buckets - получатели, сгруппированные по доменам (group_by_domain).
+    Одновременно открыто не больше concurrency SMTP-сессий (семафор).
+    Освободившаяся сессия помнит домен последнего письма и в первую
+    очередь достается письму в тот же домен.
+    throttle - ограничитель скорости по доменам (DomainThrottle).
+    Письма каждого домена запускает своя корутина: она сначала ждет
+    разрешения ограничителя домена и только потом занимает общий слот,
+    поэтому медленный домен не держит слоты, нужные остальным доменам.
+    Результаты передаются в put(recipient, success, response).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    # домен -> свободные сессии, последним отправлявшие в этот домен
+    idle = defaultdict(list)
+    tasks = set()
+
+    def take_idle(domain):
+        if idle[domain]:
+            return idle[domain].pop()
+        for clients in idle.values():
+            if clients:
+                return clients.pop()
+        return None
+
+    async def send_group(domain, group):
+        """Одно письмо группе получателей одного домена (prepared.split)"""
+        error = None
+        refused = {}
+        try:
+            if len(group) == 1:
+                email = prepared.build_raw(group[0])
+            else:
+                email = prepared.build_batch(group)
+
+            reconnects = 0
+            while True:
+                client = take_idle(domain)
+                try:
+                    if client is None:
+                        client = AsyncSMTPClient()
+                        await client.connect()
+                    refused = await client.send(prepared.from_addr, email.addresses, email.pieces())
+                except (smtplib.SMTPServerDisconnected, ConnectionError, asyncio.TimeoutError):
+                    client.close()
+                    reconnects += 1
+                    if reconnects > max_reconnects:
+                        raise
+                    continue
+                except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                    # Сервер отклонил именно это письмо, сессию можно использовать дальше
+                    if client.ready:
+                        idle[domain].append(client)
+                    else:
+                        client.close()
+                    raise
+                except Exception:
+                    client.close()
+                    raise
+                idle[domain].append(client)
+                break
+        except smtplib.SMTPRecipientsRefused as e:
+            error = e
+            refused = e.recipients
+        except Exception as e:
+            error = e
+            for recipient in group:
+                put(recipient, False, str(e) or e.__class__.__name__)
+            return
+        else:
+            if refused:
+                error = smtplib.SMTPRecipientsRefused(refused)
+        finally:
+            if throttle is not None:
+                throttle.release(domain, error)
+            semaphore.release()
+
+        for recipient, address in zip(group, email.addresses):
+            if address in refused:
+                put(recipient, False, str({address: refused[address]}))
+            else:
+                put(recipient, True, 'Сообщение успешно отправлено')
+
+    async def schedule(domain, recipients):
+        """Запускать письма домена: сначала слот ограничителя домена, потом общий"""
+        for group in prepared.split(recipients):
+            if stop.is_set():
+                return
+            if throttle is not None:
+                await throttle.acquire_async(domain)
+            await semaphore.acquire()
+            if stop.is_set():
+                semaphore.release()
+                if throttle is not None:
+                    throttle.cancel(domain)
+                return
+            task = asyncio.create_task(send_group(domain, group))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*(schedule(domain, recipients) for domain, recipients in buckets))
+    if tasks:
+        await asyncio.gather(*tasks)
+    await asyncio.gather(*(client.quit() for clients in idle.values() for client in clients))
+
+
+def send_async(prepared, buckets, concurrency=None, throttle=None, stop=None):
+    """Асинхронный движок доставки с тем же интерфейсом, что и send_sequential.
+
+    Цикл событий работает в отдельном потоке, результаты отдаются
+    вызывающему потоку через очередь, поэтому запись попыток в БД
+    остается синхронной.
+    После stop новые сессии не начинаются, а результаты начатых
+    по-прежнему отдаются вызывающему, пока цикл событий не завершится.
+    """
+    concurrency = concurrency or settings.MAILING_ASYNC_CONCURRENCY
+    # Получатели уже загружены в group_by_domain: ORM в цикле событий недоступна
+    results = queue.Queue()
+    if stop is None:
+        stop = threading.Event()
+    finished = object()
+    errors = []
+
+    def run():
+        try:
+            asyncio.run(deliver_async(
+                prepared, buckets, concurrency,
+                lambda *result: results.put(result), stop, throttle,
+            ))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            results.put(finished)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            result = results.get()
+            if result is finished:
+                break
+            yield result
+    finally:
+        stop.set()
+        thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,82 @@
+"""Условные GET-запросы (ETag) для списков и карточек.
+
+Страница, отмеченная декоратором conditional, сначала получает ETag:
+хеш пользователя, сессии, пути с параметрами, поколения данных владельца
+(mailings.generations) и отметки изменения выборки из БД - времени
+последнего изменения (updated_at) и числа строк. Если браузер прислал
+тот же ETag в If-None-Match, отвечаем 304 без основного запроса
+и без шаблона.
+
+Отметка из БД не зависит от кеша, поэтому ETag верен и тогда, когда
+поколение потерялось или у процессов свой локальный кеш. Поколение
+добавляет то, чего нет в updated_at: попытки, задания и получателей
+рассылки. Last-Modified не отдается: по одному времени нельзя заметить
+удаление строки или смену статуса рассылки со временем.
+"""
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .generations import current, scope_of
+from .models import status_condition
+from .page_cache import has_messages
+from .roles import get_roles
+
+
+def stamp(queryset, **aggregates):
+    """Отметка изменения выборки: последнее изменение, число строк и aggregates"""
+    values = queryset.order_by().aggregate(updated=Max('updated_at'), count=Count('pk'), **aggregates)
+    return ':'.join(str(values[name]) for name in sorted(values))
+
+
+def mailing_stamp(queryset):
+    """Отметка рассылок: статус меняется со временем без записи, поэтому считаем и его"""
+    return stamp(
+        queryset,
+        running=Count('pk', filter=status_condition('Запущена')),
+        finished=Count('pk', filter=status_condition('Завершена')),
+        message_updated=Max('message__updated_at'),
+    )
+
+
+def page_etag(request, data_stamp):
+    roles = get_roles(request)
+    epoch, generation = current(scope_of(request))
+    # Сессия - потому что после входа меняется CSRF-токен в формах страницы
+    source = ':'.join(str(part) for part in (
+        request.user.pk, int(roles.is_staff), int(roles.is_manager), request.session.session_key,
+        epoch, generation, request.get_full_path(), data_stamp,
+    ))
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+def conditional(stamp_func):
+    """Отвечать 304, если данные страницы не изменились.
+
+    stamp_func(request, *args, **kwargs) возвращает отметку изменения
+    данных страницы (stamp, mailing_stamp). Страница с всплывающими
+    сообщениями всегда строится заново.
+    """
+    def etag_func(request, *args, **kwargs):
+        if has_messages(request):
+            return None
+        return page_etag(request, stamp_func(request, *args, **kwargs))
+
+    def decorator(view_func):
+        conditional_view = condition(etag_func=etag_func)(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.has_header('ETag'):
+                # Страница своя у каждого пользователя, браузер проверяет ее при каждом показе
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+
+        # По ETag кеш страниц (mailings.page_cache) проверяет, не устарела ли сохраненная страница
+        wrapper.page_etag = etag_func
+        return wrapper
+    return decorator
@@ -0,0 +1,205 @@
+"""Счетчики попыток рассылок на Mailing и OwnerDeliveryCounter.
+
+Счетчики увеличиваются выражениями F() в той же транзакции, в которой
+записываются попытки (AttemptBuffer.flush), поэтому параллельные
+обработчики не теряют чужие прибавления. Попытки удаляемых рассылок
+и получателей вычитаются сигналами до удаления (forget_mailing,
+forget_recipient). Расхождения после ручных правок исправляет команда
+rebuild_delivery_counters.
+"""
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, TruncHour
+from django.utils import timezone
+
+from .generations import bump, bump_all
+from .models import DeliveryRollup, Mailing, MailingAttempt, OwnerDeliveryCounter
+from .rollups import add_counts, hour_of
+
+
+def increments(total, successful, failed, last_attempt_at=None):
+    """Аргументы для update(), прибавляющие значения к счетчикам"""
+    values = {
+        'attempts_total': F('attempts_total') + total,
+        'attempts_successful': F('attempts_successful') + successful,
+        'attempts_failed': F('attempts_failed') + failed,
+    }
+    if last_attempt_at is not None:
+        last = Value(last_attempt_at)
+        values['last_attempt_at'] = Greatest(Coalesce('last_attempt_at', last), last)
+    return values
+
+
+def record_attempts(attempts):
+    """Прибавить к счетчикам рассылок и их владельцев записанные попытки.
+
+    Заодно пополняются почасовые итоги (mailings.rollups). Вызывается
+    в транзакции, которая пишет попытки. Строки обновляются в порядке id,
+    чтобы параллельные обработчики не блокировали друг друга встречно.
+    """
+    if not attempts:
+        return
+    # [всего, успешно, неудачно, последняя попытка]
+    per_mailing = defaultdict(lambda: [0, 0, 0, None])
+    for attempt in attempts:
+        counts = per_mailing[attempt.mailing_id]
+        counts[0] += 1
+        if attempt.status == 'Успешно':
+            counts[1] += 1
+        else:
+            counts[2] += 1
+        if counts[3] is None or attempt.attempt_time > counts[3]:
+            counts[3] = attempt.attempt_time
+
+    owners = dict(Mailing.objects.filter(pk__in=per_mailing).values_list('pk', 'owner_id'))
+    per_hour = defaultdict(int)
+    for attempt in attempts:
+        if attempt.mailing_id in owners:
+            key = (hour_of(attempt.attempt_time), owners[attempt.mailing_id], attempt.mailing_id, attempt.status)
+            per_hour[key] += 1
+
+    per_owner = defaultdict(lambda: [0, 0, 0, None])
+    for mailing_id, owner_id in owners.items():
+        if owner_id is None:
+            continue
+        counts = per_owner[owner_id]
+        mailing_counts = per_mailing[mailing_id]
+        for i in range(3):
+            counts[i] += mailing_counts[i]
+        if counts[3] is None or mailing_counts[3] > counts[3]:
+            counts[3] = mailing_counts[3]
+
+    for mailing_id in sorted(per_mailing):
+        Mailing.objects.filter(pk=mailing_id).update(
+            updated_at=timezone.now(), **increments(*per_mailing[mailing_id])
+        )
+
+    OwnerDeliveryCounter.objects.bulk_create(
+        [OwnerDeliveryCounter(owner_id=owner_id) for owner_id in per_owner],
+        ignore_conflicts=True
+    )
+    for owner_id in sorted(per_owner):
+        OwnerDeliveryCounter.objects.filter(owner_id=owner_id).update(**increments(*per_owner[owner_id]))
+
+    add_counts(per_hour)
+    # Попытки пишутся bulk_create, сигналов нет - кеш владельцев сбрасываем сами
+    bump(owners.values())
+
+
+def forget_mailing(mailing):
+    """Вычесть счетчики удаляемой рассылки из счетчиков владельца.
+
+    Счетчики читаются из БД под блокировкой строки, а не берутся из объекта:
+    объект мог быть загружен до записи последних попыток.
+    """
+    if mailing.owner_id is None:
+        return
+    counts = Mailing.objects.select_for_update().filter(pk=mailing.pk).values_list(
+        'attempts_total', 'attempts_successful', 'attempts_failed'
+    ).first()
+    if not counts or not counts[0]:
+        return
+    OwnerDeliveryCounter.objects.filter(owner_id=mailing.owner_id).update(
+        **increments(*(-count for count in counts))
+    )
+
+
+def forget_recipient(recipient):
+    """Вычесть попытки удаляемого получателя из счетчиков и почасовых итогов.
+
+    Попытки удаляются каскадом вместе с получателем, поэтому вычитаем их
+    заранее, сгруппировав в БД по рассылке, часу и статусу. Время последней
+    попытки рассылок и владельцев пересчитывается без попыток получателя.
+    """
+    rows = MailingAttempt.objects.filter(recipient=recipient).annotate(
+        rollup_hour=TruncHour('attempt_time', tzinfo=dt_timezone.utc)
+    ).values('mailing', 'mailing__owner', 'rollup_hour', 'status').annotate(n=Count('pk')).order_by()
+    per_mailing = defaultdict(lambda: [0, 0, 0])
+    per_owner = defaultdict(lambda: [0, 0, 0])
+    per_hour = {}
+    for row in rows:
+        index = 1 if row['status'] == 'Успешно' else 2
+        for counts in (per_mailing[row['mailing']], per_owner[row['mailing__owner']]):
+            counts[0] += row['n']
+            counts[index] += row['n']
+        per_hour[(row['mailing'], row['rollup_hour'], row['status'])] = row['n']
+    if not per_mailing:
+        return
+
+    others = MailingAttempt.objects.filter(mailing=OuterRef('pk')).exclude(recipient=recipient).order_by()
+    for mailing_id in sorted(per_mailing):
+        Mailing.objects.filter(pk=mailing_id).update(
+            updated_at=timezone.now(),
+            last_attempt_at=Subquery(others.values('mailing').annotate(last=Max('attempt_time')).values('last')),
+            **increments(*(-count for count in per_mailing[mailing_id]))
+        )
+    per_owner.pop(None, None)
+    mailings = Mailing.objects.filter(owner=OuterRef('owner')).order_by().values('owner')
+    for owner_id in sorted(per_owner):
+        OwnerDeliveryCounter.objects.filter(owner_id=owner_id).update(
+            last_attempt_at=Subquery(mailings.annotate(last=Max('last_attempt_at')).values('last')),
+            **increments(*(-count for count in per_owner[owner_id]))
+        )
+
+    # Итогов может не быть у попыток, записанных до их появления (backfill_delivery_rollup)
+    for mailing_id, hour, status in sorted(per_hour):
+        DeliveryRollup.objects.filter(mailing_id=mailing_id, hour=hour, status=status).update(
+            count=Greatest(F('count') - per_hour[(mailing_id, hour, status)], Value(0))
+        )
+    DeliveryRollup.objects.filter(mailing_id__in=per_mailing, count=0).delete()
+    bump(per_owner)
+
+
+def rebuild_counters():
+    """Пересчитать все счетчики по таблице попыток.
+
+    Рассылки обновляются одним UPDATE с подзапросами, счетчики владельцев
+    собираются заново из счетчиков рассылок. Возвращает пару
+    (число рассылок с расхождением, число владельцев).
+    """
+    attempts = MailingAttempt.objects.filter(mailing=OuterRef('pk')).order_by().values('mailing')
+
+    def count(condition=None):
+        return Coalesce(Subquery(attempts.annotate(n=Count('pk', filter=condition)).values('n')), 0)
+
+    actual = {
+        'attempts_total': count(),
+        'attempts_successful': count(Q(status='Успешно')),
+        'attempts_failed': count(Q(status='Не успешно')),
+        'last_attempt_at': Subquery(attempts.annotate(last=Max('attempt_time')).values('last')),
+    }
+
+    with transaction.atomic():
+        drifted = Mailing.objects.annotate(
+            actual_total=actual['attempts_total'],
+            actual_successful=actual['attempts_successful'],
+            actual_failed=actual['attempts_failed'],
+        ).exclude(
+            attempts_total=F('actual_total'),
+            attempts_successful=F('actual_successful'),
+            attempts_failed=F('actual_failed'),
+        ).count()
+        Mailing.objects.update(updated_at=timezone.now(), **actual)
+
+        totals = Mailing.objects.filter(owner__isnull=False).values('owner').annotate(
+            total=Sum('attempts_total'),
+            successful=Sum('attempts_successful'),
+            failed=Sum('attempts_failed'),
+            last=Max('last_attempt_at'),
+        ).order_by()
+        OwnerDeliveryCounter.objects.all().delete()
+        OwnerDeliveryCounter.objects.bulk_create([
+            OwnerDeliveryCounter(
+                owner_id=row['owner'],
+                attempts_total=row['total'],
+                attempts_successful=row['successful'],
+                attempts_failed=row['failed'],
+                last_attempt_at=row['last'],
+            )
+            for row in totals
+        ])
+        bump_all()
+    return drifted, len(totals)
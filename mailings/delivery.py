@@ -0,0 +1,384 @@
+import smtplib
+import threading
+from collections import Counter, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+
+from .counters import record_attempts
+from .models import DeliveryCheckpoint, MailingAttempt
+from .prepared import PreparedEmail, PreparedMessage
+from .throttling import get_throttle, recipient_domain
+
+
+# Ошибки, после которых сессия с сервером считается разорванной
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+# Сколько писем одного домена поток пула отправляет подряд через свое соединение
+DOMAIN_SLICE_SIZE = 50
+
+# Запрошена остановка процесса (SIGTERM). Обработчик сигнала только ставит
+# флаг и не бросает исключение посреди записи буфера в БД. deliver_mailing
+# замечает флаг после очередного письма: любой движок (последовательный,
+# пул потоков, asyncio) перестает начинать новые отправки, а результаты уже
+# начатых записываются до того, как поднимется DeliveryStopped. Поэтому
+# остановка может занять время отправки тех писем, что уже в работе
+stop_requested = threading.Event()
+
+
+class DeliveryStopped(Exception):
+    """Отправка прервана по запросу остановки процесса"""
+
+
+class MailConnection:
+    """Одно соединение с почтовым сервером на всю отправку рассылки.
+
+    Соединение открывается при первой отправке и переоткрывается,
+    если сервер разорвал сессию посреди отправки.
+    """
+
+    def __init__(self, max_reconnects=3):
+        self.backend = get_connection(fail_silently=False)
+        self.max_reconnects = max_reconnects
+        self.is_open = False
+
+    def open(self):
+        if not self.is_open:
+            self.backend.open()
+            self.is_open = True
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            try:
+                self.backend.close()
+            except (smtplib.SMTPException, OSError):
+                # Сессия уже разорвана, закрывать нечего
+                pass
+
+    def send(self, email):
+        """Отправить письмо, при разрыве соединения переподключиться"""
+        reconnects = 0
+        while True:
+            self.open()
+            try:
+                if isinstance(email, PreparedEmail):
+                    return email.send(self.backend.connection)
+                return self.backend.send_messages([email])
+            except RECONNECT_ERRORS:
+                self.close()
+                reconnects += 1
+                if reconnects > self.max_reconnects:
+                    raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AttemptBuffer:
+    """Буфер попыток рассылки.
+
+    Попытки копятся в памяти и записываются пачками через bulk_create
+    в одной транзакции. Если попытка относится к заданию, в той же
+    транзакции пишется отметка DeliveryCheckpoint и обновляются счетчики
+    попыток рассылки и ее владельца. При выходе из блока
+    with (в том числе по ошибке) остаток буфера сбрасывается в БД.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.MAILING_ATTEMPT_BATCH_SIZE
+        self.pending = []
+        self.checkpoints = []
+        self.lock = threading.RLock()
+
+    def add(self, mailing_id, recipient_id, success, response, job_id=None):
+        with self.lock:
+            self.pending.append(MailingAttempt(
+                mailing_id=mailing_id,
+                recipient_id=recipient_id,
+                status='Успешно' if success else 'Не успешно',
+                server_response=response
+            ))
+            if job_id is not None:
+                self.checkpoints.append(DeliveryCheckpoint(
+                    job_id=job_id,
+                    recipient_id=recipient_id,
+                    success=success
+                ))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, []
+            checkpoints, self.checkpoints = self.checkpoints, []
+            with transaction.atomic():
+                MailingAttempt.objects.bulk_create(pending, batch_size=self.batch_size)
+                DeliveryCheckpoint.objects.bulk_create(
+                    checkpoints, batch_size=self.batch_size, ignore_conflicts=True
+                )
+                record_attempts(pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+def try_send(connection, email, throttle=None):
+    """Отправить письмо и вернуть пару (успех, ответ сервера).
+
+    С throttle отправка ждет разрешения ограничителя домена получателя
+    и сообщает ему результат.
+    """
+    domain = recipient_domain(email.to[0])
+    if throttle is not None:
+        throttle.acquire(domain)
+    error = None
+    try:
+        connection.send(email)
+    except Exception as e:
+        error = e
+        return False, str(e)
+    finally:
+        if throttle is not None:
+            throttle.release(domain, error)
+    return True, 'Сообщение успешно отправлено'
+
+
+def try_send_batch(connection, email, recipients, throttle=None):
+    """Отправить одно письмо группе получателей одного домена одной транзакцией.
+
+    Возвращает список (получатель, успех, ответ сервера): отказ сервера
+    на RCPT TO относится только к своему получателю, ошибка всей
+    транзакции - ко всем.
+    """
+    domain = recipient_domain(email.to[0])
+    if throttle is not None:
+        throttle.acquire(domain)
+    error = None
+    try:
+        refused = connection.send(email)
+    except smtplib.SMTPRecipientsRefused as e:
+        error = e
+        refused = e.recipients
+    except Exception as e:
+        error = e
+        return [(recipient, False, str(e)) for recipient in recipients]
+    else:
+        if refused:
+            error = smtplib.SMTPRecipientsRefused(refused)
+    finally:
+        if throttle is not None:
+            throttle.release(domain, error)
+    results = []
+    for recipient, address in zip(recipients, email.addresses):
+        if address in refused:
+            results.append((recipient, False, str({address: refused[address]})))
+        else:
+            results.append((recipient, True, 'Сообщение успешно отправлено'))
+    return results
+
+
+def send_group(connection, prepared, recipients, throttle=None, stop=None):
+    """Отправить письма получателям одного домена, по транзакции на группу prepared.split.
+
+    Если письмо не собирается (например, после подстановки в теме
+    оказался перевод строки), это неудачная попытка только для его
+    получателей, остальные письма отправляются.
+    После stop оставшиеся группы не отправляются и в результат не попадают.
+    """
+    results = []
+    for group in prepared.split(recipients):
+        if stop is not None and stop.is_set():
+            break
+        try:
+            email = prepared.build(group[0]) if len(group) == 1 else prepared.build_batch(group)
+        except Exception as e:
+            results.extend((recipient, False, str(e)) for recipient in group)
+            continue
+        if len(group) == 1:
+            results.append((group[0], *try_send(connection, email, throttle)))
+        else:
+            results.extend(try_send_batch(connection, email, group, throttle))
+    return results
+
+
+def group_by_domain(recipients):
+    """Разложить получателей по доменам.
+
+    Возвращает список пар (домен, получатели), крупные домены первыми,
+    чтобы самые длинные серии писем шли через одно соединение.
+    """
+    buckets = defaultdict(list)
+    for recipient in recipients:
+        buckets[recipient_domain(recipient.email)].append(recipient)
+    return sorted(buckets.items(), key=lambda item: (-len(item[1]), item[0]))
+
+
+def send_sequential(prepared, buckets, throttle=None, stop=None):
+    """Отправка по одному письму через общее соединение, домен за доменом"""
+    with MailConnection() as connection:
+        for domain, recipients in buckets:
+            for group in prepared.split(recipients):
+                if stop is not None and stop.is_set():
+                    return
+                yield from send_group(connection, prepared, group, throttle)
+
+
+def send_parallel(prepared, buckets, workers, throttle=None, stop=None):
+    """Отправка через пул потоков.
+
+    Получатели каждого домена делятся на серии по DOMAIN_SLICE_SIZE.
+    Серию целиком отправляет один поток через свое соединение, так что
+    соединение на все время серии занято одним доменом. Одновременно
+    в работе не больше workers * 2 серий, а серий одного домена - не больше,
+    чем ограничитель разрешает одновременных отправок в этот домен: иначе
+    потоки пула ждали бы в throttle.acquire медленный домен, пока письма
+    в остальные домены стоят в очереди.
+    После stop новые серии не запускаются, запущенные прерываются между
+    письмами, а результаты уже отправленных писем отдаются до выхода.
+    """
+    local = threading.local()
+    connections = []
+    connections_lock = threading.Lock()
+
+    def send_slice(recipients):
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            connection = local.connection = MailConnection()
+            with connections_lock:
+                connections.append(connection)
+        return send_group(connection, prepared, recipients, throttle, stop)
+
+    # Серия кратна размеру пакета, чтобы не дробить транзакции
+    size = max(DOMAIN_SLICE_SIZE // prepared.envelope_batch, 1) * prepared.envelope_batch
+    # Серии, еще не отданные пулу, по доменам в порядке buckets
+    queued = [
+        (domain, deque(recipients[start:start + size] for start in range(0, len(recipients), size)))
+        for domain, recipients in buckets
+    ]
+    running = Counter()
+
+    def next_slice():
+        """Серия первого домена, у которого есть свободный слот ограничителя"""
+        for domain, slices in queued:
+            limit = throttle.domain_concurrency(domain) if throttle is not None else workers * 2
+            if slices and running[domain] < limit:
+                running[domain] += 1
+                return domain, slices.popleft()
+        return None, None
+
+    # future -> домен серии
+    in_flight = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                while len(in_flight) < workers * 2 and not (stop is not None and stop.is_set()):
+                    domain, recipients = next_slice()
+                    if recipients is None:
+                        break
+                    in_flight[executor.submit(send_slice, recipients)] = domain
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running[in_flight.pop(future)] -= 1
+                    yield from future.result()
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def deliver_mailing(mailing, on_result=None, attempts=None, workers=1,
+                    engine='sync', concurrency=None, recipients=None, job=None,
+                    domain_counts=None, envelope_batch=None):
+    """Отправка рассылки всем получателям.
+
+    При workers > 1 письма рассылаются пулом потоков, каждый поток держит
+    свое SMTP-соединение. engine='async' включает асинхронный движок,
+    в котором до concurrency SMTP-сессий обслуживаются одним циклом событий.
+    Получатели группируются по доменам, и письма одного домена идут
+    подряд через одно соединение.
+    Результаты записываются только из вызывающего потока, поэтому итоги
+    не зависят ни от движка, ни от числа потоков. Если включено
+    ограничение MAILING_THROTTLE, скорость отправки в каждый домен
+    подстраивается под ответы его серверов.
+
+    on_result(recipient, success, response) вызывается после каждого письма.
+    attempts - общий AttemptBuffer, если не передан, создается свой.
+    recipients - подмножество получателей, по умолчанию все получатели рассылки.
+    job - задание DeliveryJob, для которого вместе с попытками пишутся отметки.
+    domain_counts - словарь (например, Counter), в который добавляется
+    число получателей по доменам.
+    envelope_batch - сколько получателей одного домена отправлять одной
+    SMTP-транзакцией (по умолчанию MAILING_ENVELOPE_BATCH).
+    Если выставлен stop_requested или on_result бросил исключение
+    (например, LeaseLost), движок перестает брать новые письма, попытки
+    уже отправленных писем дописываются в буфер, и только потом
+    поднимается DeliveryStopped или исключение on_result.
+    Возвращает кортеж (успешно, неудачно).
+    """
+    # Сообщение кодируется в MIME один раз на всю отправку
+    prepared = PreparedMessage(mailing.message, envelope_batch)
+    if recipients is None:
+        recipients = mailing.recipients.all()
+    buckets = group_by_domain(recipients)
+    if domain_counts is not None:
+        for domain, bucket in buckets:
+            domain_counts[domain] = domain_counts.get(domain, 0) + len(bucket)
+    success_count = 0
+    fail_count = 0
+    throttle = get_throttle()
+
+    own_buffer = attempts is None
+    if own_buffer:
+        attempts = AttemptBuffer()
+
+    # Остановка движка: новые письма не отправляются, а результаты уже
+    # начатых отправок дочитываются, чтобы ни одно письмо не осталось без попытки
+    stop = threading.Event()
+    if engine == 'async':
+        from .async_delivery import send_async
+        results = send_async(prepared, buckets, concurrency, throttle, stop)
+    elif workers > 1:
+        results = send_parallel(prepared, buckets, workers, throttle, stop)
+    else:
+        results = send_sequential(prepared, buckets, throttle, stop)
+
+    error = None
+    try:
+        for recipient, success, response in results:
+            if success:
+                success_count += 1
+            else:
+                fail_count += 1
+
+            attempts.add(mailing.pk, recipient.pk, success, response, job_id=job.pk if job else None)
+            if error is not None:
+                continue
+            try:
+                if on_result is not None:
+                    on_result(recipient, success, response)
+            except Exception as e:
+                error = e
+            else:
+                if stop_requested.is_set():
+                    error = DeliveryStopped(f'Рассылка #{mailing.pk}: отправка остановлена')
+            if error is not None:
+                stop.set()
+    finally:
+        results.close()
+        if own_buffer:
+            attempts.flush()
+    if error is not None:
+        raise error
+    return success_count, fail_count
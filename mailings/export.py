@@ -0,0 +1,65 @@
+"""Выгрузка журнала попыток рассылок в CSV и JSON Lines.
+
+Строки читаются из БД частями через iterator(chunk_size) в виде
+кортежей values_list и сразу превращаются в текст, поэтому память
+не растет с числом выгружаемых попыток. Генераторы подходят и для
+StreamingHttpResponse, и для записи в файл из команды.
+"""
+import csv
+import json
+
+from django.utils import timezone
+
+
+# Колонка выгрузки -> поле для values_list
+COLUMNS = [
+    ('id', 'pk'),
+    ('attempt_time', 'attempt_time'),
+    ('mailing_id', 'mailing_id'),
+    ('subject', 'mailing__message__subject'),
+    ('recipient', 'recipient__email'),
+    ('status', 'status'),
+    ('server_response', 'server_response'),
+]
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+CHUNK_SIZE = 2000
+
+
+class Echo:
+    """Псевдофайл для csv.writer: write() возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def attempt_rows(attempts, chunk_size=CHUNK_SIZE):
+    """Кортежи попыток в порядке времени, время - в текущем часовом поясе"""
+    rows = attempts.order_by('attempt_time', 'pk').values_list(
+        *(lookup for _, lookup in COLUMNS)
+    ).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield row[:1] + (timezone.localtime(row[1]).isoformat(),) + row[2:]
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, _ in COLUMNS])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows):
+    names = [name for name, _ in COLUMNS]
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n'
+
+
+def export_lines(attempts, format='csv', chunk_size=CHUNK_SIZE):
+    """Строки выгрузки попыток в формате csv или jsonl"""
+    rows = attempt_rows(attempts, chunk_size)
+    return jsonl_lines(rows) if format == 'jsonl' else csv_lines(rows)
@@ -1,5 +1,10 @@
+from datetime import datetime, time, timedelta
+
 from django import forms
-from .models import Recipient, Message, Mailing
+from django.db.models import Q
+from django.utils import timezone
+from .models import Recipient, Message, Mailing, MailingAttempt
+from .personalization import FIELDS, unknown_placeholders
 
 
 class RecipientForm(forms.ModelForm):
@@ -13,6 +18,21 @@ class RecipientForm(forms.ModelForm):
         }
 
 
+class RecipientImportForm(forms.Form):
+    """Загрузка получателей из CSV-файла"""
+    file = forms.FileField(
+        label='CSV-файл',
+        help_text='Первая строка - названия колонок: email, full_name, comment. '
+                  'Разделитель - запятая или точка с запятой, кодировка UTF-8.',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,text/csv'})
+    )
+    update_existing = forms.BooleanField(
+        required=False,
+        label='Обновить Ф. И. О. и комментарий у уже добавленных получателей',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
+
+
 class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
@@ -21,6 +41,27 @@ class MessageForm(forms.ModelForm):
             'subject': forms.TextInput(attrs={'class': 'form-control'}),
             'body': forms.Textarea(attrs={'class': 'form-control', 'rows': 5}),
         }
+        help_texts = {
+            'body': 'Можно использовать подстановки {full_name} и {email} - '
+                    'они заменятся данными получателя.',
+        }
+
+    def clean_placeholders(self, field):
+        value = self.cleaned_data.get(field)
+        unknown = unknown_placeholders(value or '')
+        if unknown:
+            allowed = ', '.join(f'{{{name}}}' for name in FIELDS)
+            raise forms.ValidationError(
+                f'Неизвестные подстановки: {", ".join(f"{{{name}}}" for name in unknown)}. '
+                f'Доступны: {allowed}.'
+            )
+        return value
+
+    def clean_subject(self):
+        return self.clean_placeholders('subject')
+
+    def clean_body(self):
+        return self.clean_placeholders('body')
 
 
 class MailingForm(forms.ModelForm):
@@ -48,7 +89,6 @@ class MailingForm(forms.ModelForm):
         end_time = cleaned_data.get('end_time')
 
         if start_time and end_time:
-            from django.utils import timezone
             now = timezone.now()
 
             # Проверка: start_time не может быть в прошлом
@@ -64,3 +104,93 @@ class MailingForm(forms.ModelForm):
                 })
 
         return cleaned_data
+
+
+class StatisticsFilterForm(forms.Form):
+    """Период для отчета по попыткам рассылок"""
+    date_from = forms.DateField(
+        required=False,
+        label='С',
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    date_to = forms.DateField(
+        required=False,
+        label='По',
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError({
+                'date_to': 'Дата окончания периода должна быть не раньше даты начала.'
+            })
+        return cleaned_data
+
+    def bounds(self):
+        """Границы периода (начало, конец) как моменты времени, None - без границы"""
+        if not self.is_valid():
+            return None, None
+        date_from = self.cleaned_data.get('date_from')
+        date_to = self.cleaned_data.get('date_to')
+        current_timezone = timezone.get_current_timezone()
+        start = end = None
+        if date_from:
+            start = datetime.combine(date_from, time.min, tzinfo=current_timezone)
+        if date_to:
+            # Последний день периода входит целиком
+            end = datetime.combine(date_to + timedelta(days=1), time.min, tzinfo=current_timezone)
+        return start, end
+
+    def attempt_filter(self, prefix=''):
+        """Условие Q на время попытки; prefix - путь до попытки, например 'attempts__'"""
+        start, end = self.bounds()
+        condition = Q()
+        if start:
+            condition &= Q(**{f'{prefix}attempt_time__gte': start})
+        if end:
+            condition &= Q(**{f'{prefix}attempt_time__lt': end})
+        return condition
+
+
+class AttemptFilterForm(forms.Form):
+    """Фильтры списка попыток рассылок"""
+    status = forms.ChoiceField(
+        required=False,
+        label='Статус',
+        choices=[('', 'Все')] + MailingAttempt.STATUS_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    mailing = forms.ModelChoiceField(
+        required=False,
+        label='Рассылка',
+        queryset=Mailing.objects.none(),
+        empty_label='Все',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    recipient = forms.EmailField(
+        required=False,
+        label='Email получателя',
+        widget=forms.EmailInput(attrs={'class': 'form-control'})
+    )
+
+    def __init__(self, *args, mailings=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if mailings is None:
+            del self.fields['mailing']
+        else:
+            self.fields['mailing'].queryset = mailings.select_related('message')
+
+    def filter(self, attempts):
+        """Применить заполненные фильтры к QuerySet попыток"""
+        if not self.is_valid():
+            return attempts
+        if self.cleaned_data.get('status'):
+            attempts = attempts.filter(status=self.cleaned_data['status'])
+        if self.cleaned_data.get('mailing'):
+            attempts = attempts.filter(mailing=self.cleaned_data['mailing'])
+        if self.cleaned_data.get('recipient'):
+            attempts = attempts.filter(recipient__email=self.cleaned_data['recipient'])
+        return attempts
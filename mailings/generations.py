@@ -0,0 +1,98 @@
+"""Кеш результатов запросов с поколениями по владельцам.
+
+У каждого владельца в кеше есть номер поколения. Любое изменение его
+получателей, сообщений, рассылок или попыток увеличивает номер, и все
+закешированные для него результаты перестают находиться: номер входит
+в ключ. Старые записи не удаляются, а просто истекают. Кеш менеджеров
+(scope=ALL) зависит от общего поколения, которое растет при изменении
+данных любого владельца.
+
+Поколения увеличиваются сигналами (mailings.signals) и явно там, где
+сигналов нет: bulk_create и update() (попытки, загрузка получателей,
+пересчет статусов и счетчиков). Увеличение откладывается до фиксации
+транзакции, чтобы никто не закешировал под новым номером старые данные.
+
+Поколения работают, только если кеш общий для всех процессов (Redis):
+попытки пишут send_mailings и обработчики очереди, а не веб-сервер.
+С локальным кешем cached() ничего не кеширует (RESULT_CACHE_ENABLED).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .roles import get_roles
+
+
+# Область кеша для данных всех владельцев
+ALL = 'all'
+
+EPOCH_KEY = 'generation:epoch'
+
+
+def generation_key(scope):
+    return f'generation:{scope}'
+
+
+def initial_generation():
+    # Номер от времени, а не 1: после вытеснения счетчика из кеша он не
+    # совпадет с номером, под которым еще лежат старые результаты
+    return time.time_ns() // 1000
+
+
+def scope_of(request):
+    """Область кеша пользователя: все данные для менеджеров, иначе свои"""
+    return ALL if get_roles(request).can_view_all else request.user.pk
+
+
+def current(scope):
+    """Пара (эпоха, поколение области) для ключа кеша"""
+    keys = [EPOCH_KEY, generation_key(scope)]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, initial_generation(), None)
+            values[key] = cache.get(key)
+    return values[EPOCH_KEY], values[generation_key(scope)]
+
+
+def increment(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, initial_generation(), None)
+
+
+def bump(owner_ids):
+    """Сделать устаревшим кеш владельцев (и общий) после фиксации транзакции"""
+    owner_ids = {owner_id for owner_id in owner_ids if owner_id is not None}
+
+    def apply():
+        for owner_id in owner_ids:
+            increment(generation_key(owner_id))
+        increment(generation_key(ALL))
+
+    transaction.on_commit(apply)
+
+
+def bump_all():
+    """Сделать устаревшим весь кеш - для массовых изменений по всем владельцам"""
+    transaction.on_commit(lambda: increment(EPOCH_KEY))
+
+
+def cached(scope, name, compute, timeout=None):
+    """Результат compute() из кеша области scope или вычисленный и сохраненный.
+
+    Без RESULT_CACHE_ENABLED (по умолчанию при локальном кеше) результат
+    всегда вычисляется заново.
+    """
+    if not settings.RESULT_CACHE_ENABLED:
+        return compute()
+    epoch, generation = current(scope)
+    key = f'result:{name}:{scope}:{epoch}:{generation}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, settings.RESULT_CACHE_SECONDS if timeout is None else timeout)
+    return value
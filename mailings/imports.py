@@ -0,0 +1,156 @@
+"""Загрузка получателей из CSV.
+
+Файл читается построчно, строки собираются в пачки по batch_size
+и записываются одним bulk_create на пачку, поэтому память не зависит
+от размера файла. Повторы по (email, владелец) отсекает уникальный
+индекс: существующие получатели пропускаются или обновляются.
+"""
+import csv
+from itertools import chain
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+
+from .generations import bump
+from .models import Recipient
+
+
+# Колонки файла; email обязательна, остальные могут отсутствовать
+COLUMNS = ('email', 'full_name', 'comment')
+
+# Сколько отклоненных строк хранить в отчете; считаются все
+REJECTED_SAMPLE = 100
+
+FULL_NAME_MAX_LENGTH = Recipient._meta.get_field('full_name').max_length
+
+
+class ImportFileError(ValueError):
+    """Файл нельзя разобрать как CSV с получателями"""
+
+    def __init__(self, message, report=None):
+        super().__init__(message)
+        self.report = report
+
+
+class ImportReport:
+    """Итоги загрузки"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.rejected = 0
+        # Первые REJECTED_SAMPLE отклоненных строк: (номер строки, email, причина)
+        self.rejected_rows = []
+
+    def reject(self, line, email, reason):
+        self.rejected += 1
+        if len(self.rejected_rows) < REJECTED_SAMPLE:
+            self.rejected_rows.append((line, email, reason))
+
+
+def normalize_email(value):
+    """Email без пробелов по краям и с доменом в нижнем регистре"""
+    local, at, domain = value.strip().rpartition('@')
+    return f'{local}@{domain.lower()}' if at else value.strip()
+
+
+def read_rows(lines):
+    """Пары (номер строки, {колонка: значение}) из строк CSV.
+
+    Первая строка - заголовок. Разделитель - запятая или точка с запятой
+    (так сохраняет CSV русский Excel), выбирается по заголовку.
+    """
+    lines = iter(lines)
+    header = next(lines, '')
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    reader = csv.reader(chain([header], lines), delimiter=delimiter)
+    columns = [name.strip().lower() for name in next(reader, [])]
+    if 'email' not in columns:
+        raise ImportFileError('В первой строке файла должны быть названия колонок, среди них email')
+    for values in reader:
+        if any(value.strip() for value in values):
+            yield reader.line_num, dict(zip(columns, values))
+
+
+def clean_row(values):
+    """Поля получателя (email, ф. и. о., комментарий) или ValidationError"""
+    email = normalize_email(values.get('email') or '')
+    full_name = (values.get('full_name') or '').strip()
+    comment = (values.get('comment') or '').strip()
+    if not email:
+        raise ValidationError('не указан email')
+    validate_email(email)
+    if not full_name:
+        raise ValidationError('не указаны Ф. И. О.')
+    if len(full_name) > FULL_NAME_MAX_LENGTH:
+        raise ValidationError(f'Ф. И. О. длиннее {FULL_NAME_MAX_LENGTH} символов')
+    return email, full_name, comment
+
+
+def save_batch(owner, batch, update_existing, report):
+    """Записать пачку {email: Recipient} одним запросом"""
+    existing = set(
+        Recipient.objects.filter(owner=owner, email__in=list(batch)).values_list('email', flat=True)
+    )
+    if update_existing:
+        Recipient.objects.bulk_create(
+            batch.values(),
+            update_conflicts=True,
+            unique_fields=['email', 'owner'],
+            update_fields=['full_name', 'comment', 'updated_at']
+        )
+        report.updated += len(existing)
+    else:
+        # ignore_conflicts - на случай, если получателя добавили после проверки
+        Recipient.objects.bulk_create(
+            [recipient for email, recipient in batch.items() if email not in existing],
+            ignore_conflicts=True
+        )
+        report.skipped += len(existing)
+    report.created += len(batch) - len(existing)
+    bump([owner.pk])
+
+
+def import_recipients(owner, lines, batch_size=500, update_existing=False, on_batch=None, on_reject=None):
+    """Загрузить получателей владельца owner из строк CSV.
+
+    Существующие получатели пропускаются, а с update_existing у них
+    обновляются Ф. И. О. и комментарий. Повтор email в одной пачке
+    считается пропуском, в данных остается последняя строка.
+    on_batch(report) вызывается после каждой записанной пачки,
+    on_reject(номер строки, значения, причина) - для каждой отклоненной
+    строки. Возвращает ImportReport.
+    """
+    report = ImportReport()
+    batch = {}
+    line = 1
+    try:
+        for line, values in read_rows(lines):
+            report.rows += 1
+            try:
+                email, full_name, comment = clean_row(values)
+            except ValidationError as error:
+                reason = '; '.join(error.messages)
+                report.reject(line, values.get('email', ''), reason)
+                if on_reject:
+                    on_reject(line, values, reason)
+                continue
+            if email in batch:
+                report.skipped += 1
+            batch[email] = Recipient(email=email, full_name=full_name, comment=comment, owner=owner)
+            if len(batch) >= batch_size:
+                save_batch(owner, batch, update_existing, report)
+                batch = {}
+                if on_batch:
+                    on_batch(report)
+    except (UnicodeDecodeError, csv.Error) as error:
+        raise ImportFileError(
+            f'Не удалось прочитать файл после строки {line}: нужен CSV в кодировке UTF-8', report
+        ) from error
+    if batch:
+        save_batch(owner, batch, update_existing, report)
+        if on_batch:
+            on_batch(report)
+    return report
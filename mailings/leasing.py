@@ -0,0 +1,62 @@
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+class LeaseLost(Exception):
+    """Аренда истекла и строку забрал другой обработчик"""
+
+
+def lease_is_free(now):
+    return Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+
+
+def claim(queryset, owner, lease_seconds, limit=1):
+    """Взять в аренду до limit свободных строк из queryset.
+
+    Модель должна иметь поля lease_owner и lease_expires_at. Свободны строки
+    без аренды и с истекшей арендой, так что строки упавших обработчиков
+    возвращаются в работу сами. На PostgreSQL строки выбираются через
+    SELECT ... FOR UPDATE SKIP LOCKED, на SQLite каждая строка захватывается
+    условным UPDATE по сроку аренды. Возвращает список id захваченных строк.
+    """
+    model = queryset.model
+    now = timezone.now()
+    expires = now + timezone.timedelta(seconds=lease_seconds)
+    candidates = queryset.filter(lease_is_free(now))
+
+    if connection.features.has_select_for_update_skip_locked:
+        # Блокируем только строки самой модели, а не связанные через фильтры таблицы
+        of = ('self',) if connection.features.has_select_for_update_of else ()
+        with transaction.atomic():
+            ids = list(
+                candidates.select_for_update(skip_locked=True, of=of).values_list('pk', flat=True)[:limit]
+            )
+            model.objects.filter(pk__in=ids).update(lease_owner=owner, lease_expires_at=expires)
+        return ids
+
+    ids = []
+    for pk in candidates.values_list('pk', flat=True)[:limit * 4]:
+        updated = model.objects.filter(lease_is_free(now), pk=pk).update(
+            lease_owner=owner,
+            lease_expires_at=expires
+        )
+        if updated:
+            ids.append(pk)
+            if len(ids) >= limit:
+                break
+    return ids
+
+
+def renew(model, pk, owner, lease_seconds):
+    """Продлить аренду, если она все еще наша. Иначе поднять LeaseLost."""
+    now = timezone.now()
+    updated = model.objects.filter(pk=pk, lease_owner=owner, lease_expires_at__gte=now).update(
+        lease_expires_at=now + timezone.timedelta(seconds=lease_seconds)
+    )
+    if not updated:
+        raise LeaseLost(f'{model.__name__} #{pk}: аренда потеряна')
+
+
+def release(model, pk, owner):
+    model.objects.filter(pk=pk, lease_owner=owner).update(lease_owner='', lease_expires_at=None)
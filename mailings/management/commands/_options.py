@@ -0,0 +1,59 @@
+"""Общие параметры команд, отправляющих рассылки"""
+from django.conf import settings
+from django.core.management.base import CommandError
+from mailings.prepared import SMTP_BACKEND
+
+
+def add_delivery_arguments(parser):
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=None,
+        help='Сколько попыток рассылки записывать в БД одной транзакцией',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Число потоков отправки, у каждого свое SMTP-соединение',
+    )
+    parser.add_argument(
+        '--engine',
+        choices=['sync', 'async'],
+        default='sync',
+        help='Движок отправки: блокирующий (sync) или asyncio (async)',
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=None,
+        help='Число одновременных SMTP-сессий для --engine=async',
+    )
+    parser.add_argument(
+        '--envelope-batch',
+        type=int,
+        default=None,
+        help='Сколько получателей одного домена отправлять одной SMTP-транзакцией '
+             '(только для сообщений без подстановок)',
+    )
+
+
+def delivery_options(options):
+    """Параметры для deliver_mailing из разобранных аргументов команды"""
+    if options['engine'] == 'async' and settings.EMAIL_BACKEND != SMTP_BACKEND:
+        raise CommandError('Асинхронный движок работает только с SMTP-бэкендом')
+    return {
+        'workers': options['workers'],
+        'engine': options['engine'],
+        'concurrency': options['concurrency'],
+        'envelope_batch': options['envelope_batch'],
+    }
+
+
+def domain_summary(domain_counts, limit=5):
+    """Строка с крупнейшими доменами получателей для итогов команды"""
+    top = sorted(domain_counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    summary = ', '.join(f'{domain}: {count}' for domain, count in top)
+    if len(domain_counts) > limit:
+        summary += f' и еще {len(domain_counts) - limit} доменов'
+    return summary
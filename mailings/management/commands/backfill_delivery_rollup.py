@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from mailings.rollups import backfill
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобрать почасовые итоги попыток рассылок по таблице попыток. '
+        'Запускать, когда отправка не идет: попытки, записанные во время '
+        'пересборки, могут быть учтены дважды'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help='Сколько попыток обрабатывать за один проход',
+        )
+
+    def handle(self, *args, **options):
+        chunks = 0
+        for last_id in backfill(options['chunk_size']):
+            chunks += 1
+            self.stdout.write(f'  обработаны попытки до id {last_id}')
+        self.stdout.write(self.style.SUCCESS(f'Итоги пересобраны, проходов: {chunks}'))
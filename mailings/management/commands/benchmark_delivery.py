@@ -0,0 +1,85 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from mailings.async_delivery import send_async
+from mailings.delivery import group_by_domain, send_parallel, send_sequential
+from mailings.models import Message, Recipient
+from mailings.prepared import SMTP_BACKEND, PreparedMessage, build_email
+from mailings.smtp_server import LocalSMTPServer
+
+
+class Command(BaseCommand):
+    help = 'Сравнение движков отправки на локальном SMTP-сервере (без сети и БД)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=200, help='Число писем')
+        parser.add_argument(
+            '--latency', type=float, default=20,
+            help='Задержка ответа сервера в миллисекундах',
+        )
+        parser.add_argument('--workers', type=int, default=8, help='Потоков для пула')
+        parser.add_argument(
+            '--concurrency', type=int, default=100,
+            help='SMTP-сессий для асинхронного движка',
+        )
+        parser.add_argument(
+            '--envelope-batch', type=int, default=1,
+            help='Получателей одного домена на одну SMTP-транзакцию',
+        )
+
+    def handle(self, *args, **options):
+        message = Message(subject='Проверка скорости', body='Тестовое письмо\n' * 200)
+        recipients = [
+            Recipient(email=f'user{i}@domain{i % 10}.example', full_name=f'Получатель {i}')
+            for i in range(options['recipients'])
+        ]
+        buckets = group_by_domain(recipients)
+        engines = [
+            ('sync', lambda prepared: send_sequential(prepared, buckets)),
+            (f'sync, {options["workers"]} потоков',
+             lambda prepared: send_parallel(prepared, buckets, options['workers'])),
+            (f'async, {options["concurrency"]} сессий',
+             lambda prepared: send_async(prepared, buckets, options['concurrency'])),
+        ]
+
+        # Сборка писем без отправки: EmailMessage на каждого получателя
+        # против общих байтов PreparedMessage
+        started = time.perf_counter()
+        for recipient in recipients:
+            build_email(message.subject, message.body, recipient.email).message().as_bytes(linesep='\r\n')
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        prepared = PreparedMessage(message)
+        for recipient in recipients:
+            prepared.build_raw(recipient).pieces()
+        reused = time.perf_counter() - started
+        self.stdout.write(
+            f'Сборка писем: EmailMessage {built * 1000:.1f} мс, '
+            f'PreparedMessage {reused * 1000:.1f} мс'
+        )
+
+        with LocalSMTPServer(latency=options['latency'] / 1000) as server:
+            with override_settings(
+                EMAIL_BACKEND=SMTP_BACKEND,
+                EMAIL_HOST=server.host,
+                EMAIL_PORT=server.port,
+                EMAIL_USE_TLS=False,
+                EMAIL_USE_SSL=False,
+                EMAIL_HOST_USER='',
+                EMAIL_HOST_PASSWORD='',
+            ):
+                prepared = PreparedMessage(message, options['envelope_batch'])
+                for name, run in engines:
+                    started = time.perf_counter()
+                    failed = sum(1 for _, success, _ in run(prepared) if not success)
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f'{name}: {elapsed:.2f} с, '
+                        f'{len(recipients) / elapsed:.0f} писем/с, ошибок: {failed}'
+                    )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Сервер принял писем: {server.messages}, сессий: {server.sessions}'
+                )
+            )
@@ -0,0 +1,86 @@
+import time
+from collections import namedtuple
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Engine
+from mailings.personalization import compile_template
+
+
+# Легкая замена Recipient: у шаблона те же поля, но без накладных расходов модели
+Row = namedtuple('Row', ['full_name', 'email'])
+
+SUBJECT = '{full_name}, для вас персональное предложение'
+BODY = (
+    'Здравствуйте, {full_name}!\n\n'
+    'Письмо отправлено на адрес {email}. Скидка 10% действует до конца месяца.\n'
+    + 'Текст письма без подстановок.\n' * 20
+)
+
+
+def as_django_template(text):
+    return text.replace('{full_name}', '{{ full_name }}').replace('{email}', '{{ email }}')
+
+
+class Command(BaseCommand):
+    help = 'Замер стоимости подстановки данных получателя в тему и текст сообщения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=1000000,
+            help='Число получателей',
+        )
+        parser.add_argument(
+            '--compare', type=int, default=10000,
+            help='На скольких получателях замерить шаблонизатор Django для сравнения (0 - не замерять)',
+        )
+        parser.add_argument(
+            '--batch', type=int, default=10000,
+            help='Сколько получателей создавать за раз, чтобы не держать в памяти все',
+        )
+
+    def rows(self, count, batch):
+        for start in range(0, count, batch):
+            yield [
+                Row(f'Получатель {i}', f'user{i}@example.com')
+                for i in range(start, min(start + batch, count))
+            ]
+
+    def handle(self, *args, **options):
+        count = options['count']
+
+        started = time.perf_counter()
+        subject = compile_template(SUBJECT)
+        body = compile_template(BODY)
+        compiled = time.perf_counter() - started
+
+        elapsed = 0.0
+        for rows in self.rows(count, options['batch']):
+            started = time.perf_counter()
+            for row in rows:
+                subject.render(row)
+                body.render(row)
+            elapsed += time.perf_counter() - started
+        self.stdout.write(
+            f'Разбор шаблонов: {compiled * 1e6:.0f} мкс (один раз на рассылку)'
+        )
+        self.stdout.write(
+            f'Подстановка для {count} получателей: {elapsed:.2f} с, '
+            f'{elapsed / count * 1e9:.0f} нс на получателя'
+        )
+
+        compare = min(options['compare'], count)
+        if compare:
+            engine = Engine()
+            started = time.perf_counter()
+            for rows in self.rows(compare, options['batch']):
+                for row in rows:
+                    context = Context(row._asdict())
+                    engine.from_string(as_django_template(SUBJECT)).render(context)
+                    engine.from_string(as_django_template(BODY)).render(context)
+            django_elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'Шаблонизатор Django с разбором на каждое письмо ({compare} получателей): '
+                f'{django_elapsed / compare * 1e9:.0f} нс на получателя'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from mailings.models import Mailing, Message, Recipient
+from mailings.roles import MANAGERS_GROUP
 
 
 class Command(BaseCommand):
@@ -9,7 +10,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         # Создаем или получаем группу
-        group, created = Group.objects.get_or_create(name='Менеджеры')
+        group, created = Group.objects.get_or_create(name=MANAGERS_GROUP)
 
         if created:
             self.stdout.write(self.style.SUCCESS('Группа "Менеджеры" создана'))
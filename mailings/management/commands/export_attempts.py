@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from mailings.export import CHUNK_SIZE, FORMATS, export_lines
+from mailings.forms import StatisticsFilterForm
+from mailings.models import MailingAttempt
+
+
+class Command(BaseCommand):
+    help = 'Выгрузить журнал попыток рассылок в CSV или JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=sorted(FORMATS),
+            default='csv',
+            help='Формат выгрузки',
+        )
+        parser.add_argument(
+            '--mailing',
+            type=int,
+            action='append',
+            help='ID рассылки (можно указать несколько раз)',
+        )
+        parser.add_argument(
+            '--date-from',
+            help='Начало периода, ГГГГ-ММ-ДД',
+        )
+        parser.add_argument(
+            '--date-to',
+            help='Конец периода включительно, ГГГГ-ММ-ДД',
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для выгрузки (по умолчанию - стандартный вывод)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Сколько строк читать из БД за раз',
+        )
+
+    def handle(self, *args, **options):
+        period = StatisticsFilterForm({'date_from': options['date_from'], 'date_to': options['date_to']})
+        if not period.is_valid():
+            raise CommandError(f'Неверный период: {period.errors.as_text()}')
+
+        attempts = MailingAttempt.objects.filter(period.attempt_filter())
+        if options['mailing']:
+            attempts = attempts.filter(mailing_id__in=options['mailing'])
+
+        lines = export_lines(attempts, options['format'], options['chunk_size'])
+        if options['output']:
+            count = 0
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for line in lines:
+                    output.write(line)
+                    count += 1
+            if options['format'] == 'csv':
+                count -= 1  # строка заголовков
+            self.stderr.write(self.style.SUCCESS(f'Выгружено попыток: {count} в {options["output"]}'))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,91 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from mailings.imports import ImportFileError, import_recipients
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Загрузить получателей владельца из CSV-файла (колонки email, full_name, comment)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='CSV-файл в кодировке UTF-8, "-" - стандартный ввод',
+        )
+        parser.add_argument(
+            '--owner',
+            required=True,
+            help='Email владельца получателей',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько получателей записывать в БД одним запросом',
+        )
+        parser.add_argument(
+            '--update-existing',
+            action='store_true',
+            help='Обновить Ф. И. О. и комментарий у уже добавленных получателей',
+        )
+        parser.add_argument(
+            '--rejects',
+            help='Записать отклоненные строки в CSV-файл (номер строки, причина, исходные значения)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(email=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {options["owner"]} не найден')
+
+        if options['path'] == '-':
+            source = open(sys.stdin.fileno(), encoding='utf-8-sig', newline='', closefd=False)
+        else:
+            try:
+                source = open(options['path'], encoding='utf-8-sig', newline='')
+            except OSError as error:
+                raise CommandError(f'Не удалось открыть файл: {error}')
+
+        rejects = open(options['rejects'], 'w', encoding='utf-8', newline='') if options['rejects'] else None
+        on_reject = None
+        if rejects:
+            writer = csv.writer(rejects)
+            writer.writerow(['line', 'reason', 'email', 'full_name', 'comment'])
+
+            def on_reject(line, values, reason):
+                writer.writerow([line, reason] + [values.get(column, '') for column in ('email', 'full_name', 'comment')])
+
+        def on_batch(report):
+            self.stdout.write(
+                f'  строк: {report.rows}, добавлено: {report.created}, обновлено: {report.updated}, '
+                f'пропущено: {report.skipped}, отклонено: {report.rejected}'
+            )
+
+        try:
+            with source:
+                report = import_recipients(
+                    owner, source,
+                    batch_size=options['batch_size'],
+                    update_existing=options['update_existing'],
+                    on_batch=on_batch,
+                    on_reject=on_reject
+                )
+        except ImportFileError as error:
+            raise CommandError(str(error))
+        finally:
+            if rejects:
+                rejects.close()
+
+        for line, email, reason in report.rejected_rows[:10]:
+            self.stdout.write(f'  строка {line} ({email}): {reason}')
+        if report.rejected > 10:
+            self.stdout.write(f'  ... и еще {report.rejected - 10} отклоненных строк')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Загрузка завершена: добавлено {report.created}, обновлено {report.updated}, '
+                f'пропущено {report.skipped}, отклонено {report.rejected}'
+            )
+        )
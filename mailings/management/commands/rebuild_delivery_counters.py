@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from mailings.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитать счетчики попыток рассылок и владельцев по таблице попыток. '
+        'Лучше запускать, когда отправка не идет: попытки, записанные во время '
+        'пересчета, могут не попасть в счетчики владельцев'
+    )
+
+    def handle(self, *args, **options):
+        drifted, owners = rebuild_counters()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Счетчики пересчитаны. Рассылок с расхождением: {drifted}, владельцев: {owners}'
+            )
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from mailings.models import Mailing
+
+
+class Command(BaseCommand):
+    help = (
+        'Привести сохраненные статусы рассылок к текущему времени одним UPDATE. '
+        'Планировщик и send_mailings делают это сами, команда нужна, если они не запущены'
+    )
+
+    def handle(self, *args, **options):
+        count = Mailing.objects.reconcile_status()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено статусов рассылок: {count}'))
@@ -0,0 +1,68 @@
+import signal
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from mailings.delivery import AttemptBuffer, DeliveryStopped, stop_requested
+from mailings.leasing import LeaseLost
+from mailings.outbox import claim_chunk, process_chunk, worker_name
+
+from ._options import add_delivery_arguments, delivery_options, domain_summary
+
+
+class Command(BaseCommand):
+    help = 'Обработчик очереди заданий на отправку рассылок'
+
+    def add_arguments(self, parser):
+        add_delivery_arguments(parser)
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=5,
+            help='Пауза в секундах между проверками пустой очереди',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать текущую очередь и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        delivery = delivery_options(options)
+        worker = worker_name()
+
+        # По SIGTERM только ставим флаг: начатые отправки дописываются в буфер попыток,
+        # новые не начинаются (см. delivery.stop_requested)
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_requested.set())
+
+        self.stdout.write(f'Обработчик {worker} запущен')
+        while not stop_requested.is_set():
+            chunk = claim_chunk(worker)
+            if chunk is None:
+                if options['once']:
+                    break
+                stop_requested.wait(options['poll'])
+                continue
+
+            self.stdout.write(
+                f'Задание #{chunk.job_id}, рассылка #{chunk.job.mailing_id}: '
+                f'получатели {chunk.first_recipient_id}-{chunk.last_recipient_id}'
+            )
+            domains = Counter()
+            try:
+                with AttemptBuffer(options['batch_size']) as attempts:
+                    success_count, fail_count = process_chunk(
+                        chunk, worker, attempts=attempts, domain_counts=domains, **delivery
+                    )
+            except LeaseLost as e:
+                self.stdout.write(self.style.WARNING(str(e)))
+                continue
+            except DeliveryStopped as e:
+                # Часть остается арендованной, ее дошлет другой обработчик после истечения аренды
+                self.stdout.write(self.style.WARNING(str(e)))
+                break
+
+            self.stdout.write(
+                self.style.SUCCESS(f'Успешно: {success_count}, Неудачно: {fail_count}')
+            )
+            if domains:
+                self.stdout.write(f'  Домены: {domain_summary(domains)}')
@@ -0,0 +1,88 @@
+import signal
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from mailings.delivery import AttemptBuffer, DeliveryStopped, stop_requested
+from mailings.leasing import LeaseLost
+from mailings.outbox import dispatch_mailing, enqueue_mailing, worker_name
+from mailings.scheduler import MailingScheduler
+
+from ._options import add_delivery_arguments, delivery_options, domain_summary
+
+
+class Command(BaseCommand):
+    help = 'Постоянно работающий планировщик рассылок (замена запуску send_mailings из cron)'
+
+    def add_arguments(self, parser):
+        add_delivery_arguments(parser)
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=30,
+            help='Период опроса БД в секундах на случай пропущенных изменений',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='Повторять активную рассылку каждые N секунд (по умолчанию отправляется один раз)',
+        )
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Не отправлять самому, а ставить рассылки в очередь для run_delivery_worker',
+        )
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=60,
+            help='На сколько секунд узел арендует рассылку перед отправкой',
+        )
+
+    def handle(self, *args, **options):
+        delivery = delivery_options(options)
+        worker = worker_name()
+
+        def dispatch(mailing):
+            if options['enqueue']:
+                job, created = enqueue_mailing(mailing)
+                self.stdout.write(f'Рассылка #{mailing.id} поставлена в очередь (задание #{job.id})')
+                return
+
+            self.stdout.write(f'Обработка рассылки #{mailing.id}: {mailing.message.subject}')
+            domains = Counter()
+            try:
+                with AttemptBuffer(options['batch_size']) as attempts:
+                    job, success_count, fail_count = dispatch_mailing(
+                        mailing, worker, options['lease'], attempts=attempts,
+                        domain_counts=domains, **delivery
+                    )
+            except (LeaseLost, DeliveryStopped) as e:
+                self.stdout.write(self.style.WARNING(str(e)))
+                return
+            if job is None:
+                self.stdout.write(
+                    self.style.WARNING(f'Рассылка #{mailing.id} уже обработана другим узлом')
+                )
+                return
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Рассылка #{mailing.id} завершена. Успешно: {success_count}, Неудачно: {fail_count}'
+                )
+            )
+            if domains:
+                self.stdout.write(f'  Домены: {domain_summary(domains)}')
+
+        scheduler = MailingScheduler(dispatch, poll=options['poll'], interval=options['interval'])
+
+        def stop(signum, frame):
+            # Идущая отправка дописывает начатые письма и останавливается (см. delivery.stop_requested)
+            scheduler.stop()
+            stop_requested.set()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, stop)
+
+        self.stdout.write('Планировщик рассылок запущен')
+        scheduler.run()
+        self.stdout.write('Планировщик рассылок остановлен')
@@ -1,13 +1,55 @@
+import signal
+from collections import Counter
+
 from django.core.management.base import BaseCommand
-from django.core.mail import send_mail
 from django.utils import timezone
-from mailings.models import Mailing, MailingAttempt
+from mailings.delivery import AttemptBuffer, DeliveryStopped, stop_requested
+from mailings.leasing import LeaseLost
+from mailings.models import Mailing
+from mailings.outbox import dispatch_mailing, worker_name
+
+from ._options import add_delivery_arguments, delivery_options, domain_summary
 
 
 class Command(BaseCommand):
     help = 'Отправка рассылок по расписанию'
 
+    def add_arguments(self, parser):
+        add_delivery_arguments(parser)
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=60,
+            help='На сколько секунд узел арендует рассылку. Должно быть не меньше '
+                 'разброса запуска команды на разных узлах и не больше периода cron',
+        )
+
+    def report(self, recipient, success, response):
+        if success:
+            self.stdout.write(
+                self.style.SUCCESS(f'  ✓ Отправлено: {recipient.email}')
+            )
+        else:
+            self.stdout.write(
+                self.style.ERROR(f'  ✗ Ошибка для {recipient.email}: {response}')
+            )
+
     def handle(self, *args, **options):
+        delivery = delivery_options(options)
+
+        # По SIGTERM только ставим флаг: начатые отправки дописываются в буфер попыток,
+        # новые не начинаются (см. delivery.stop_requested)
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_requested.set())
+
+        try:
+            with AttemptBuffer(options['batch_size']) as attempts:
+                self.send_due_mailings(attempts, delivery, options['lease'])
+        except DeliveryStopped as e:
+            # Незавершенную часть задания дошлет следующий запуск после истечения аренды
+            self.stdout.write(self.style.WARNING(str(e)))
+
+    def send_due_mailings(self, attempts, delivery, lease):
+        worker = worker_name()
         now = timezone.now()
         
         # Получаем рассылки, которые нужно отправить
@@ -18,63 +60,37 @@ class Command(BaseCommand):
         )
         
         for mailing in mailings:
+            if stop_requested.is_set():
+                raise DeliveryStopped(f'Отправка остановлена до рассылки #{mailing.id}')
             self.stdout.write(f'Обработка рассылки #{mailing.id}: {mailing.message.subject}')
             
-            recipients = mailing.recipients.all()
-            success_count = 0
-            fail_count = 0
-            
-            for recipient in recipients:
-                try:
-                    send_mail(
-                        subject=mailing.message.subject,
-                        message=mailing.message.body,
-                        from_email=None,
-                        recipient_list=[recipient.email],
-                        fail_silently=False,
-                    )
-                    MailingAttempt.objects.create(
-                        mailing=mailing,
-                        recipient=recipient,
-                        status='Успешно',
-                        server_response='Сообщение успешно отправлено'
-                    )
-                    success_count += 1
-                    self.stdout.write(
-                        self.style.SUCCESS(f'  ✓ Отправлено: {recipient.email}')
-                    )
-                except Exception as e:
-                    MailingAttempt.objects.create(
-                        mailing=mailing,
-                        recipient=recipient,
-                        status='Не успешно',
-                        server_response=str(e)
-                    )
-                    fail_count += 1
-                    self.stdout.write(
-                        self.style.ERROR(f'  ✗ Ошибка для {recipient.email}: {str(e)}')
-                    )
-            
-            # Обновляем статус рассылки динамически без валидации
-            current_status = mailing.get_status()
-            if mailing.status != current_status:
-                Mailing.objects.filter(pk=mailing.pk).update(status=current_status)
-                mailing.status = current_status
-            
+            # Рассылку арендует один узел, остальные помогают с частями его задания
+            domains = Counter()
+            try:
+                job, success_count, fail_count = dispatch_mailing(
+                    mailing, worker, lease, on_result=self.report, attempts=attempts,
+                    domain_counts=domains, **delivery
+                )
+            except LeaseLost as e:
+                self.stdout.write(self.style.WARNING(str(e)))
+                continue
+            if job is None:
+                self.stdout.write(
+                    self.style.WARNING(f'Рассылка #{mailing.id} уже обработана другим узлом')
+                )
+                continue
+
             self.stdout.write(
                 self.style.SUCCESS(
                     f'Рассылка #{mailing.id} завершена. Успешно: {success_count}, Неудачно: {fail_count}'
                 )
             )
+            if domains:
+                self.stdout.write(f'  Домены: {domain_summary(domains)}')
         
-        # Обновляем статусы завершенных рассылок
-        completed_mailings = Mailing.objects.filter(
-            status='Запущена',
-            end_time__lt=now
-        )
-        count = completed_mailings.update(status='Завершена')
+        # Статусы всех рассылок приводим к текущему времени одним UPDATE
+        count = Mailing.objects.reconcile_status()
         if count > 0:
             self.stdout.write(
-                self.style.SUCCESS(f'Обновлено статусов завершенных рассылок: {count}')
+                self.style.SUCCESS(f'Обновлено статусов рассылок: {count}')
             )
-
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0003_mailing_owner_message_owner_recipient_owner_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mailingattempt',
+            name='attempt_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата и время попытки'),
+        ),
+    ]
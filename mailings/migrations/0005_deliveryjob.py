@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0004_mailingattempt_attempt_time_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('В очереди', 'В очереди'), ('Выполняется', 'Выполняется'), ('Выполнено', 'Выполнено'), ('Ошибка', 'Ошибка')], default='В очереди', max_length=20, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Поставлено в очередь')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало выполнения')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание выполнения')),
+                ('worker', models.CharField(blank=True, max_length=255, verbose_name='Обработчик')),
+                ('success_count', models.PositiveIntegerField(default=0, verbose_name='Успешно')),
+                ('fail_count', models.PositiveIntegerField(default=0, verbose_name='Неудачно')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='mailings.mailing', verbose_name='Рассылка')),
+            ],
+            options={
+                'verbose_name': 'Задание на отправку',
+                'verbose_name_plural': 'Задания на отправку',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='deliveryjob_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def chunk_open_jobs(apps, schema_editor):
+    """Разбить на части задания, поставленные в очередь до появления частей"""
+    DeliveryJob = apps.get_model('mailings', 'DeliveryJob')
+    DeliveryChunk = apps.get_model('mailings', 'DeliveryChunk')
+    chunk_size = 1000
+    for job in DeliveryJob.objects.filter(status__in=['В очереди', 'Выполняется']):
+        ids = list(job.mailing.recipients.order_by('pk').values_list('pk', flat=True))
+        DeliveryChunk.objects.bulk_create([
+            DeliveryChunk(
+                job=job,
+                first_recipient_id=ids[start],
+                last_recipient_id=ids[min(start + chunk_size, len(ids)) - 1],
+            )
+            for start in range(0, len(ids), chunk_size)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0005_deliveryjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Аренда до'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Арендатор'),
+        ),
+        migrations.CreateModel(
+            name='DeliveryChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_recipient_id', models.BigIntegerField(verbose_name='Первый получатель')),
+                ('last_recipient_id', models.BigIntegerField(verbose_name='Последний получатель')),
+                ('done_at', models.DateTimeField(blank=True, null=True, verbose_name='Обработано')),
+                ('success_count', models.PositiveIntegerField(default=0, verbose_name='Успешно')),
+                ('fail_count', models.PositiveIntegerField(default=0, verbose_name='Неудачно')),
+                ('lease_owner', models.CharField(blank=True, max_length=255, verbose_name='Арендатор')),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True, verbose_name='Аренда до')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='mailings.deliveryjob', verbose_name='Задание')),
+            ],
+            options={
+                'verbose_name': 'Часть задания',
+                'verbose_name_plural': 'Части заданий',
+                'ordering': ['job', 'first_recipient_id'],
+                'indexes': [models.Index(fields=['done_at', 'lease_expires_at'], name='deliverychunk_pending_idx')],
+            },
+        ),
+        migrations.RunPython(chunk_open_jobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0006_delivery_leasing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('success', models.BooleanField(verbose_name='Успешно')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='mailings.deliveryjob', verbose_name='Задание')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mailings.recipient', verbose_name='Получатель')),
+            ],
+            options={
+                'verbose_name': 'Отметка обработки',
+                'verbose_name_plural': 'Отметки обработки',
+                'unique_together': {('job', 'recipient')},
+            },
+        ),
+    ]
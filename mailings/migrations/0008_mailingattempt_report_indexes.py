@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0007_deliverycheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mailingattempt',
+            index=models.Index(fields=['attempt_time'], name='mailingattempt_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailingattempt',
+            index=models.Index(fields=['mailing', 'attempt_time', 'status'], name='mailingattempt_mailing_idx'),
+        ),
+    ]
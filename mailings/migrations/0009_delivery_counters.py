@@ -0,0 +1,88 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_counters(apps, schema_editor):
+    """Посчитать счетчики по попыткам, записанным до появления счетчиков"""
+    Mailing = apps.get_model('mailings', 'Mailing')
+    MailingAttempt = apps.get_model('mailings', 'MailingAttempt')
+    OwnerDeliveryCounter = apps.get_model('mailings', 'OwnerDeliveryCounter')
+    rows = MailingAttempt.objects.values('mailing').annotate(
+        total=models.Count('pk'),
+        successful=models.Count('pk', filter=models.Q(status='Успешно')),
+        failed=models.Count('pk', filter=models.Q(status='Не успешно')),
+        last=models.Max('attempt_time'),
+    ).order_by()
+    for row in rows:
+        Mailing.objects.filter(pk=row['mailing']).update(
+            attempts_total=row['total'],
+            attempts_successful=row['successful'],
+            attempts_failed=row['failed'],
+            last_attempt_at=row['last'],
+        )
+    owners = Mailing.objects.filter(owner__isnull=False).values('owner').annotate(
+        total=models.Sum('attempts_total'),
+        successful=models.Sum('attempts_successful'),
+        failed=models.Sum('attempts_failed'),
+        last=models.Max('last_attempt_at'),
+    ).order_by()
+    OwnerDeliveryCounter.objects.bulk_create([
+        OwnerDeliveryCounter(
+            owner_id=row['owner'],
+            attempts_total=row['total'],
+            attempts_successful=row['successful'],
+            attempts_failed=row['failed'],
+            last_attempt_at=row['last'],
+        )
+        for row in owners
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mailings', '0008_mailingattempt_report_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailing',
+            name='attempts_failed',
+            field=models.PositiveIntegerField(default=0, verbose_name='Неудачных попыток'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='attempts_successful',
+            field=models.PositiveIntegerField(default=0, verbose_name='Успешных попыток'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='attempts_total',
+            field=models.PositiveIntegerField(default=0, verbose_name='Всего попыток'),
+        ),
+        migrations.AddField(
+            model_name='mailing',
+            name='last_attempt_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последняя попытка'),
+        ),
+        migrations.CreateModel(
+            name='OwnerDeliveryCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts_total', models.PositiveIntegerField(default=0, verbose_name='Всего попыток')),
+                ('attempts_successful', models.PositiveIntegerField(default=0, verbose_name='Успешных попыток')),
+                ('attempts_failed', models.PositiveIntegerField(default=0, verbose_name='Неудачных попыток')),
+                ('last_attempt_at', models.DateTimeField(blank=True, null=True, verbose_name='Последняя попытка')),
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_counter', to=settings.AUTH_USER_MODEL, verbose_name='Владелец')),
+            ],
+            options={
+                'verbose_name': 'Счетчики владельца',
+                'verbose_name_plural': 'Счетчики владельцев',
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
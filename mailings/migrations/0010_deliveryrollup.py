@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('mailings', '0009_delivery_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Час')),
+                ('status', models.CharField(choices=[('Успешно', 'Успешно'), ('Не успешно', 'Не успешно')], max_length=20, verbose_name='Статус')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Попыток')),
+                ('mailing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='mailings.mailing', verbose_name='Рассылка')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Владелец')),
+            ],
+            options={
+                'verbose_name': 'Попытки за час',
+                'verbose_name_plural': 'Попытки по часам',
+                'indexes': [models.Index(fields=['hour'], name='deliveryrollup_hour_idx'), models.Index(fields=['owner', 'hour'], name='deliveryrollup_owner_idx')],
+                'unique_together': {('mailing', 'hour', 'status')},
+            },
+        ),
+    ]
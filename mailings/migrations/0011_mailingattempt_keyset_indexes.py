@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0010_deliveryrollup'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='mailingattempt',
+            name='mailingattempt_time_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mailingattempt',
+            name='mailingattempt_mailing_idx',
+        ),
+        migrations.AddIndex(
+            model_name='mailingattempt',
+            index=models.Index(fields=['attempt_time', 'id'], name='mailingattempt_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailingattempt',
+            index=models.Index(fields=['mailing', 'attempt_time', 'id', 'status'], name='mailingattempt_mailing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailingattempt',
+            index=models.Index(fields=['recipient', 'attempt_time', 'id'], name='mailingattempt_recipient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailingattempt',
+            index=models.Index(fields=['status', 'attempt_time', 'id'], name='mailingattempt_status_idx'),
+        ),
+    ]
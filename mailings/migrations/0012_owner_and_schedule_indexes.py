@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0011_mailingattempt_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['status', 'start_time', 'end_time'], name='mailing_schedule_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailing',
+            index=models.Index(fields=['owner', 'start_time', 'id'], name='mailing_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['owner', 'subject'], name='message_owner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipient',
+            index=models.Index(fields=['owner', 'email'], name='recipient_owner_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:20
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def close_duplicate_jobs(apps, schema_editor):
+    """Закрыть лишние необработанные задания рассылок, оставив самое раннее"""
+    DeliveryJob = apps.get_model('mailings', 'DeliveryJob')
+    DeliveryChunk = apps.get_model('mailings', 'DeliveryChunk')
+    kept = set()
+    duplicates = []
+    for job_id, mailing_id in DeliveryJob.objects.filter(
+        status__in=['В очереди', 'Выполняется']
+    ).order_by('created_at', 'pk').values_list('pk', 'mailing_id'):
+        if mailing_id in kept:
+            duplicates.append(job_id)
+        kept.add(mailing_id)
+    now = timezone.now()
+    DeliveryChunk.objects.filter(job_id__in=duplicates, done_at__isnull=True).update(done_at=now)
+    DeliveryJob.objects.filter(pk__in=duplicates).update(
+        status='Ошибка',
+        error='Повторное задание по рассылке закрыто',
+        finished_at=now,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailings', '0013_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='deliveryjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['В очереди', 'Выполняется'])), fields=('mailing',), name='deliveryjob_one_open_per_mailing'),
+        ),
+    ]
@@ -1,5 +1,10 @@
 from django.db import models
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import Now
 from django.conf import settings
+from django.utils import timezone
+
+from .generations import bump
 
 
 class Recipient(models.Model):
@@ -8,12 +13,20 @@ class Recipient(models.Model):
     full_name = models.CharField(max_length=255, verbose_name='Ф. И. О.')
     comment = models.TextField(blank=True, verbose_name='Комментарий')
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Владелец')
+    # Время последнего изменения, по нему строится ETag страниц (см. mailings.conditional)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
 
     class Meta:
         verbose_name = 'Получатель рассылки'
         verbose_name_plural = 'Получатели рассылки'
         ordering = ['email']
         unique_together = [['email', 'owner']]
+        indexes = [
+            # Список получателей владельца в порядке email
+            models.Index(fields=['owner', 'email'], name='recipient_owner_idx'),
+            # Отметка изменения списка владельца (последнее изменение и число строк)
+            models.Index(fields=['owner', 'updated_at'], name='recipient_updated_idx'),
+        ]
         permissions = [
             ('can_view_all_recipients', 'Может просматривать всех получателей'),
         ]
@@ -27,11 +40,16 @@ class Message(models.Model):
     subject = models.CharField(max_length=255, verbose_name='Тема письма')
     body = models.TextField(verbose_name='Тело письма')
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Владелец')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
 
     class Meta:
         verbose_name = 'Сообщение'
         verbose_name_plural = 'Сообщения'
         ordering = ['subject']
+        indexes = [
+            models.Index(fields=['owner', 'subject'], name='message_owner_idx'),
+            models.Index(fields=['owner', 'updated_at'], name='message_updated_idx'),
+        ]
         permissions = [
             ('can_view_all_messages', 'Может просматривать все сообщения'),
         ]
@@ -40,6 +58,59 @@ class Message(models.Model):
         return self.subject
 
 
+def status_condition(status, now=None):
+    """Условие Q, при котором рассылка сейчас в статусе status.
+
+    now - момент времени; по умолчанию текущее время БД (NOW()).
+    """
+    now = Now() if now is None else now
+    if status == 'Создана':
+        return Q(start_time__gt=now)
+    if status == 'Завершена':
+        return Q(end_time__lt=now)
+    return Q(start_time__lte=now, end_time__gte=now)
+
+
+def current_status(now=None):
+    """Выражение статуса рассылки по времени - то же, что Mailing.get_status(), но в SQL"""
+    return Case(
+        When(status_condition('Создана', now), then=Value('Создана')),
+        When(status_condition('Завершена', now), then=Value('Завершена')),
+        default=Value('Запущена'),
+        output_field=models.CharField(),
+    )
+
+
+class MailingQuerySet(models.QuerySet):
+    def with_current_status(self, now=None):
+        """Добавить к рассылкам поле current_status, вычисленное в БД"""
+        return self.annotate(current_status=current_status(now))
+
+    def in_status(self, status, now=None):
+        """Рассылки, которые сейчас в статусе status, без опоры на сохраненное поле"""
+        return self.filter(status_condition(status, now))
+
+    def reconcile_status(self, now=None):
+        """Записать в поле status вычисленный статус одним UPDATE.
+
+        Затрагиваются только рассылки, у которых статус устарел.
+        Возвращает число обновленных рассылок.
+        """
+        status = current_status(now)
+        stale = self.exclude(status=status)
+        owners = set(stale.values_list('owner_id', flat=True).distinct())
+        if not owners:
+            return 0
+        count = stale.update(status=status, updated_at=timezone.now())
+        # update() не вызывает сигналов, кеш владельцев сбрасываем сами
+        bump(owners)
+        return count
+
+    def touch(self):
+        """Отметить рассылки измененными, не меняя полей (например, при смене состояния задания)"""
+        return self.update(updated_at=timezone.now())
+
+
 class Mailing(models.Model):
     """Модель рассылки"""
     STATUS_CHOICES = [
@@ -54,11 +125,29 @@ class Mailing(models.Model):
     message = models.ForeignKey(Message, on_delete=models.CASCADE, verbose_name='Сообщение')
     recipients = models.ManyToManyField(Recipient, verbose_name='Получатели')
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Владелец')
+    # Аренда рассылки узлом, который ставит ее в очередь (см. mailings.leasing)
+    lease_owner = models.CharField(max_length=255, blank=True, verbose_name='Арендатор')
+    lease_expires_at = models.DateTimeField(null=True, blank=True, verbose_name='Аренда до')
+    # Счетчики попыток, обновляются при записи попыток (см. mailings.counters)
+    attempts_total = models.PositiveIntegerField(default=0, verbose_name='Всего попыток')
+    attempts_successful = models.PositiveIntegerField(default=0, verbose_name='Успешных попыток')
+    attempts_failed = models.PositiveIntegerField(default=0, verbose_name='Неудачных попыток')
+    last_attempt_at = models.DateTimeField(null=True, blank=True, verbose_name='Последняя попытка')
+    # Меняется и при обновлениях через update(): статуса, счетчиков, состояния заданий
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    objects = MailingQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рассылка'
         verbose_name_plural = 'Рассылки'
         ordering = ['-start_time']
+        indexes = [
+            # Выбор рассылок к отправке и завершению (send_mailings, планировщик)
+            models.Index(fields=['status', 'start_time', 'end_time'], name='mailing_schedule_idx'),
+            # Рассылки владельца, новые первыми (списки и статистика)
+            models.Index(fields=['owner', 'start_time', 'id'], name='mailing_owner_idx'),
+        ]
         permissions = [
             ('can_view_all_mailings', 'Может просматривать все рассылки'),
             ('can_disable_mailing', 'Может отключать рассылки'),
@@ -87,7 +176,8 @@ class MailingAttempt(models.Model):
         ('Не успешно', 'Не успешно'),
     ]
 
-    attempt_time = models.DateTimeField(auto_now_add=True, verbose_name='Дата и время попытки')
+    # Время выставляется при отправке, а не при записи: попытки пишутся в БД пачками
+    attempt_time = models.DateTimeField(default=timezone.now, verbose_name='Дата и время попытки')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name='Статус')
     server_response = models.TextField(blank=True, verbose_name='Ответ почтового сервера')
     mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name='attempts', verbose_name='Рассылка')
@@ -97,6 +187,135 @@ class MailingAttempt(models.Model):
         verbose_name = 'Попытка рассылки'
         verbose_name_plural = 'Попытки рассылки'
         ordering = ['-attempt_time']
+        indexes = [
+            # Отчеты за период и постраничный вывод по курсору (время, id):
+            # по всем попыткам, по рассылке, по получателю и по статусу
+            models.Index(fields=['attempt_time', 'id'], name='mailingattempt_time_idx'),
+            models.Index(fields=['mailing', 'attempt_time', 'id', 'status'], name='mailingattempt_mailing_idx'),
+            models.Index(fields=['recipient', 'attempt_time', 'id'], name='mailingattempt_recipient_idx'),
+            models.Index(fields=['status', 'attempt_time', 'id'], name='mailingattempt_status_idx'),
+        ]
 
     def __str__(self):
         return f"Попытка {self.id} - {self.status} ({self.attempt_time})"
+
+
+class DeliveryJob(models.Model):
+    """Задание на отправку рассылки в очереди исходящих"""
+    STATUS_CHOICES = [
+        ('В очереди', 'В очереди'),
+        ('Выполняется', 'Выполняется'),
+        ('Выполнено', 'Выполнено'),
+        ('Ошибка', 'Ошибка'),
+    ]
+    # Задания в этих статусах еще не обработаны
+    OPEN_STATUSES = ['В очереди', 'Выполняется']
+
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name='jobs', verbose_name='Рассылка')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='В очереди', verbose_name='Статус')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Поставлено в очередь')
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Начало выполнения')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Окончание выполнения')
+    worker = models.CharField(max_length=255, blank=True, verbose_name='Обработчик')
+    success_count = models.PositiveIntegerField(default=0, verbose_name='Успешно')
+    fail_count = models.PositiveIntegerField(default=0, verbose_name='Неудачно')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+
+    class Meta:
+        verbose_name = 'Задание на отправку'
+        verbose_name_plural = 'Задания на отправку'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='deliveryjob_status_idx'),
+        ]
+        constraints = [
+            # Не больше одного необработанного задания на рассылку (см. outbox.enqueue_mailing)
+            models.UniqueConstraint(
+                fields=['mailing'],
+                condition=Q(status__in=['В очереди', 'Выполняется']),
+                name='deliveryjob_one_open_per_mailing',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Задание {self.id} - рассылка {self.mailing_id} ({self.status})"
+
+
+class DeliveryChunk(models.Model):
+    """Часть получателей задания: диапазон id, который обработчик захватывает целиком"""
+    job = models.ForeignKey(DeliveryJob, on_delete=models.CASCADE, related_name='chunks', verbose_name='Задание')
+    first_recipient_id = models.BigIntegerField(verbose_name='Первый получатель')
+    last_recipient_id = models.BigIntegerField(verbose_name='Последний получатель')
+    done_at = models.DateTimeField(null=True, blank=True, verbose_name='Обработано')
+    success_count = models.PositiveIntegerField(default=0, verbose_name='Успешно')
+    fail_count = models.PositiveIntegerField(default=0, verbose_name='Неудачно')
+    lease_owner = models.CharField(max_length=255, blank=True, verbose_name='Арендатор')
+    lease_expires_at = models.DateTimeField(null=True, blank=True, verbose_name='Аренда до')
+
+    class Meta:
+        verbose_name = 'Часть задания'
+        verbose_name_plural = 'Части заданий'
+        ordering = ['job', 'first_recipient_id']
+        indexes = [
+            models.Index(fields=['done_at', 'lease_expires_at'], name='deliverychunk_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"Часть {self.id} задания {self.job_id} ({self.first_recipient_id}-{self.last_recipient_id})"
+
+
+class DeliveryCheckpoint(models.Model):
+    """Отметка о том, что получатель задания уже обработан.
+
+    Пишется в одной транзакции с попыткой рассылки. Перезапущенное задание
+    пропускает отмеченных получателей, поэтому повторный запуск не шлет
+    письма второй раз. После завершения задания отметки удаляются.
+    """
+    job = models.ForeignKey(DeliveryJob, on_delete=models.CASCADE, related_name='checkpoints', verbose_name='Задание')
+    recipient = models.ForeignKey(Recipient, on_delete=models.CASCADE, verbose_name='Получатель')
+    success = models.BooleanField(verbose_name='Успешно')
+
+    class Meta:
+        verbose_name = 'Отметка обработки'
+        verbose_name_plural = 'Отметки обработки'
+        unique_together = [['job', 'recipient']]
+
+    def __str__(self):
+        return f"Задание {self.job_id} - получатель {self.recipient_id}"
+
+
+class OwnerDeliveryCounter(models.Model):
+    """Счетчики попыток по всем рассылкам владельца (см. mailings.counters)"""
+    owner = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='delivery_counter', verbose_name='Владелец')
+    attempts_total = models.PositiveIntegerField(default=0, verbose_name='Всего попыток')
+    attempts_successful = models.PositiveIntegerField(default=0, verbose_name='Успешных попыток')
+    attempts_failed = models.PositiveIntegerField(default=0, verbose_name='Неудачных попыток')
+    last_attempt_at = models.DateTimeField(null=True, blank=True, verbose_name='Последняя попытка')
+
+    class Meta:
+        verbose_name = 'Счетчики владельца'
+        verbose_name_plural = 'Счетчики владельцев'
+
+    def __str__(self):
+        return f"Счетчики {self.owner} - {self.attempts_total}"
+
+
+class DeliveryRollup(models.Model):
+    """Число попыток рассылки за час по статусам (см. mailings.rollups)"""
+    hour = models.DateTimeField(verbose_name='Час')
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Владелец')
+    mailing = models.ForeignKey(Mailing, on_delete=models.CASCADE, related_name='rollups', verbose_name='Рассылка')
+    status = models.CharField(max_length=20, choices=MailingAttempt.STATUS_CHOICES, verbose_name='Статус')
+    count = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+
+    class Meta:
+        verbose_name = 'Попытки за час'
+        verbose_name_plural = 'Попытки по часам'
+        unique_together = [['mailing', 'hour', 'status']]
+        indexes = [
+            models.Index(fields=['hour'], name='deliveryrollup_hour_idx'),
+            models.Index(fields=['owner', 'hour'], name='deliveryrollup_owner_idx'),
+        ]
+
+    def __str__(self):
+        return f"Рассылка {self.mailing_id} - {self.hour} - {self.status}: {self.count}"
@@ -0,0 +1,228 @@
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+from django.utils import timezone
+
+from .delivery import deliver_mailing
+from .generations import bump
+from .leasing import claim, renew
+from .models import DeliveryCheckpoint, DeliveryChunk, DeliveryJob, Mailing
+
+
+OPEN_STATUSES = DeliveryJob.OPEN_STATUSES
+
+
+def worker_name():
+    """Имя обработчика для полей аренды и DeliveryJob.worker"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def job_changed(mailing):
+    """Состояние задания видно на странице рассылки: отметить рассылку измененной"""
+    Mailing.objects.filter(pk=mailing.pk).touch()
+    bump([mailing.owner_id])
+
+
+def create_chunks(job, chunk_size=None):
+    """Разбить получателей рассылки на диапазоны id по chunk_size штук"""
+    chunk_size = chunk_size or settings.MAILING_CHUNK_SIZE
+    ids = list(job.mailing.recipients.order_by('pk').values_list('pk', flat=True))
+    DeliveryChunk.objects.bulk_create([
+        DeliveryChunk(
+            job=job,
+            first_recipient_id=ids[start],
+            last_recipient_id=ids[min(start + chunk_size, len(ids)) - 1]
+        )
+        for start in range(0, len(ids), chunk_size)
+    ])
+
+
+def open_job(mailing):
+    """Необработанное задание рассылки или None"""
+    return mailing.jobs.filter(status__in=OPEN_STATUSES).first()
+
+
+def enqueue_mailing(mailing):
+    """Поставить рассылку в очередь на отправку.
+
+    Если по рассылке уже есть необработанное задание, новое не создается.
+    Проверка и создание идут под блокировкой строки рассылки, так что
+    повторная отправка формы или планировщик одновременно с ней не
+    создадут второе задание. Там, где FOR UPDATE не поддерживается
+    (SQLite), второе задание отсекает уникальное условие
+    deliveryjob_one_open_per_mailing. Возвращает пару (задание, создано ли оно сейчас).
+    """
+    try:
+        with transaction.atomic():
+            Mailing.objects.select_for_update().filter(pk=mailing.pk).first()
+            job = open_job(mailing)
+            if job is not None:
+                return job, False
+            job = DeliveryJob.objects.create(mailing=mailing)
+            create_chunks(job)
+            job_changed(mailing)
+    except IntegrityError:
+        # Задание только что создал параллельный вызов
+        return open_job(mailing), False
+    # Рассылка без получателей завершается сразу
+    finish_job(job)
+    return job, True
+
+
+def claim_mailing(mailing, worker, lease_seconds):
+    """Арендовать рассылку, чтобы в этот запуск ее поставил в очередь только один узел.
+
+    Аренда не снимается досрочно, а истекает сама: узлы, запущенные
+    по тому же расписанию чуть позже, не отправят рассылку повторно.
+    """
+    return bool(claim(Mailing.objects.filter(pk=mailing.pk), worker, lease_seconds))
+
+
+def claim_chunk(worker, job=None):
+    """Взять в аренду необработанную часть задания (любого или указанного)"""
+    chunks = DeliveryChunk.objects.filter(done_at__isnull=True, job__status__in=OPEN_STATUSES)
+    if job is not None:
+        chunks = chunks.filter(job=job)
+    ids = claim(chunks.order_by('job__created_at', 'id'), worker, settings.MAILING_LEASE_SECONDS)
+    if not ids:
+        return None
+    return DeliveryChunk.objects.select_related('job__mailing__message').get(pk=ids[0])
+
+
+def finish_job(job):
+    """Закрыть задание, если все его части обработаны"""
+    if job.chunks.filter(done_at__isnull=True).exists():
+        return False
+    totals = job.chunks.aggregate(success=Sum('success_count'), fail=Sum('fail_count'))
+    closed = DeliveryJob.objects.filter(pk=job.pk, status__in=OPEN_STATUSES).update(
+        status='Выполнено',
+        success_count=totals['success'] or 0,
+        fail_count=totals['fail'] or 0,
+        finished_at=timezone.now()
+    )
+    if closed:
+        # Итоги перенесены в задание, отметки больше не нужны
+        job.checkpoints.all().delete()
+        job_changed(job.mailing)
+
+    # Обновляем статус рассылки без валидации
+    Mailing.objects.filter(pk=job.mailing_id).reconcile_status()
+    return True
+
+
+def pending_recipients(chunk):
+    """Получатели части задания, которых еще нет в отметках задания.
+
+    Отметки исключаются через NOT EXISTS по уникальному индексу
+    (job, recipient), а не перебором попыток рассылки.
+    """
+    done = DeliveryCheckpoint.objects.filter(job_id=chunk.job_id, recipient_id=OuterRef('pk'))
+    return chunk.job.mailing.recipients.filter(
+        pk__gte=chunk.first_recipient_id,
+        pk__lte=chunk.last_recipient_id
+    ).exclude(Exists(done))
+
+
+def process_chunk(chunk, worker, on_result=None, attempts=None, **delivery_options):
+    """Отправить письма получателям части задания.
+
+    Получатели, отмеченные прошлым прерванным запуском, пропускаются.
+    Аренда части продлевается по ходу отправки. Если ее забрал другой
+    обработчик, отправка прерывается исключением LeaseLost.
+    Возвращает кортеж (успешно, неудачно) для писем, отправленных сейчас.
+    """
+    job = chunk.job
+    mailing = job.mailing
+    lease_seconds = settings.MAILING_LEASE_SECONDS
+    now = timezone.now()
+    if DeliveryJob.objects.filter(pk=job.pk, status='В очереди').update(
+        status='Выполняется',
+        started_at=now,
+        worker=worker
+    ):
+        job_changed(mailing)
+
+    if now > mailing.end_time:
+        DeliveryJob.objects.filter(pk=job.pk, status__in=OPEN_STATUSES).update(
+            status='Ошибка',
+            error=f'Период рассылки истек {mailing.end_time}',
+            finished_at=now
+        )
+        DeliveryChunk.objects.filter(job=job, done_at__isnull=True).update(done_at=now)
+        job.checkpoints.all().delete()
+        job_changed(mailing)
+        return 0, 0
+
+    renewed_at = time.monotonic()
+
+    def report(recipient, success, response):
+        nonlocal renewed_at
+        if time.monotonic() - renewed_at > lease_seconds / 3:
+            renew(DeliveryChunk, chunk.pk, worker, lease_seconds)
+            renewed_at = time.monotonic()
+        if on_result is not None:
+            on_result(recipient, success, response)
+
+    success_count, fail_count = deliver_mailing(
+        mailing,
+        on_result=report,
+        attempts=attempts,
+        recipients=pending_recipients(chunk),
+        job=job,
+        **delivery_options
+    )
+    # Часть считается обработанной только после записи ее попыток и отметок
+    if attempts is not None:
+        attempts.flush()
+
+    # Итоги части считаем по отметкам, чтобы учесть и прерванные запуски
+    totals = job.checkpoints.filter(
+        recipient_id__gte=chunk.first_recipient_id,
+        recipient_id__lte=chunk.last_recipient_id
+    ).aggregate(
+        successful=Count('pk', filter=Q(success=True)),
+        failed=Count('pk', filter=Q(success=False))
+    )
+    DeliveryChunk.objects.filter(pk=chunk.pk, lease_owner=worker).update(
+        done_at=timezone.now(),
+        success_count=totals['successful'],
+        fail_count=totals['failed'],
+        lease_owner='',
+        lease_expires_at=None
+    )
+    finish_job(job)
+    return success_count, fail_count
+
+
+def process_job(job, worker, **options):
+    """Обработать все свободные части задания. Возвращает (успешно, неудачно)."""
+    success_count = 0
+    fail_count = 0
+    while True:
+        chunk = claim_chunk(worker, job)
+        if chunk is None:
+            return success_count, fail_count
+        success, fail = process_chunk(chunk, worker, **options)
+        success_count += success
+        fail_count += fail
+
+
+def dispatch_mailing(mailing, worker, lease_seconds, **options):
+    """Поставить рассылку в очередь и сразу отправить ее силами этого узла.
+
+    Если рассылку уже арендовал другой узел, этот узел только помогает
+    с частями его открытого задания. Возвращает (задание, успешно, неудачно),
+    задание равно None, если делать уже нечего.
+    """
+    if claim_mailing(mailing, worker, lease_seconds):
+        job, created = enqueue_mailing(mailing)
+    else:
+        job = open_job(mailing)
+        if job is None:
+            return None, 0, 0
+    success_count, fail_count = process_job(job, worker, **options)
+    return job, success_count, fail_count
@@ -0,0 +1,155 @@
+"""Кеш целых страниц с учетом пользователя и поколений данных.
+
+Кешируются только страницы, явно отмеченные декоратором page_cache.
+Ключ включает путь с параметрами, пользователя, его роли и поколение
+его данных (mailings.generations), поэтому страница одного пользователя
+не попадет к другому, а после изменения данных страница строится заново.
+
+Страница не берется из кеша и не сохраняется в него, если в запросе
+есть всплывающие сообщения или при построении страницы понадобился
+CSRF-токен (в ней есть форма с POST). У страниц с ETag (mailings.conditional)
+сохраненная страница перед выдачей сверяется с текущим ETag - одним
+запросом отметки изменения данных, поэтому изменения из других процессов
+видны сразу. Страница из кеша с ETag, который уже есть у браузера,
+отдается ответом 304. Счетчики попаданий и
+промахов по каждой странице отдает page_cache_stats().
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, quote_etag
+
+from .generations import ALL, current, scope_of
+from .roles import get_roles
+
+
+# Отмеченные страницы: модуль.функция -> срок хранения в секундах
+CACHED_VIEWS = {}
+
+OUTCOMES = ('hit', 'miss', 'not_modified', 'bypass')
+
+
+def page_cache(timeout):
+    """Разрешить кешировать страницу на timeout секунд"""
+    def decorator(view_func):
+        view_func.page_cache_timeout = timeout
+        CACHED_VIEWS[view_name_of(view_func)] = timeout
+        return view_func
+    return decorator
+
+
+def view_name_of(view_func):
+    return f'{view_func.__module__}.{view_func.__name__}'
+
+
+def stat_key(view_name, outcome):
+    return f'page_cache:stat:{view_name}:{outcome}'
+
+
+def count(view_name, outcome):
+    key = stat_key(view_name, outcome)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def page_cache_stats():
+    """{страница: {'hit': n, 'miss': n, 'not_modified': n, 'bypass': n}} по отмеченным страницам"""
+    keys = {stat_key(view_name, outcome): (view_name, outcome) for view_name in CACHED_VIEWS for outcome in OUTCOMES}
+    values = cache.get_many(list(keys))
+    stats = {view_name: dict.fromkeys(OUTCOMES, 0) for view_name in CACHED_VIEWS}
+    for key, value in values.items():
+        view_name, outcome = keys[key]
+        stats[view_name][outcome] = value
+    return stats
+
+
+def has_messages(request):
+    return len(get_messages(request)) > 0
+
+
+def page_key(request):
+    user = request.user
+    if user.is_authenticated:
+        roles = get_roles(request)
+        scope = scope_of(request)
+        who = f'{user.pk}:{int(roles.is_staff)}{int(roles.is_manager)}'
+    else:
+        scope = ALL
+        who = 'anon'
+    epoch, generation = current(scope)
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'page_cache:page:{who}:{epoch}:{generation}:{path}'
+
+
+def is_current(response, view_func, request, view_args, view_kwargs):
+    """Сохраненная страница совпадает с текущим ETag страницы (если он у нее есть)"""
+    etag_func = getattr(view_func, 'page_etag', None)
+    if etag_func is None:
+        return True
+    etag = etag_func(request, *view_args, **view_kwargs)
+    return etag is not None and quote_etag(etag) == response.get('ETag')
+
+
+class PageCacheMiddleware:
+    """Отдает из кеша и сохраняет в кеш страницы, отмеченные page_cache.
+
+    Должен стоять после AuthenticationMiddleware, MessageMiddleware и RoleMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not hasattr(request, '_page_cache_view'):
+            return response
+        view_name, timeout, key = request._page_cache_view
+        # miss - страница построена и сохранена, not_modified - ответ 304 по ETag
+        # (mailings.conditional), bypass - построена, но сохранять нельзя
+        cacheable = (
+            key is not None
+            and response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            and not has_messages(request)
+        )
+        if cacheable:
+            cache.set(key, response, timeout)
+            outcome = 'miss'
+        elif response.status_code == 304:
+            outcome = 'not_modified'
+        else:
+            outcome = 'bypass'
+        count(view_name, outcome)
+        response['X-Page-Cache'] = outcome
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timeout = getattr(view_func, 'page_cache_timeout', None)
+        if timeout is None or not settings.PAGE_CACHE_ENABLED or request.method != 'GET':
+            return None
+        view_name = view_name_of(view_func)
+        if has_messages(request):
+            # Страница покажет сообщения, ее нельзя ни отдать из кеша, ни сохранить
+            request._page_cache_view = (view_name, timeout, None)
+            return None
+
+        key = page_key(request)
+        response = cache.get(key)
+        if response is not None and not is_current(response, view_func, request, view_args, view_kwargs):
+            # Данные изменились в обход поколений (например, в другом процессе) - строим заново
+            response = None
+        if response is not None:
+            count(view_name, 'hit')
+            # Если у браузера уже есть эта страница, отдаем 304 вместо нее
+            response = get_conditional_response(request, etag=response.get('ETag'), response=response)
+            response['X-Page-Cache'] = 'hit'
+            return response
+        request._page_cache_view = (view_name, timeout, key)
+        return None
@@ -0,0 +1,97 @@
+"""Постраничный вывод по курсору (keyset) для больших таблиц.
+
+Страница выбирается условием на ключ сортировки (время, id) последней
+показанной строки, а не OFFSET, поэтому любая страница стоит столько
+же, сколько первая: БД сразу переходит в нужное место индекса.
+"""
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(moment, pk):
+    raw = f'{moment.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """Курсор в пару (время, id) или None, если курсор испорчен"""
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+    except (binascii.Error, ValueError):
+        return None
+    moment, _, pk = raw.rpartition('|')
+    try:
+        moment = parse_datetime(moment)
+    except ValueError:
+        return None
+    if moment is None or not pk.isdigit():
+        return None
+    return moment, int(pk)
+
+
+class KeysetPage:
+    """Страница выборки с курсорами на соседние страницы"""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_page(queryset, after=None, before=None, per_page=50, field='attempt_time'):
+    """Страница queryset, упорядоченного от новых к старым по (field, id).
+
+    after - курсор последней строки предыдущей страницы (листаем дальше),
+    before - курсор первой строки следующей страницы (листаем назад).
+    Без курсора возвращается первая страница.
+    """
+    after = decode_cursor(after)
+    before = decode_cursor(before) if after is None else None
+
+    if before is not None:
+        moment, pk = before
+        # Условие field >= moment отдельно, чтобы БД взяла диапазон по индексу
+        rows = list(queryset.filter(
+            Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'pk__gt': pk}),
+            **{f'{field}__gte': moment}
+        ).order_by(field, 'pk')[:per_page + 1])
+        has_more = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        next_cursor = cursor_of(items[-1], field) if items else None
+        previous_cursor = cursor_of(items[0], field) if has_more else None
+        return KeysetPage(items, next_cursor, previous_cursor)
+
+    if after is not None:
+        moment, pk = after
+        queryset = queryset.filter(
+            Q(**{f'{field}__lt': moment}) | Q(**{field: moment, 'pk__lt': pk}),
+            **{f'{field}__lte': moment}
+        )
+    rows = list(queryset.order_by(f'-{field}', '-pk')[:per_page + 1])
+    items = rows[:per_page]
+    next_cursor = cursor_of(items[-1], field) if len(rows) > per_page else None
+    previous_cursor = cursor_of(items[0], field) if after is not None and items else None
+    return KeysetPage(items, next_cursor, previous_cursor)
+
+
+def cursor_of(item, field):
+    return encode_cursor(getattr(item, field), item.pk)
@@ -0,0 +1,67 @@
+"""Подстановка данных получателя в тему и текст сообщения.
+
+В тексте можно использовать {full_name} и {email} - они заменяются
+полями Recipient. Остальной текст, в том числе фигурные скобки,
+отправляется как есть.
+"""
+import re
+from functools import lru_cache
+from operator import attrgetter
+
+
+# Подстановка -> поле Recipient
+FIELDS = {
+    'full_name': 'full_name',
+    'email': 'email',
+}
+
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+class CompiledTemplate:
+    """Шаблон, заранее разобранный в строку формата и список полей.
+
+    Разбор делается один раз. Подстановка для получателя - это одна
+    операция % над готовой строкой формата, без повторного разбора.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        literals = []
+        fields = []
+        position = 0
+        for match in PLACEHOLDER.finditer(text):
+            if match.group(1) not in FIELDS:
+                continue
+            literals.append(text[position:match.start()].replace('%', '%%'))
+            fields.append(FIELDS[match.group(1)])
+            position = match.end()
+        literals.append(text[position:].replace('%', '%%'))
+
+        self.fields = tuple(fields)
+        self.format = '%s'.join(literals)
+        self.getter = attrgetter(*fields) if fields else None
+
+    @property
+    def is_static(self):
+        """В шаблоне нет подстановок, текст одинаков для всех получателей"""
+        return not self.fields
+
+    def render(self, recipient):
+        if self.getter is None:
+            return self.text
+        values = self.getter(recipient)
+        if len(self.fields) == 1:
+            values = (values,)
+        return self.format % values
+
+
+@lru_cache(maxsize=256)
+def compile_template(text):
+    """Разобрать шаблон (результат кешируется по тексту)"""
+    return CompiledTemplate(text)
+
+
+def unknown_placeholders(text):
+    """Подстановки в тексте, которых нет среди FIELDS"""
+    return sorted({name for name in PLACEHOLDER.findall(text) if name not in FIELDS})
@@ -0,0 +1,208 @@
+import re
+import smtplib
+import ssl
+from email.utils import make_msgid
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+
+from .personalization import compile_template
+
+
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+# Точка в начале строки экранируется второй точкой (RFC 5321, 4.5.2)
+LEADING_DOT = re.compile(rb'^\.', re.MULTILINE)
+
+# Адрес-заглушка, которым собирается общая часть письма
+PLACEHOLDER_ADDRESS = 'recipient@invalid'
+
+
+def build_email(subject, body, email):
+    """Собрать письмо для одного получателя"""
+    return EmailMessage(
+        subject=subject,
+        body=body,
+        from_email=None,
+        to=[email],
+    )
+
+
+def serialize(email):
+    """Байты заголовков (без To и Message-ID) и тела письма для DATA"""
+    mime = email.message()
+    del mime['To']
+    del mime['Message-ID']
+    head, _, body = mime.as_bytes(linesep='\r\n').partition(b'\r\n\r\n')
+    return head + b'\r\n', dot_stuff(body)
+
+
+def dot_stuff(data):
+    """Подготовить данные к команде DATA: экранировать точки, закончить переводом строки"""
+    data = LEADING_DOT.sub(b'..', data)
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data
+
+
+def send_pieces(sock, pieces):
+    """Записать части письма в сокет без склейки в один буфер.
+
+    Для обычного сокета используется sendmsg (writev): все части уходят
+    одним системным вызовом. TLS-сокет sendmsg не поддерживает, для него
+    части склеиваются.
+    """
+    if isinstance(sock, ssl.SSLSocket) or not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(pieces))
+        return
+    views = [memoryview(piece) for piece in pieces if piece]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+
+
+def reset(smtp):
+    """RSET после отказа сервера, разрыв сессии при этом не ошибка"""
+    try:
+        smtp.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+class PreparedMessage:
+    """Сообщение рассылки, один раз собранное в байты MIME.
+
+    Заголовки (кроме To и Message-ID) и тело кодируются и сериализуются
+    при создании объекта. Письмо получателю - это те же байты плюс строка
+    с его To и Message-ID, тело при этом не копируется.
+
+    Тема и текст - шаблоны с подстановками (mailings.personalization).
+    Если в них есть подстановки, байты собираются для каждого получателя
+    отдельно, но сами шаблоны разбираются один раз.
+
+    Готовые байты отправляются только через SMTP-бэкенд. С другими
+    бэкендами (консоль, locmem) build() собирает обычный EmailMessage.
+
+    envelope_batch - сколько получателей одного домена можно отправить
+    одной SMTP-транзакцией (по умолчанию MAILING_ENVELOPE_BATCH). Работает
+    только для сообщений без подстановок и только через SMTP-бэкенд.
+    """
+
+    def __init__(self, message, envelope_batch=None):
+        self.subject = compile_template(message.subject)
+        self.body = compile_template(message.body)
+        self.personalized = not (self.subject.is_static and self.body.is_static)
+
+        email = build_email(message.subject, message.body, PLACEHOLDER_ADDRESS)
+        self.encoding = email.encoding or settings.DEFAULT_CHARSET
+        self.from_addr = sanitize_address(email.from_email, self.encoding)
+        self.head, self.data = (None, None) if self.personalized else serialize(email)
+        self.raw = settings.EMAIL_BACKEND == SMTP_BACKEND
+        envelope_batch = envelope_batch or settings.MAILING_ENVELOPE_BATCH
+        self.envelope_batch = 1 if self.personalized else max(1, envelope_batch)
+
+    def render(self, recipient):
+        """EmailMessage с подставленными данными получателя"""
+        return build_email(
+            self.subject.render(recipient),
+            self.body.render(recipient),
+            recipient.email
+        )
+
+    def build(self, recipient):
+        """Письмо получателю для MailConnection.send"""
+        if self.raw:
+            return self.build_raw(recipient)
+        return self.render(recipient)
+
+    def build_raw(self, recipient):
+        if self.personalized:
+            return PreparedEmail(self, [recipient.email], *serialize(self.render(recipient)))
+        return PreparedEmail(self, [recipient.email], self.head, self.data)
+
+    def build_batch(self, recipients):
+        """Одно письмо всем recipients (только для сообщений без подстановок)"""
+        return PreparedEmail(self, [recipient.email for recipient in recipients], self.head, self.data)
+
+    def split(self, recipients):
+        """Разбить получателей одного домена на группы для одной транзакции"""
+        size = self.envelope_batch if self.raw else 1
+        for start in range(0, len(recipients), size):
+            yield recipients[start:start + size]
+
+
+class PreparedEmail:
+    """Письмо из байтов PreparedMessage одному или нескольким получателям.
+
+    Нескольким получателям письмо уходит одной SMTP-транзакцией: MAIL FROM,
+    по RCPT TO на каждый адрес и одна команда DATA. Если сервер объявил
+    PIPELINING, команды отправляются пачкой, а ответы читаются после.
+    """
+
+    def __init__(self, prepared, emails, head, data):
+        self.prepared = prepared
+        self.to = emails
+        self.addresses = [sanitize_address(email, prepared.encoding) for email in emails]
+        self.head = head
+        self.data = data
+
+    def pieces(self):
+        """Части данных для команды DATA, включая завершающую точку"""
+        # Адреса других получателей пакета в письмо не попадают
+        to = self.addresses[0] if len(self.addresses) == 1 else 'undisclosed-recipients:;'
+        headers = f'To: {to}\r\nMessage-ID: {make_msgid(domain=DNS_NAME)}\r\n\r\n'
+        return [self.head, headers.encode(), self.data, b'.\r\n']
+
+    def send(self, smtp):
+        """Отправить письмо через открытое соединение smtplib.SMTP.
+
+        Возвращает словарь отклоненных адресов {адрес: (код, ответ)}.
+        Если отклонены все адреса, поднимается SMTPRecipientsRefused.
+        """
+        if smtp is None or smtp.sock is None:
+            raise smtplib.SMTPServerDisconnected('Соединение не открыто')
+        smtp.ehlo_or_helo_if_needed()
+        from_addr = self.prepared.from_addr
+        commands = [f'MAIL FROM:<{from_addr}>'] + [f'RCPT TO:<{address}>' for address in self.addresses]
+
+        if smtp.has_extn('pipelining'):
+            smtp.send(''.join(f'{command}\r\n' for command in commands + ['DATA']))
+            replies = [smtp.getreply() for _ in range(len(commands) + 1)]
+        else:
+            replies = [smtp.docmd(command) for command in commands]
+            if replies[0][0] == 250 and any(code in (250, 251) for code, _ in replies[1:]):
+                replies.append(smtp.docmd('DATA'))
+
+        code, response = replies[0]
+        refused = {
+            address: reply
+            for address, reply in zip(self.addresses, replies[1:len(commands)])
+            if reply[0] not in (250, 251)
+        }
+        data_code, data_response = replies[len(commands)] if len(replies) > len(commands) else (None, b'')
+        if data_code == 354 and (code != 250 or len(refused) == len(self.addresses)):
+            # Сервер принял DATA без получателей: завершаем пустое письмо
+            smtp.send(b'.\r\n')
+            smtp.getreply()
+            data_code = None
+        if code != 250:
+            reset(smtp)
+            raise smtplib.SMTPSenderRefused(code, response, from_addr)
+        if len(refused) == len(self.addresses):
+            reset(smtp)
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_code != 354:
+            reset(smtp)
+            raise smtplib.SMTPDataError(data_code, data_response)
+
+        send_pieces(smtp.sock, self.pieces())
+        code, response = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+        return refused
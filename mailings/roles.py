@@ -0,0 +1,83 @@
+"""Роли пользователя: менеджер и доступ ко всем данным.
+
+Принадлежность к группе "Менеджеры" хранится в общем кеше по id
+пользователя и сбрасывается сигналами при изменении групп (см.
+mailings.signals). С локальным кешем роль не кешируется
+(ROLE_CACHE_ENABLED): сброс в одном процессе не виден остальным.
+RoleMiddleware кладет в request.roles объект,
+который считает роли один раз за запрос, так что после прогрева
+страница не делает запросов к группам.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+
+
+MANAGERS_GROUP = 'Менеджеры'
+
+
+def role_cache_key(user_id):
+    return f'user_is_manager:{user_id}'
+
+
+def is_manager(user):
+    """Пользователь входит в группу менеджеров"""
+    if not user.is_authenticated:
+        return False
+    if not settings.ROLE_CACHE_ENABLED:
+        return user.groups.filter(name=MANAGERS_GROUP).exists()
+    key = role_cache_key(user.pk)
+    value = cache.get(key)
+    if value is None:
+        value = user.groups.filter(name=MANAGERS_GROUP).exists()
+        cache.set(key, value, settings.ROLE_CACHE_SECONDS)
+    return value
+
+
+def forget_roles(user_ids):
+    """Сбросить закешированные роли пользователей"""
+    cache.delete_many([role_cache_key(user_id) for user_id in user_ids])
+
+
+class UserRoles:
+    """Роли пользователя, вычисленные один раз за запрос"""
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def is_manager(self):
+        return is_manager(self.user)
+
+    @property
+    def is_staff(self):
+        return self.user.is_staff
+
+    @property
+    def can_view_all(self):
+        """Видит данные всех пользователей: персонал и менеджеры"""
+        return self.is_staff or self.is_manager
+
+    @property
+    def is_read_only(self):
+        """Менеджер без прав персонала может только просматривать чужие данные"""
+        return self.is_manager and not self.is_staff
+
+
+def get_roles(request):
+    """Роли пользователя запроса (RoleMiddleware или вычисленные на месте)"""
+    roles = getattr(request, 'roles', None)
+    if roles is None or roles.user is not request.user:
+        roles = request.roles = UserRoles(request.user)
+    return roles
+
+
+class RoleMiddleware:
+    """Кладет в request.roles роли текущего пользователя, вычисляемые по требованию"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.roles = UserRoles(request.user)
+        return self.get_response(request)
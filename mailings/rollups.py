@@ -0,0 +1,110 @@
+"""Почасовые итоги попыток рассылок (DeliveryRollup).
+
+Итоги пополняются в той же транзакции, что и попытки (AttemptBuffer.flush
+через mailings.counters.record_attempts), поэтому графики строятся по
+нескольким сотням строк, а не по таблице попыток. Попытки, записанные
+до появления итогов, переносит команда backfill_delivery_rollup.
+"""
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .generations import bump_all
+from .models import DeliveryRollup, MailingAttempt
+
+
+# Период длиннее этого показывается по дням, а не по часам
+HOURLY_SERIES_LIMIT = timedelta(days=7)
+
+
+def hour_of(moment):
+    """Начало часа в UTC"""
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def add_counts(counts):
+    """Прибавить к итогам {(час, владелец, рассылка, статус): число попыток}"""
+    if not counts:
+        return
+    DeliveryRollup.objects.bulk_create(
+        [
+            DeliveryRollup(hour=hour, owner_id=owner_id, mailing_id=mailing_id, status=status)
+            for hour, owner_id, mailing_id, status in counts
+        ],
+        ignore_conflicts=True
+    )
+    # Строки обновляются в одном порядке, чтобы обработчики не ждали друг друга встречно
+    for key in sorted(counts, key=lambda key: (key[2], key[0], key[3])):
+        hour, owner_id, mailing_id, status = key
+        DeliveryRollup.objects.filter(mailing_id=mailing_id, hour=hour, status=status).update(
+            count=F('count') + counts[key]
+        )
+
+
+def backfill(chunk_size=10000):
+    """Пересобрать итоги по всем попыткам.
+
+    Попытки читаются диапазонами id по chunk_size и группируются в БД,
+    каждый диапазон записывается своей транзакцией. Генератор отдает
+    id последней обработанной попытки после каждого диапазона.
+    """
+    DeliveryRollup.objects.all().delete()
+    last_id = 0
+    while True:
+        ids = list(
+            MailingAttempt.objects.filter(pk__gt=last_id)
+            .order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            bump_all()
+            return
+        rows = MailingAttempt.objects.filter(pk__gt=last_id, pk__lte=ids[-1]).annotate(
+            rollup_hour=TruncHour('attempt_time', tzinfo=dt_timezone.utc)
+        ).values('rollup_hour', 'mailing__owner', 'mailing', 'status').annotate(
+            n=Count('pk')
+        ).order_by()
+        with transaction.atomic():
+            add_counts({
+                (row['rollup_hour'], row['mailing__owner'], row['mailing'], row['status']): row['n']
+                for row in rows
+            })
+        last_id = ids[-1]
+        yield last_id
+
+
+def series(rollups, start, end):
+    """Ряд попыток по статусам за [start, end) для графика.
+
+    До HOURLY_SERIES_LIMIT точки идут по часам, дальше - по дням.
+    Возвращает словарь с подписями и рядами успешных и неудачных попыток.
+    """
+    trunc = TruncHour if end - start <= HOURLY_SERIES_LIMIT else TruncDay
+    rows = rollups.filter(hour__gte=start, hour__lt=end).annotate(
+        bucket=trunc('hour')
+    ).values('bucket', 'status').annotate(total=Sum('count')).order_by('bucket')
+
+    totals = {}
+    for row in rows:
+        totals[row['bucket'], row['status']] = row['total']
+
+    # Пустые часы (дни) тоже попадают в ряд, чтобы ось времени была равномерной
+    daily = trunc is TruncDay
+    step = timedelta(days=1) if daily else timedelta(hours=1)
+    moment = timezone.localtime(start).replace(minute=0, second=0, microsecond=0)
+    if daily:
+        moment = moment.replace(hour=0)
+    points = []
+    while moment < end:
+        points.append(moment)
+        moment += step
+
+    label_format = '%d.%m.%Y' if daily else '%d.%m %H:00'
+    return {
+        'granularity': 'day' if daily else 'hour',
+        'labels': [point.strftime(label_format) for point in points],
+        'successful': [totals.get((point, 'Успешно'), 0) for point in points],
+        'failed': [totals.get((point, 'Не успешно'), 0) for point in points],
+    }
@@ -0,0 +1,155 @@
+import heapq
+import threading
+
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import DeliveryJob, Mailing
+
+
+# Счетчик изменений расписания в общем кеше: по нему планировщик узнает
+# об изменениях рассылок, сделанных в других процессах (веб-сервер, админка)
+SCHEDULE_VERSION_KEY = 'mailing_schedule_version'
+
+# Изменения в этом же процессе будят планировщик сразу
+schedule_changed = threading.Event()
+
+
+def notify_schedule_changed():
+    """Сообщить планировщику, что рассылки изменились"""
+    try:
+        cache.incr(SCHEDULE_VERSION_KEY)
+    except ValueError:
+        cache.set(SCHEDULE_VERSION_KEY, 1, None)
+    schedule_changed.set()
+
+
+def last_dispatched(pks):
+    """{id рассылки: время постановки последнего задания} для рассылок pks"""
+    return dict(
+        DeliveryJob.objects.filter(mailing_id__in=pks)
+        .order_by()
+        .values('mailing_id')
+        .annotate(last=Max('created_at'))
+        .values_list('mailing_id', 'last')
+    )
+
+
+class MailingScheduler:
+    """Планировщик рассылок с очередью по времени срабатывания.
+
+    В куче лежат события (время, id рассылки, вид): 'send' в момент начала
+    отправки и 'finish' в момент окончания. Планировщик спит до ближайшего
+    события, но не дольше poll секунд, и просыпается раньше по сигналу
+    об изменении расписания в этом процессе. Изменения из других процессов
+    он замечает по счетчику в кеше или по опросу БД после пробуждения.
+
+    Была ли рассылка уже отправлена, планировщик узнает по заданиям
+    DeliveryJob в БД, поэтому после перезапуска он не отправляет
+    повторно рассылки, которые уже идут.
+
+    dispatch(mailing) вызывается, когда рассылку пора отправлять.
+    При interval рассылка повторяется каждые interval секунд, пока идет
+    период отправки, иначе отправляется один раз на каждое время начала.
+    """
+
+    def __init__(self, dispatch, poll=30, interval=None):
+        self.dispatch = dispatch
+        self.poll = poll
+        self.interval = interval
+        self.heap = []
+        # id рассылки -> (start_time, end_time) по последнему чтению из БД
+        self.schedule = {}
+        self.version = None
+        self.stopped = threading.Event()
+
+    def refresh(self):
+        """Перечитать расписание из БД и поставить в кучу новые события.
+
+        Заодно сохраненные статусы всех рассылок приводятся к текущему
+        времени одним UPDATE.
+        """
+        now = timezone.now()
+        Mailing.objects.reconcile_status(now)
+        rows = Mailing.objects.filter(
+            status__in=['Создана', 'Запущена'],
+            end_time__gte=now
+        ).values_list('id', 'start_time', 'end_time')
+
+        schedule = {pk: (start, end) for pk, start, end in rows}
+        changed = {pk: times for pk, times in schedule.items() if self.schedule.get(pk) != times}
+        dispatched = last_dispatched(changed)
+        for pk, times in changed.items():
+            start, end = times
+            last = dispatched.get(pk)
+            if last is None or last < start:
+                heapq.heappush(self.heap, (start, pk, 'send', times))
+            elif self.interval:
+                self.push_repeat(pk, times, last)
+            heapq.heappush(self.heap, (end, pk, 'finish', times))
+        self.schedule = schedule
+        self.version = cache.get(SCHEDULE_VERSION_KEY)
+
+    def push_repeat(self, pk, times, last):
+        """Поставить повтор рассылки через interval после отправки в last"""
+        next_due = last + timezone.timedelta(seconds=self.interval)
+        if next_due <= times[1]:
+            heapq.heappush(self.heap, (next_due, pk, 'send', times))
+
+    def is_current(self, pk, times):
+        """Событие устарело, если рассылку с тех пор изменили или удалили"""
+        return self.schedule.get(pk) == times
+
+    def fire_due(self):
+        now = timezone.now()
+        while self.heap and self.heap[0][0] <= now and not self.stopped.is_set():
+            due, pk, kind, times = heapq.heappop(self.heap)
+            if not self.is_current(pk, times):
+                continue
+
+            if kind == 'finish':
+                Mailing.objects.filter(pk=pk).exclude(status='Завершена').update(
+                    status='Завершена', updated_at=timezone.now()
+                )
+                self.schedule.pop(pk, None)
+                continue
+
+            mailing = Mailing.objects.select_related('message').filter(pk=pk).first()
+            if mailing is None:
+                continue
+            self.dispatch(mailing)
+
+            Mailing.objects.filter(pk=pk).reconcile_status()
+
+            if self.interval:
+                self.push_repeat(pk, times, timezone.now())
+            now = timezone.now()
+
+    def seconds_until_next(self):
+        if not self.heap:
+            return self.poll
+        delay = (self.heap[0][0] - timezone.now()).total_seconds()
+        return max(0, min(delay, self.poll))
+
+    def run(self):
+        self.refresh()
+        next_poll = timezone.now() + timezone.timedelta(seconds=self.poll)
+
+        while not self.stopped.is_set():
+            close_old_connections()
+            self.fire_due()
+
+            schedule_changed.wait(self.seconds_until_next())
+            changed = schedule_changed.is_set()
+            schedule_changed.clear()
+
+            now = timezone.now()
+            if changed or now >= next_poll or cache.get(SCHEDULE_VERSION_KEY) != self.version:
+                self.refresh()
+                next_poll = now + timezone.timedelta(seconds=self.poll)
+
+    def stop(self):
+        self.stopped.set()
+        schedule_changed.set()
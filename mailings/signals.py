@@ -0,0 +1,89 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .counters import forget_mailing, forget_recipient
+from .generations import bump
+from .models import Mailing, MailingAttempt, Message, Recipient
+from .roles import forget_roles
+from .scheduler import notify_schedule_changed
+
+
+@receiver([post_save, post_delete], sender=Mailing)
+def mailing_schedule_changed(sender, instance, **kwargs):
+    """Разбудить планировщик при создании, изменении или удалении рассылки"""
+    notify_schedule_changed()
+
+
+@receiver(pre_delete, sender=Mailing)
+def mailing_counters_deleted(sender, instance, **kwargs):
+    """Убрать попытки удаляемой рассылки из счетчиков владельца (в транзакции удаления)"""
+    forget_mailing(instance)
+
+
+@receiver(pre_delete, sender=Recipient)
+def recipient_counters_deleted(sender, instance, **kwargs):
+    """Убрать попытки удаляемого получателя из счетчиков и итогов (в транзакции удаления)"""
+    forget_recipient(instance)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Сбросить закешированные роли при изменении групп пользователя.
+
+    Группы меняются с двух сторон: user.groups (reverse=False, instance -
+    пользователь) и group.user_set (reverse=True, pk_set - id пользователей).
+    """
+    if reverse:
+        if action == 'pre_clear':
+            forget_roles(instance.user_set.values_list('pk', flat=True))
+        elif action in ('post_add', 'post_remove'):
+            forget_roles(pk_set)
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        forget_roles([instance.pk])
+
+
+@receiver([post_save, pre_delete], sender=Group)
+def group_changed(sender, instance, **kwargs):
+    """Переименование или удаление группы меняет роли всех ее участников"""
+    if instance.pk is not None:
+        forget_roles(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Recipient)
+@receiver([post_save, post_delete], sender=Message)
+@receiver([post_save, post_delete], sender=Mailing)
+def owner_data_changed(sender, instance, **kwargs):
+    """Сбросить кеш владельца при изменении его получателей, сообщений и рассылок"""
+    bump([instance.owner_id])
+
+
+@receiver(post_save, sender=MailingAttempt)
+def attempt_saved(sender, instance, **kwargs):
+    """Попытка, сохраненная по одной (например, в админке).
+
+    post_delete для попыток не подключается: с ним удаление рассылки
+    загружало бы в память все ее попытки вместо одного DELETE. Попытки
+    удаляются вместе с рассылкой, а ее удаление сбрасывает кеш.
+    """
+    bump(Mailing.objects.filter(pk=instance.mailing_id).values_list('owner_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Mailing.recipients.through)
+def mailing_recipients_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Состав получателей рассылки (с любой стороны связи) принадлежит владельцу instance.
+
+    Сами рассылки отмечаются измененными: число получателей есть в списке рассылок.
+    Со стороны получателя (reverse=True) рассылки - pk_set, а при clear их
+    нужно найти до удаления связей.
+    """
+    if reverse:
+        if action == 'pre_clear':
+            instance.mailing_set.touch()
+        elif action in ('post_add', 'post_remove'):
+            Mailing.objects.filter(pk__in=pk_set).touch()
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        Mailing.objects.filter(pk=instance.pk).touch()
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump([instance.owner_id])
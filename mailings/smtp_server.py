@@ -0,0 +1,146 @@
+import asyncio
+import threading
+
+
+class LocalSMTPServer:
+    """Локальный asyncio SMTP-сервер для тестов и замеров без выхода в сеть.
+
+    Понимает минимальный набор команд (EHLO/HELO, MAIL, RCPT, DATA, RSET,
+    NOOP, QUIT), объявляет PIPELINING и считает принятые письма.
+    latency - задержка перед каждым ответом в секундах, имитирует сеть.
+    Адреса из reject получают отказ 550 на RCPT TO, адреса из defer -
+    временный отказ 451. С drop_after сервер молча закрывает сессию на
+    следующей команде MAIL после drop_after принятых в ней писем, как
+    сервер, разрывающий долгие соединения. С keep принятые письма
+    сохраняются в received как пары (получатели, байты DATA).
+
+    Сервер запускается в отдельном потоке со своим циклом событий:
+
+        with LocalSMTPServer(latency=0.02) as server:
+            ... # EMAIL_HOST = server.host, EMAIL_PORT = server.port
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, reject=(), defer=(), drop_after=None,
+                 keep=False):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.reject = {address.lower() for address in reject}
+        self.defer = {address.lower() for address in defer}
+        self.drop_after = drop_after
+        self.keep = keep
+        self.received = []
+        self.messages = 0
+        self.recipients = 0
+        self.sessions = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    async def reply(self, writer, text):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(text.encode() + b'\r\n')
+        await writer.drain()
+
+    async def read_data(self, reader):
+        lines = []
+        while True:
+            line = await reader.readline()
+            if not line or line == b'.\r\n':
+                return b''.join(lines)
+            if self.keep:
+                lines.append(line)
+
+    async def handle(self, reader, writer):
+        self.sessions += 1
+        accepted = []
+        session_messages = 0
+        try:
+            await self.reply(writer, '220 localhost ESMTP')
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', 'replace').strip()
+                verb = command[:4].upper()
+
+                if verb == 'EHLO':
+                    await self.reply(
+                        writer, '250-localhost\r\n250-PIPELINING\r\n250-8BITMIME\r\n250 SMTPUTF8'
+                    )
+                elif verb == 'HELO':
+                    await self.reply(writer, '250 localhost')
+                elif verb == 'MAIL':
+                    if self.drop_after is not None and session_messages >= self.drop_after:
+                        break
+                    accepted = []
+                    await self.reply(writer, '250 OK')
+                elif verb == 'RCPT':
+                    address = command.partition(':')[2].strip().strip('<>').lower()
+                    if address in self.reject:
+                        await self.reply(writer, '550 No such user')
+                    elif address in self.defer:
+                        await self.reply(writer, '451 Try again later')
+                    else:
+                        accepted.append(address)
+                        await self.reply(writer, '250 OK')
+                elif verb == 'DATA':
+                    if not accepted:
+                        await self.reply(writer, '554 No valid recipients')
+                        continue
+                    await self.reply(writer, '354 End data with <CR><LF>.<CR><LF>')
+                    data = await self.read_data(reader)
+                    if self.keep:
+                        self.received.append((accepted, data))
+                    self.messages += 1
+                    session_messages += 1
+                    self.recipients += len(accepted)
+                    accepted = []
+                    await self.reply(writer, '250 OK: queued')
+                elif verb == 'RSET':
+                    accepted = []
+                    await self.reply(writer, '250 OK')
+                elif verb == 'NOOP':
+                    await self.reply(writer, '250 OK')
+                elif verb == 'QUIT':
+                    await self.reply(writer, '221 Bye')
+                    break
+                else:
+                    await self.reply(writer, '502 Command not implemented')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle, self.host, self.port, backlog=1024)
+            )
+            self.port = self.server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
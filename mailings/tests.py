@@ -1,3 +1,1438 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import re
+import smtplib
+import tempfile
+import threading
+from collections import Counter
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from users.models import User
+
+from .async_delivery import send_async
+from .conditional import mailing_stamp
+from .counters import rebuild_counters, record_attempts
+from .delivery import (
+    AttemptBuffer, DeliveryStopped, MailConnection, deliver_mailing, group_by_domain, send_parallel,
+    stop_requested, try_send_batch,
+)
+from .export import export_lines
+from .generations import ALL, bump, cached
+from .imports import ImportFileError, import_recipients
+from .leasing import LeaseLost, renew
+from .management.commands._options import domain_summary
+from .models import (
+    DeliveryChunk, DeliveryJob, DeliveryRollup, Mailing, MailingAttempt, Message, OwnerDeliveryCounter, Recipient
+)
+from .outbox import claim_chunk, enqueue_mailing, process_chunk, process_job
+from .pagination import encode_cursor, keyset_page
+from .prepared import PreparedMessage, serialize
+from .roles import MANAGERS_GROUP, is_manager, role_cache_key
+from .rollups import backfill, hour_of, series
+from .scheduler import MailingScheduler
+from .smtp_server import LocalSMTPServer
+from .throttling import DomainThrottle, recipient_domain
+
+
+# Признак полного просмотра таблицы в плане запроса
+FULL_SCAN = {
+    # SQLite: "SCAN таблица" без "USING INDEX"; проход по индексу в нужном порядке - не полный просмотр
+    'sqlite': re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+
+
+def explain(sql):
+    """Строки плана запроса для SQL с подставленными параметрами"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(sql):
+    """Таблицы, которые запрос просматривает целиком (подзапросы в FROM не считаются)"""
+    pattern = FULL_SCAN[connection.vendor]
+    tables = set(connection.introspection.table_names())
+    return {match for line in explain(sql) for match in pattern.findall(line) if match in tables}
+
+
+@skipUnless(connection.vendor in FULL_SCAN, 'Разбор планов есть только для SQLite и PostgreSQL')
+class QueryPlanTests(TestCase):
+    """Основные запросы страниц и рассылки не должны просматривать таблицы целиком.
+
+    Проверяются запросы владельца рассылок: у менеджеров выборки идут
+    по всем строкам и полный просмотр для них ожидаем.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(email='owner@example.com', username='owner')
+        other = User.objects.create(email='other@example.com', username='other')
+        cls.manager = User.objects.create(email='manager@example.com', username='manager')
+        cls.manager.groups.add(Group.objects.create(name='Менеджеры'))
+
+        now = timezone.now()
+        for user in (cls.owner, other):
+            recipients = Recipient.objects.bulk_create([
+                Recipient(email=f'r{i}@d{i % 5}.example', full_name=f'Получатель {i}', owner=user)
+                for i in range(40)
+            ])
+            message = Message.objects.create(subject='Тема', body='Текст', owner=user)
+            for day in range(5):
+                mailing = Mailing.objects.create(
+                    start_time=now - timezone.timedelta(days=day, hours=1),
+                    end_time=now + timezone.timedelta(hours=1 - day * 2),
+                    message=message,
+                    owner=user,
+                )
+                mailing.recipients.set(recipients)
+                attempts = MailingAttempt.objects.bulk_create([
+                    MailingAttempt(
+                        mailing=mailing,
+                        recipient=recipient,
+                        status='Успешно' if i % 4 else 'Не успешно',
+                        attempt_time=now - timezone.timedelta(days=day, minutes=i),
+                    )
+                    for i, recipient in enumerate(recipients)
+                ])
+                DeliveryRollup.objects.bulk_create([
+                    DeliveryRollup(
+                        hour=hour_of(attempt.attempt_time), owner=user, mailing=mailing,
+                        status=attempt.status, count=1
+                    )
+                    for attempt in attempts
+                ], ignore_conflicts=True)
+        cls.mailing = Mailing.objects.filter(owner=cls.owner).first()
+        cls.attempt = MailingAttempt.objects.filter(mailing__owner=cls.owner).order_by('-attempt_time').first()
+
+    def setUp(self):
+        cache.clear()
+        if connection.vendor == 'postgresql':
+            # На маленькой таблице PostgreSQL выберет Seq Scan и при наличии индекса,
+            # поэтому просим его просматривать таблицу, только если других путей нет
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertNoFullScans(self, queries, allow=()):
+        for query in queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            scans = full_scans(sql) - set(allow)
+            self.assertFalse(scans, f'Полный просмотр {", ".join(sorted(scans))}:\n{sql}\n' + '\n'.join(explain(sql)))
+
+    def assertViewUsesIndexes(self, url, user=None, allow=()):
+        self.client.force_login(user or self.owner)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertNoFullScans(captured.captured_queries, allow)
+
+    def test_recipient_list(self):
+        self.assertViewUsesIndexes(reverse('mailings:recipient_list'))
+
+    def test_message_list(self):
+        self.assertViewUsesIndexes(reverse('mailings:message_list'))
+
+    def test_mailing_list(self):
+        self.assertViewUsesIndexes(reverse('mailings:mailing_list'))
+
+    def test_mailing_detail(self):
+        url = reverse('mailings:mailing_detail', args=[self.mailing.pk])
+        self.assertViewUsesIndexes(url)
+        self.assertViewUsesIndexes(f'{url}?status=Успешно')
+
+    def test_attempt_list(self):
+        url = reverse('mailings:attempt_list')
+        cursor = encode_cursor(self.attempt.attempt_time, self.attempt.pk)
+        self.assertViewUsesIndexes(url)
+        self.assertViewUsesIndexes(f'{url}?after={cursor}')
+        self.assertViewUsesIndexes(f'{url}?before={cursor}')
+        self.assertViewUsesIndexes(f'{url}?status=Не успешно&mailing={self.mailing.pk}')
+        self.assertViewUsesIndexes(f'{url}?recipient=r1@d1.example')
+
+    def test_attempt_list_for_manager(self):
+        # Список рассылок для фильтра менеджера содержит все рассылки
+        self.assertViewUsesIndexes(reverse('mailings:attempt_list'), self.manager, allow=['mailings_mailing'])
+
+    def test_attempt_export(self):
+        url = reverse('mailings:attempt_export')
+        date = timezone.localdate()
+        self.assertViewUsesIndexes(f'{url}?mailing={self.mailing.pk}')
+        self.assertViewUsesIndexes(f'{url}?date_from={date}&date_to={date}&format=jsonl')
+
+    def test_statistics(self):
+        url = reverse('mailings:statistics')
+        date = timezone.localdate()
+        self.assertViewUsesIndexes(url)
+        self.assertViewUsesIndexes(f'{url}?date_from={date - timezone.timedelta(days=2)}&date_to={date}')
+
+    def test_statistics_series(self):
+        url = reverse('mailings:statistics_series')
+        self.assertViewUsesIndexes(url)
+        self.assertViewUsesIndexes(f'{url}?mailing={self.mailing.pk}')
+
+    def test_mailings_to_send(self):
+        now = timezone.now()
+        with CaptureQueriesContext(connection) as captured:
+            list(Mailing.objects.filter(status__in=['Создана', 'Запущена'], start_time__lte=now, end_time__gte=now))
+            list(Mailing.objects.filter(status__in=['Создана', 'Запущена'], end_time__gte=now).values_list('id'))
+            Mailing.objects.filter(status='Запущена', end_time__lt=now).count()
+        self.assertNoFullScans(captured.captured_queries)
+
+
+@override_settings(PAGE_CACHE_ENABLED=False)
+class ConditionalGetTests(TestCase):
+    """Повторный запрос с тем же ETag получает 304 без основного запроса и шаблона"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create(email='owner@example.com', username='owner')
+        cls.recipient = Recipient.objects.create(email='r@example.com', full_name='Получатель', owner=cls.owner)
+        message = Message.objects.create(subject='Тема', body='Текст', owner=cls.owner)
+        now = timezone.now()
+        cls.mailing = Mailing.objects.create(
+            start_time=now - timezone.timedelta(hours=1),
+            end_time=now + timezone.timedelta(hours=1),
+            message=message,
+            owner=cls.owner,
+        )
+        cls.mailing.recipients.add(cls.recipient)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.owner)
+
+    def urls(self):
+        return [
+            reverse('mailings:recipient_list'),
+            reverse('mailings:message_list'),
+            reverse('mailings:mailing_list'),
+            reverse('mailings:mailing_detail', args=[self.mailing.pk]),
+            reverse('mailings:statistics'),
+        ]
+
+    def test_not_modified(self):
+        for url in self.urls():
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with CaptureQueriesContext(connection) as captured:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertFalse(response.templates)
+                # Кроме сессии и пользователя - только отметка изменения данных
+                data_queries = [query['sql'] for query in captured.captured_queries if 'mailings_' in query['sql']]
+                self.assertEqual(len(data_queries), 1, data_queries)
+
+    def test_modified_after_change(self):
+        url = reverse('mailings:recipient_list')
+        etag = self.client.get(url)['ETag']
+        self.recipient.full_name = 'Другой получатель'
+        self.recipient.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Другой получатель')
+
+    def test_stamp_sees_updates_without_signals(self):
+        # update() не вызывает сигналов, отметку меняет поле updated_at
+        mailings = Mailing.objects.filter(pk=self.mailing.pk)
+        before = mailing_stamp(mailings)
+        mailings.touch()
+        self.assertNotEqual(mailing_stamp(mailings), before)
+
+        before = mailing_stamp(mailings)
+        mailings.update(end_time=timezone.now() - timezone.timedelta(minutes=1))
+        self.assertNotEqual(mailing_stamp(mailings), before)
+
+    def test_flash_message_page_is_rendered(self):
+        manager = User.objects.create(email='manager@example.com', username='manager')
+        manager.groups.add(Group.objects.create(name='Менеджеры'))
+        self.client.force_login(manager)
+        url = reverse('mailings:recipient_list')
+        etag = self.client.get(url)['ETag']
+        # Менеджер без прав на правку возвращается к тому же списку с сообщением об ошибке
+        response = self.client.get(
+            reverse('mailings:recipient_update', args=[self.recipient.pk]), HTTP_IF_NONE_MATCH=etag, follow=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'нет прав')
+
+    @override_settings(PAGE_CACHE_ENABLED=True)
+    def test_page_cache_hit_not_modified(self):
+        url = reverse('mailings:message_list')
+        first = self.client.get(url)
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+
+    @override_settings(PAGE_CACHE_ENABLED=True)
+    def test_page_cache_checks_stamp(self):
+        # Изменение без сброса поколения, как из другого процесса с локальным кешем
+        url = reverse('mailings:mailing_detail', args=[self.mailing.pk])
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+        Mailing.objects.filter(pk=self.mailing.pk).update(attempts_total=7, updated_at=timezone.now())
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'всего 7')
+
+
+class ResultCacheTests(TestCase):
+    """Кеш результатов с поколениями включается только для общего кеша"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_local_cache_is_not_used(self):
+        # Локальный кеш процесса не видит сбросов из обработчиков очереди
+        self.assertFalse(settings.SHARED_CACHE)
+        self.assertEqual(cached(ALL, 'test', self.compute), 1)
+        self.assertEqual(cached(ALL, 'test', self.compute), 2)
+
+    @override_settings(RESULT_CACHE_ENABLED=True)
+    def test_bump_invalidates(self):
+        self.assertEqual(cached(ALL, 'test', self.compute), 1)
+        self.assertEqual(cached(ALL, 'test', self.compute), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump([None])
+        self.assertEqual(cached(ALL, 'test', self.compute), 2)
+
+
+def create_mailing(emails, subject='Тема', full_name='Получатель'):
+    """Идущая сейчас рассылка нового владельца получателям emails"""
+    number = User.objects.count()
+    owner = User.objects.create(email=f'owner{number}@example.com', username=f'owner{number}')
+    recipients = Recipient.objects.bulk_create([
+        Recipient(email=email, full_name=full_name, owner=owner) for email in emails
+    ])
+    now = timezone.now()
+    mailing = Mailing.objects.create(
+        start_time=now - timezone.timedelta(hours=1),
+        end_time=now + timezone.timedelta(hours=1),
+        message=Message.objects.create(subject=subject, body='Текст', owner=owner),
+        owner=owner,
+    )
+    mailing.recipients.set(recipients)
+    return mailing
+
+
+def attempt_statuses(mailing):
+    """{email получателя: статус попытки} по рассылке"""
+    return dict(mailing.attempts.values_list('recipient__email', 'status'))
+
+
+class LocalSMTPMixin:
+    """Отправка через SMTP-бэкенд на локальный LocalSMTPServer"""
+    server_options = {}
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.server = LocalSMTPServer(**self.server_options).start()
+        self.addCleanup(self.server.stop)
+        overrides = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST=self.server.host,
+            EMAIL_PORT=self.server.port,
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+            MAILING_THROTTLE=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+
+class PersonalizationFailureTests(LocalSMTPMixin, TestCase):
+    def test_bad_header_fails_only_its_recipient(self):
+        mailing = create_mailing(['a@example.com', 'b@example.com', 'c@example.com'], subject='Привет, {full_name}')
+        # Перевод строки в Ф. И. О. (загрузка из CSV его пропускает) ломает заголовок Subject
+        Recipient.objects.filter(email='b@example.com').update(full_name='Имя\nBcc: x@example.com')
+
+        self.assertEqual(deliver_mailing(mailing), (2, 1))
+        self.assertEqual(attempt_statuses(mailing), {
+            'a@example.com': 'Успешно',
+            'b@example.com': 'Не успешно',
+            'c@example.com': 'Успешно',
+        })
+        self.assertEqual(self.server.messages, 2)
+
+
+class PreparedMessageTests(LocalSMTPMixin, TestCase):
+    """Сообщение кодируется в MIME один раз, получателю меняются только To и Message-ID"""
+    server_options = {'keep': True}
+
+    def test_raw_bytes(self):
+        mailing = create_mailing(['a@example.com', 'b@example.com'])
+        with mock.patch('mailings.prepared.serialize', wraps=serialize) as serialized:
+            self.assertEqual(deliver_mailing(mailing, envelope_batch=1), (2, 0))
+        self.assertEqual(serialized.call_count, 1)
+
+        received = sorted(self.server.received)
+        self.assertEqual([recipients for recipients, data in received], [['a@example.com'], ['b@example.com']])
+        headers = re.compile(rb'^(To|Message-ID): (.*)\r\n', re.MULTILINE)
+        found = [dict(headers.findall(data)) for recipients, data in received]
+        self.assertEqual([fields[b'To'] for fields in found], [b'a@example.com', b'b@example.com'])
+        self.assertNotEqual(found[0][b'Message-ID'], found[1][b'Message-ID'])
+        # Без To и Message-ID письма совпадают байт в байт
+        first, second = (headers.sub(b'', data) for recipients, data in received)
+        self.assertEqual(first, second)
+        self.assertIn(b'Subject: ', first)
+
+
+class EnqueueTests(TestCase):
+    """У рассылки не бывает двух необработанных заданий"""
+
+    def setUp(self):
+        self.mailing = create_mailing(['a@example.com', 'b@example.com'])
+
+    def test_repeated_enqueue_returns_open_job(self):
+        job, created = enqueue_mailing(self.mailing)
+        self.assertTrue(created)
+        self.assertEqual(enqueue_mailing(self.mailing), (job, False))
+        self.assertEqual(self.mailing.jobs.count(), 1)
+
+    def test_concurrent_enqueue(self):
+        job, created = enqueue_mailing(self.mailing)
+        # Параллельный вызов проверил очередь до того, как появилось первое задание
+        with mock.patch('mailings.outbox.open_job', side_effect=[None, job]):
+            self.assertEqual(enqueue_mailing(self.mailing), (job, False))
+        self.assertEqual(self.mailing.jobs.count(), 1)
+        self.assertEqual(job.chunks.count(), 1)
+
+    def test_constraint(self):
+        DeliveryJob.objects.create(mailing=self.mailing)
+        with self.assertRaises(IntegrityError):
+            DeliveryJob.objects.create(mailing=self.mailing, status='Выполняется')
+
+    def test_closed_job_does_not_block(self):
+        DeliveryJob.objects.create(mailing=self.mailing, status='Выполнено')
+        job, created = enqueue_mailing(self.mailing)
+        self.assertTrue(created)
+
+
+class SMTPDeliveryTests(LocalSMTPMixin, TestCase):
+    """Доставка через LocalSMTPServer: отказы на RCPT, разрыв сессии, попытки и итоги"""
+    server_options = {'reject': ['bad@example.com'], 'defer': ['later@example.com'], 'drop_after': 2}
+    emails = ['a@example.com', 'b@example.com', 'bad@example.com', 'c@example.com', 'later@example.com']
+
+    def assertDelivered(self, mailing, result):
+        self.assertEqual(result, (3, 2))
+        statuses = attempt_statuses(mailing)
+        self.assertEqual(statuses, {
+            'a@example.com': 'Успешно',
+            'b@example.com': 'Успешно',
+            'bad@example.com': 'Не успешно',
+            'c@example.com': 'Успешно',
+            'later@example.com': 'Не успешно',
+        })
+        responses = dict(mailing.attempts.values_list('recipient__email', 'server_response'))
+        self.assertIn('550', responses['bad@example.com'])
+        self.assertIn('451', responses['later@example.com'])
+
+        mailing.refresh_from_db()
+        self.assertEqual(
+            (mailing.attempts_total, mailing.attempts_successful, mailing.attempts_failed), (5, 3, 2)
+        )
+        self.assertEqual(mailing.last_attempt_at, mailing.attempts.order_by('-attempt_time')[0].attempt_time)
+        counter = OwnerDeliveryCounter.objects.get(owner=mailing.owner)
+        self.assertEqual((counter.attempts_total, counter.attempts_successful, counter.attempts_failed), (5, 3, 2))
+        rollups = dict(
+            DeliveryRollup.objects.filter(mailing=mailing).values('status').annotate(n=Sum('count')).values_list('status', 'n')
+        )
+        self.assertEqual(rollups, {'Успешно': 3, 'Не успешно': 2})
+
+    def test_sequential(self):
+        mailing = create_mailing(self.emails)
+        self.assertDelivered(mailing, deliver_mailing(mailing))
+        self.assertEqual(self.server.messages, 3)
+        # После двух писем сервер закрыл сессию, третье ушло через новое соединение
+        self.assertEqual(self.server.sessions, 2)
+
+    def test_async(self):
+        mailing = create_mailing(self.emails)
+        self.assertDelivered(mailing, deliver_mailing(mailing, engine='async', concurrency=1))
+        self.assertEqual(self.server.messages, 3)
+        self.assertEqual(self.server.sessions, 2)
+
+    def test_envelope_batch(self):
+        mailing = create_mailing(self.emails)
+        self.assertDelivered(mailing, deliver_mailing(mailing, envelope_batch=10))
+        # Одно письмо на всех принятых получателей
+        self.assertEqual((self.server.messages, self.server.recipients), (1, 3))
+
+    def test_try_send_batch(self):
+        mailing = create_mailing(['a@example.com', 'bad@example.com', 'later@example.com'])
+        recipients = list(mailing.recipients.order_by('email'))
+        prepared = PreparedMessage(mailing.message, envelope_batch=10)
+        with MailConnection() as connection:
+            results = try_send_batch(connection, prepared.build_batch(recipients), recipients)
+        self.assertEqual(
+            [(recipient.email, success) for recipient, success, response in results],
+            [('a@example.com', True), ('bad@example.com', False), ('later@example.com', False)]
+        )
+        self.assertIn('550', results[1][2])
+        self.assertIn('451', results[2][2])
+
+    def test_all_recipients_refused(self):
+        mailing = create_mailing(['bad@example.com'])
+        recipients = list(mailing.recipients.all())
+        prepared = PreparedMessage(mailing.message, envelope_batch=10)
+        with MailConnection() as connection:
+            results = try_send_batch(connection, prepared.build_batch(recipients), recipients)
+        self.assertEqual(len(results), 1)
+        self.assertFalse(results[0][1])
+        self.assertIn('550', results[0][2])
+        self.assertEqual(self.server.messages, 0)
+
+
+class EngineParityTests(LocalSMTPMixin, TestCase):
+    """Пул потоков и асинхронный движок дают те же итоги, что и последовательная отправка"""
+    server_options = {'reject': ['bad@b.example'], 'defer': ['later@c.example']}
+    emails = (
+        [f'user{i}@a.example' for i in range(60)]
+        + [f'user{i}@b.example' for i in range(5)] + ['bad@b.example']
+        + [f'user{i}@c.example' for i in range(3)] + ['later@c.example']
+        + [f'user{i}@d{i}.example' for i in range(6)]
+    )
+
+    def deliver(self, **options):
+        mailing = create_mailing(self.emails)
+        domains = Counter()
+        result = deliver_mailing(mailing, domain_counts=domains, **options)
+        return result, domain_summary(domains), attempt_statuses(mailing)
+
+    def test_same_totals(self):
+        expected = self.deliver()
+        self.assertEqual(expected[0], (74, 2))
+        self.assertEqual(
+            expected[1], 'a.example: 60, b.example: 6, c.example: 4, d0.example: 1, d1.example: 1 и еще 4 доменов'
+        )
+        self.assertEqual(self.deliver(workers=4), expected)
+        self.assertEqual(self.deliver(engine='async', concurrency=8), expected)
+
+
+class AsyncStopTests(LocalSMTPMixin, TestCase):
+    """Остановка асинхронного движка не теряет результаты начатых сессий"""
+    server_options = {'latency': 0.01}
+
+    def test_stop_records_in_flight_sessions(self):
+        mailing = create_mailing([f'user{i}@example.com' for i in range(200)])
+        self.addCleanup(stop_requested.clear)
+        reported = []
+
+        def terminate(recipient, success, response):
+            reported.append(recipient)
+            if len(reported) == 5:
+                stop_requested.set()
+
+        with self.assertRaises(DeliveryStopped):
+            deliver_mailing(mailing, on_result=terminate, engine='async', concurrency=20, envelope_batch=1)
+        self.assertEqual(MailingAttempt.objects.filter(mailing=mailing).count(), self.server.messages)
+        self.assertLess(self.server.messages, 200)
+        self.assertEqual(len(reported), 5)
+
+
+class DomainGroupingTests(TestCase):
+    """Группировка получателей по доменам и серии пула потоков"""
+
+    def recipients(self, counts):
+        return [
+            SimpleNamespace(email=f'user{i}@{domain}')
+            for domain, count in counts
+            for i in range(count)
+        ]
+
+    def test_group_by_domain(self):
+        recipients = self.recipients([('b.example', 2), ('a.example', 2), ('c.example', 3)])
+        recipients.append(SimpleNamespace(email='upper@B.Example'))
+        buckets = group_by_domain(recipients)
+        # Крупные домены первыми, при равенстве - по имени; домен без учета регистра
+        self.assertEqual([domain for domain, bucket in buckets], ['b.example', 'c.example', 'a.example'])
+        self.assertEqual(
+            [recipient.email for recipient in buckets[0][1]],
+            ['user0@b.example', 'user1@b.example', 'upper@B.Example']
+        )
+        self.assertEqual(sum(len(bucket) for domain, bucket in buckets), len(recipients))
+
+    def slices(self, counts, envelope_batch):
+        """Серии, которые send_parallel отдает потокам: [(домен, размер)]"""
+        sent = []
+
+        def send_group(connection, prepared, recipients, throttle=None, stop=None):
+            sent.append((recipient_domain(recipients[0].email), len(recipients)))
+            self.assertEqual({recipient_domain(recipient.email) for recipient in recipients}, {sent[-1][0]})
+            return [(recipient, True, '') for recipient in recipients]
+
+        recipients = self.recipients(counts)
+        prepared = SimpleNamespace(envelope_batch=envelope_batch)
+        with mock.patch('mailings.delivery.send_group', send_group):
+            results = list(send_parallel(prepared, group_by_domain(recipients), 2))
+        self.assertCountEqual([recipient for recipient, success, response in results], recipients)
+        return sorted(sent)
+
+    def test_slice_boundaries(self):
+        self.assertEqual(
+            self.slices([('a.example', 120), ('b.example', 50), ('c.example', 7)], 1),
+            [('a.example', 20), ('a.example', 50), ('a.example', 50), ('b.example', 50), ('c.example', 7)]
+        )
+
+    def test_slice_is_multiple_of_envelope_batch(self):
+        # Серия 48 = 16 пакетов по 3 получателя, пакеты не делятся между потоками
+        self.assertEqual(
+            self.slices([('a.example', 100)], 3),
+            [('a.example', 4), ('a.example', 48), ('a.example', 48)]
+        )
+
+
+class DomainThrottleTests(TestCase):
+    """Ограничитель доменов: AIMD по ответам сервера и окно параллельных отправок"""
+
+    def setUp(self):
+        self.throttle = DomainThrottle(rate=4, max_rate=100, concurrency=2, max_concurrency=10)
+
+    def state(self, domain='example.com'):
+        return self.throttle.state(domain)
+
+    def test_success_increases(self):
+        self.throttle.acquire('example.com')
+        self.throttle.release('example.com')
+        self.assertEqual((self.state().rate, self.state().concurrency, self.state().in_flight), (4.25, 2.5, 0))
+
+    def test_temporary_error_halves(self):
+        self.throttle.acquire('example.com')
+        self.throttle.release('example.com', smtplib.SMTPResponseException(451, b'Try later'))
+        self.assertEqual((self.state().rate, self.state().concurrency), (2, 1))
+        self.assertLessEqual(self.state().tokens, 0)
+
+        self.state().tokens = 1
+        self.throttle.acquire('example.com')
+        self.throttle.release('example.com', smtplib.SMTPRecipientsRefused({'a@example.com': (450, b'Busy')}))
+        self.assertEqual((self.state().rate, self.state().concurrency), (1, 1))
+
+    def test_permanent_error_keeps_rate(self):
+        self.throttle.acquire('example.com')
+        self.throttle.release('example.com', smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'No such user')}))
+        self.assertEqual((self.state().rate, self.state().concurrency), (4, 2))
+
+    def test_concurrency_limit_per_domain(self):
+        self.state().tokens = self.state('other.com').tokens = 4
+        self.assertEqual(self.throttle.try_acquire('example.com'), 0)
+        self.assertEqual(self.throttle.try_acquire('example.com'), 0)
+        # Окно домена занято: ждать освобождения слота, а не токена
+        self.assertIsNone(self.throttle.try_acquire('example.com'))
+        self.assertEqual(self.throttle.try_acquire('other.com'), 0)
+        self.throttle.release('example.com')
+        self.assertEqual(self.throttle.try_acquire('example.com'), 0)
+
+    def test_async_waiter_woken_by_release(self):
+        throttle = DomainThrottle(rate=1000, max_rate=1000, concurrency=1, max_concurrency=1)
+
+        async def scenario():
+            await throttle.acquire_async('example.com')
+            waiter = asyncio.create_task(throttle.acquire_async('example.com'))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+            # Слот возвращает другой поток, как поток пула или синхронная отправка
+            threading.Timer(0.05, throttle.release, ['example.com']).start()
+            await asyncio.wait_for(waiter, 1)
+
+        asyncio.run(scenario())
+        self.assertEqual(throttle.state('example.com').in_flight, 1)
+        self.assertEqual(throttle.state('example.com').waiters, [])
+
+
+class ThrottledDeliveryTests(LocalSMTPMixin, TestCase):
+    """Медленный домен не занимает общие слоты движков отправки"""
+
+    def test_slow_domain_does_not_block_others(self):
+        slow = [f'user{i}@slow.example' for i in range(6)]
+        fast = ['a@one.example', 'b@two.example', 'c@three.example']
+        mailing = create_mailing(slow + fast)
+        prepared = PreparedMessage(mailing.message, envelope_batch=1)
+        throttle = DomainThrottle(rate=5, max_rate=5, concurrency=1, max_concurrency=1)
+
+        results = list(send_async(prepared, group_by_domain(mailing.recipients.all()), 2, throttle))
+        order = [recipient.email for recipient, success, response in results]
+        self.assertEqual(len(order), 9)
+        # Письма в быстрые домены уходят, пока медленный ждет своей скорости
+        self.assertLessEqual(max(order.index(email) for email in fast), 4)
+
+    def test_pool_limits_slices_per_domain(self):
+        mailing = create_mailing([f'user{i}@slow.example' for i in range(120)] + ['a@fast.example'])
+        prepared = PreparedMessage(mailing.message, envelope_batch=1)
+        throttle = DomainThrottle(rate=1000, max_rate=1000, concurrency=1, max_concurrency=1)
+
+        results = list(send_parallel(prepared, group_by_domain(mailing.recipients.all()), 2, throttle))
+        order = [recipient.email for recipient, success, response in results]
+        self.assertEqual(len(order), 121)
+        # Вторая серия медленного домена не заняла поток раньше письма в другой домен
+        self.assertLess(order.index('a@fast.example'), 100)
+
+
+class LeasingTests(TransactionTestCase):
+    """Аренда частей задания: одну часть обрабатывает один обработчик"""
+
+    def setUp(self):
+        self.job, created = enqueue_mailing(create_mailing(['a@example.com', 'b@example.com']))
+        self.chunk = self.job.chunks.get()
+
+    def expire(self, chunk):
+        DeliveryChunk.objects.filter(pk=chunk.pk).update(lease_expires_at=timezone.now() - timezone.timedelta(seconds=1))
+
+    def test_two_workers_claim_one_chunk(self):
+        workers = [f'worker-{i}' for i in range(4)]
+        claimed = {}
+        barrier = threading.Barrier(len(workers))
+
+        def run(worker):
+            try:
+                barrier.wait()
+                chunk = claim_chunk(worker, self.job)
+                claimed[worker] = chunk and chunk.pk
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=[worker]) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        winners = [worker for worker, pk in claimed.items() if pk is not None]
+        self.assertEqual(len(claimed), len(workers))
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(DeliveryChunk.objects.get(pk=self.chunk.pk).lease_owner, winners[0])
+
+    def test_active_lease_is_not_taken(self):
+        self.assertEqual(claim_chunk('first', self.job), self.chunk)
+        self.assertIsNone(claim_chunk('second', self.job))
+        renew(DeliveryChunk, self.chunk.pk, 'first', 60)
+
+    def test_expired_lease_is_taken_over(self):
+        claim_chunk('first', self.job)
+        self.expire(self.chunk)
+        self.assertEqual(claim_chunk('second', self.job), self.chunk)
+        self.assertEqual(DeliveryChunk.objects.get(pk=self.chunk.pk).lease_owner, 'second')
+        # Прежний обработчик узнает о потере аренды при продлении
+        with self.assertRaises(LeaseLost):
+            renew(DeliveryChunk, self.chunk.pk, 'first', 60)
+
+
+class CheckpointTests(TransactionTestCase):
+    """Перезапуск прерванного задания не шлет письма повторно"""
+
+    def test_restart_skips_processed_recipients(self):
+        job, created = enqueue_mailing(create_mailing(['a@example.com', 'b@example.com', 'c@example.com']))
+        chunk = claim_chunk('first', job)
+
+        def crash(recipient, success, response):
+            raise RuntimeError('Обработчик упал')
+
+        # Обработчик падает после первого письма, попытка и отметка уже в буфере
+        with self.assertRaises(RuntimeError):
+            process_chunk(chunk, 'first', on_result=crash)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(job.checkpoints.count(), 1)
+
+        DeliveryChunk.objects.filter(pk=chunk.pk).update(lease_expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertEqual(process_job(job, 'second'), (2, 0))
+
+        sent = [message.to[0] for message in mail.outbox]
+        self.assertEqual(sorted(sent), ['a@example.com', 'b@example.com', 'c@example.com'])
+        self.assertEqual(MailingAttempt.objects.filter(mailing=job.mailing).count(), 3)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.success_count, job.fail_count), ('Выполнено', 3, 0))
+        # Отметки удаляются вместе с закрытием задания
+        self.assertFalse(job.checkpoints.exists())
+
+    def test_stop_between_recipients(self):
+        job, created = enqueue_mailing(create_mailing(['a@example.com', 'b@example.com', 'c@example.com']))
+        chunk = claim_chunk('first', job)
+        self.addCleanup(stop_requested.clear)
+
+        def terminate(recipient, success, response):
+            # Так поступает обработчик SIGTERM в командах отправки
+            stop_requested.set()
+
+        with self.assertRaises(DeliveryStopped):
+            with AttemptBuffer() as attempts:
+                process_chunk(chunk, 'first', on_result=terminate, attempts=attempts)
+        # Попытка отправленного письма записана, часть не закрыта
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(MailingAttempt.objects.filter(mailing=job.mailing).count(), 1)
+        self.assertEqual(job.checkpoints.count(), 1)
+        chunk.refresh_from_db()
+        self.assertIsNone(chunk.done_at)
+
+        stop_requested.clear()
+        DeliveryChunk.objects.filter(pk=chunk.pk).update(lease_expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertEqual(process_job(job, 'second'), (2, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(MailingAttempt.objects.filter(mailing=job.mailing).count(), 3)
+
+    @override_settings(MAILING_THROTTLE=False)
+    def test_stop_with_workers(self):
+        mailing = create_mailing([f'user{i}@example.com' for i in range(600)])
+        self.addCleanup(stop_requested.clear)
+        reported = []
+
+        def terminate(recipient, success, response):
+            reported.append(recipient)
+            if len(reported) == 5:
+                stop_requested.set()
+
+        with self.assertRaises(DeliveryStopped):
+            deliver_mailing(mailing, on_result=terminate, workers=4)
+        # Письма, уже отправленные потоками пула, записаны; новые серии не запускались
+        self.assertEqual(MailingAttempt.objects.filter(mailing=mailing).count(), len(mail.outbox))
+        self.assertLess(len(mail.outbox), 600)
+        self.assertEqual(len(reported), 5)
+
+
+class SchedulerTests(TestCase):
+    """Планировщик не будит себя зря и не отправляет рассылку повторно после перезапуска"""
+
+    def setUp(self):
+        self.mailing = create_mailing(['a@example.com'])
+        self.dispatched = []
+
+    def scheduler(self, **options):
+        scheduler = MailingScheduler(lambda mailing: self.dispatched.append(mailing.pk), **options)
+        scheduler.refresh()
+        return scheduler
+
+    def test_dispatches_once(self):
+        scheduler = self.scheduler()
+        scheduler.fire_due()
+        scheduler.fire_due()
+        self.assertEqual(self.dispatched, [self.mailing.pk])
+
+    def test_restart_skips_dispatched_mailing(self):
+        enqueue_mailing(self.mailing)
+        self.scheduler().fire_due()
+        self.assertEqual(self.dispatched, [])
+
+    def test_job_before_start_time_does_not_count(self):
+        job, created = enqueue_mailing(self.mailing)
+        DeliveryJob.objects.filter(pk=job.pk).update(created_at=self.mailing.start_time - timezone.timedelta(days=1))
+        self.scheduler().fire_due()
+        self.assertEqual(self.dispatched, [self.mailing.pk])
+
+    def test_restart_keeps_interval(self):
+        job, created = enqueue_mailing(self.mailing)
+        scheduler = self.scheduler(interval=600)
+        scheduler.fire_due()
+        self.assertEqual(self.dispatched, [])
+        # Следующий повтор - через interval после последнего задания
+        repeats = [due for due, pk, kind, times in scheduler.heap if kind == 'send']
+        self.assertEqual(repeats, [job.created_at + timezone.timedelta(seconds=600)])
+
+    def test_sleeps_until_event_or_poll(self):
+        scheduler = self.scheduler(poll=30)
+        scheduler.heap.clear()
+        self.assertEqual(scheduler.seconds_until_next(), 30)
+        Mailing.objects.filter(pk=self.mailing.pk).update(
+            start_time=timezone.now() + timezone.timedelta(hours=1)
+        )
+        scheduler.refresh()
+        self.assertEqual(scheduler.seconds_until_next(), 30)
+        Mailing.objects.filter(pk=self.mailing.pk).update(
+            start_time=timezone.now() + timezone.timedelta(seconds=10)
+        )
+        scheduler.refresh()
+        self.assertTrue(0 < scheduler.seconds_until_next() <= 10)
+
+
+def write_attempts(mailing, rows):
+    """Записать попытки [(получатель, статус, время)] так же, как AttemptBuffer.flush"""
+    attempts = [
+        MailingAttempt(mailing=mailing, recipient=recipient, status=status, attempt_time=moment)
+        for recipient, status, moment in rows
+    ]
+    with transaction.atomic():
+        MailingAttempt.objects.bulk_create(attempts)
+        record_attempts(attempts)
+    return attempts
+
+
+class DeliveryCounterTests(TestCase):
+    """Счетчики рассылок и владельцев совпадают с таблицей попыток"""
+
+    def setUp(self):
+        self.first = create_mailing(['a@example.com', 'b@example.com', 'c@example.com'])
+        self.owner = self.first.owner
+        self.second = Mailing.objects.create(
+            start_time=self.first.start_time,
+            end_time=self.first.end_time,
+            message=self.first.message,
+            owner=self.owner,
+        )
+        self.second.recipients.set(self.first.recipients.all())
+        self.recipients = list(self.first.recipients.order_by('email'))
+
+    def counters(self, mailing):
+        mailing.refresh_from_db()
+        return mailing.attempts_total, mailing.attempts_successful, mailing.attempts_failed
+
+    def owner_counters(self):
+        counter = OwnerDeliveryCounter.objects.get(owner=self.owner)
+        return counter.attempts_total, counter.attempts_successful, counter.attempts_failed
+
+    def test_buffer_flushes_update_counters(self):
+        # Пачки по две попытки: счетчики прибавляются при каждом сбросе буфера
+        with AttemptBuffer(batch_size=2) as attempts:
+            for i, recipient in enumerate(self.recipients + self.recipients[:2]):
+                attempts.add(self.first.pk, recipient.pk, i % 3 != 2, '')
+            for recipient in self.recipients[:2]:
+                attempts.add(self.second.pk, recipient.pk, False, '')
+
+        self.assertEqual(self.counters(self.first), (5, 4, 1))
+        self.assertEqual(self.counters(self.second), (2, 0, 2))
+        self.assertEqual(self.owner_counters(), (7, 4, 3))
+        last = MailingAttempt.objects.filter(mailing=self.first).order_by('-attempt_time')[0].attempt_time
+        self.assertEqual(self.first.last_attempt_at, last)
+        self.assertEqual(OwnerDeliveryCounter.objects.get(owner=self.owner).last_attempt_at,
+                         MailingAttempt.objects.order_by('-attempt_time')[0].attempt_time)
+        self.assertEqual(rebuild_counters(), (0, 1))
+
+    def test_rebuild_fixes_drift(self):
+        now = timezone.now()
+        write_attempts(self.first, [(recipient, 'Успешно', now) for recipient in self.recipients])
+        Mailing.objects.filter(pk=self.first.pk).update(attempts_total=100)
+        OwnerDeliveryCounter.objects.filter(owner=self.owner).update(attempts_failed=5)
+
+        self.assertEqual(rebuild_counters(), (1, 1))
+        self.assertEqual(self.counters(self.first), (3, 3, 0))
+        self.assertEqual(self.counters(self.second), (0, 0, 0))
+        self.assertEqual(self.owner_counters(), (3, 3, 0))
+
+    def test_deleted_mailing_is_subtracted(self):
+        now = timezone.now()
+        write_attempts(self.first, [(self.recipients[0], 'Успешно', now)])
+        write_attempts(self.second, [(recipient, 'Не успешно', now) for recipient in self.recipients])
+        self.assertEqual(self.owner_counters(), (4, 1, 3))
+        # Объект загружен до записи попыток, вычитаются счетчики из БД
+        self.second.delete()
+        self.assertEqual(self.owner_counters(), (1, 1, 0))
+
+    def test_deleted_recipient_is_subtracted(self):
+        now = timezone.now()
+        earlier = now - timezone.timedelta(hours=3)
+        first, second, third = self.recipients
+        write_attempts(self.first, [(first, 'Успешно', earlier), (second, 'Не успешно', now), (third, 'Успешно', now)])
+        write_attempts(self.second, [(second, 'Успешно', now), (second, 'Не успешно', now)])
+
+        second.delete()
+        self.assertEqual(self.counters(self.first), (2, 2, 0))
+        self.assertEqual(self.counters(self.second), (0, 0, 0))
+        self.assertEqual(self.owner_counters(), (2, 2, 0))
+        remaining = MailingAttempt.objects.filter(mailing=self.first).aggregate(last=Max('attempt_time'))
+        self.assertEqual(self.first.last_attempt_at, remaining['last'])
+        self.assertIsNone(self.second.last_attempt_at)
+        # Итоги по часам совпадают с оставшимися попытками, пустые строки удалены
+        rollups = {
+            (mailing_id, status): count
+            for mailing_id, status, count in DeliveryRollup.objects.values_list('mailing', 'status').annotate(
+                count=Sum('count')
+            )
+        }
+        self.assertEqual(rollups, {(self.first.pk, 'Успешно'): 2})
+        self.assertFalse(DeliveryRollup.objects.filter(count=0).exists())
+        self.assertEqual(rebuild_counters(), (0, 1))
+        self.assertEqual(OwnerDeliveryCounter.objects.get(owner=self.owner).last_attempt_at, now)
+
+
+class RollupTests(TestCase):
+    """Почасовые итоги совпадают с попытками, из которых они собраны"""
+
+    def setUp(self):
+        self.mailing = create_mailing(['a@example.com', 'b@example.com'])
+        self.start = hour_of(timezone.now()) - timezone.timedelta(hours=5)
+        first, second = self.mailing.recipients.order_by('email')
+        minutes = timezone.timedelta(minutes=1)
+        write_attempts(self.mailing, [
+            (first, 'Успешно', self.start + 10 * minutes),
+            (second, 'Не успешно', self.start + 20 * minutes),
+        ])
+        write_attempts(self.mailing, [
+            (second, 'Успешно', self.start + 125 * minutes),
+            (first, 'Успешно', self.start + 59 * minutes),
+        ])
+
+    def rollups(self):
+        return {
+            (hour, status): count
+            for hour, status, count in DeliveryRollup.objects.filter(owner=self.mailing.owner).values_list(
+                'hour', 'status', 'count'
+            )
+        }
+
+    def test_rollups_match_attempts(self):
+        two_hours = timezone.timedelta(hours=2)
+        expected = {
+            (self.start, 'Успешно'): 2,
+            (self.start, 'Не успешно'): 1,
+            (self.start + two_hours, 'Успешно'): 1,
+        }
+        self.assertEqual(self.rollups(), expected)
+        # Пересборка по одной попытке за раз складывает итоги между диапазонами
+        list(backfill(chunk_size=1))
+        self.assertEqual(self.rollups(), expected)
+
+    def test_series(self):
+        rollups = DeliveryRollup.objects.filter(owner=self.mailing.owner)
+        data = series(rollups, self.start, self.start + timezone.timedelta(hours=5))
+        self.assertEqual(data['granularity'], 'hour')
+        self.assertEqual(len(data['labels']), 5)
+        self.assertEqual(data['successful'], [2, 0, 1, 0, 0])
+        self.assertEqual(data['failed'], [1, 0, 0, 0, 0])
+
+        # Больше недели - по дням, сумма та же
+        end = self.start + timezone.timedelta(days=10)
+        daily = series(DeliveryRollup.objects.all(), end - timezone.timedelta(days=14), end)
+        self.assertEqual(daily['granularity'], 'day')
+        self.assertEqual((sum(daily['successful']), sum(daily['failed'])), (3, 1))
+
+
+class MailingStatusTests(TestCase):
+    """Статус рассылки в SQL и его запись одним UPDATE на границах периода"""
+
+    def setUp(self):
+        self.now = timezone.now()
+        second = timezone.timedelta(seconds=1)
+        template = create_mailing(['a@example.com'])
+        periods = {
+            'future': (self.now + second, self.now + 2 * second),
+            'starts_now': (self.now, self.now + second),
+            'ends_now': (self.now - second, self.now),
+            'ended': (self.now - 2 * second, self.now - timezone.timedelta(microseconds=1)),
+        }
+        self.mailings = {
+            name: Mailing.objects.create(
+                start_time=start, end_time=end, message=template.message, owner=template.owner, status='Создана'
+            )
+            for name, (start, end) in periods.items()
+        }
+        template.delete()
+
+    def statuses(self, queryset, field):
+        names = {mailing.pk: name for name, mailing in self.mailings.items()}
+        return {names[pk]: status for pk, status in queryset.values_list('pk', field)}
+
+    def test_current_status(self):
+        self.assertEqual(self.statuses(Mailing.objects.with_current_status(self.now), 'current_status'), {
+            'future': 'Создана',
+            'starts_now': 'Запущена',
+            'ends_now': 'Запущена',
+            'ended': 'Завершена',
+        })
+        self.assertEqual(
+            set(Mailing.objects.in_status('Запущена', self.now).values_list('pk', flat=True)),
+            {self.mailings['starts_now'].pk, self.mailings['ends_now'].pk}
+        )
+
+    def test_reconcile_updates_only_stale(self):
+        self.assertEqual(Mailing.objects.reconcile_status(self.now), 3)
+        self.assertEqual(
+            self.statuses(Mailing.objects.all(), 'status'),
+            self.statuses(Mailing.objects.with_current_status(self.now), 'current_status')
+        )
+        self.assertEqual(Mailing.objects.reconcile_status(self.now), 0)
+        # Через секунду запускается 'future', а 'starts_now' и 'ends_now' завершаются
+        later = self.now + timezone.timedelta(seconds=1, microseconds=1)
+        self.assertEqual(Mailing.objects.reconcile_status(later), 3)
+        self.assertEqual(self.statuses(Mailing.objects.all(), 'status'), {
+            'future': 'Запущена',
+            'starts_now': 'Завершена',
+            'ends_now': 'Завершена',
+            'ended': 'Завершена',
+        })
+
+    def test_disabled_mailing(self):
+        mailing = self.mailings['starts_now']
+        admin = User.objects.create(email='admin@example.com', username='admin', is_staff=True, is_superuser=True)
+        self.client.force_login(admin)
+        self.client.post(reverse('mailings:mailing_disable', args=[mailing.pk]))
+        mailing.refresh_from_db()
+        self.assertEqual(mailing.status, 'Завершена')
+        self.assertLess(mailing.end_time, timezone.now())
+        # Отключенная рассылка уже в актуальном статусе, UPDATE ее не трогает
+        self.assertEqual(Mailing.objects.filter(pk=mailing.pk).reconcile_status(), 0)
+        self.assertEqual(Mailing.objects.with_current_status().get(pk=mailing.pk).current_status, 'Завершена')
+
+
+class StatisticsViewTests(TestCase):
+    """Цифры страницы статистики совпадают с попытками, за все время и за период"""
+
+    def setUp(self):
+        self.running = create_mailing(['a@example.com', 'b@example.com', 'c@example.com'])
+        self.owner = self.running.owner
+        now = timezone.now()
+        self.finished = Mailing.objects.create(
+            start_time=now - timezone.timedelta(days=20),
+            end_time=now - timezone.timedelta(days=1),
+            message=self.running.message,
+            owner=self.owner,
+        )
+        self.finished.recipients.set(self.running.recipients.all())
+        a, b, c = self.running.recipients.order_by('email')
+        self.today = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+        old = self.today - timezone.timedelta(days=10)
+        write_attempts(self.running, [(a, 'Успешно', self.today), (b, 'Не успешно', self.today), (c, 'Успешно', old)])
+        write_attempts(self.finished, [(a, 'Успешно', old), (b, 'Не успешно', old)])
+        # Чужая рассылка не попадает в статистику владельца
+        other = create_mailing(['x@example.com'])
+        write_attempts(other, [(other.recipients.get(), 'Успешно', self.today)])
+        self.client.force_login(self.owner)
+
+    def get(self, **params):
+        response = self.client.get(reverse('mailings:statistics'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def totals(self, context):
+        return {name: context[name] for name in (
+            'total_mailings', 'active_mailings', 'completed_mailings',
+            'total_attempts', 'successful_attempts', 'failed_attempts',
+        )}
+
+    def per_mailing(self, context):
+        return {
+            mailing.pk: (mailing.current_status, mailing.total_attempts, mailing.successful, mailing.failed)
+            for mailing in context['page_obj']
+        }
+
+    def test_all_time(self):
+        context = self.get()
+        self.assertEqual(self.totals(context), {
+            'total_mailings': 2, 'active_mailings': 1, 'completed_mailings': 1,
+            'total_attempts': 5, 'successful_attempts': 3, 'failed_attempts': 2,
+        })
+        self.assertEqual(self.per_mailing(context), {
+            self.running.pk: ('Запущена', 3, 2, 1),
+            self.finished.pk: ('Завершена', 2, 1, 1),
+        })
+
+    def test_period(self):
+        day = self.today.date().isoformat()
+        context = self.get(date_from=day, date_to=day)
+        self.assertEqual(
+            (context['total_attempts'], context['successful_attempts'], context['failed_attempts']), (2, 1, 1)
+        )
+        self.assertEqual(self.per_mailing(context), {
+            self.running.pk: ('Запущена', 2, 1, 1),
+            self.finished.pk: ('Завершена', 0, 0, 0),
+        })
+        # Период, начатый позже всех попыток, пуст; число рассылок от периода не зависит
+        later = (self.today + timezone.timedelta(days=1)).date().isoformat()
+        context = self.get(date_from=later)
+        self.assertEqual(self.totals(context), {
+            'total_mailings': 2, 'active_mailings': 1, 'completed_mailings': 1,
+            'total_attempts': 0, 'successful_attempts': 0, 'failed_attempts': 0,
+        })
+
+    def test_manager_sees_everyone(self):
+        manager = User.objects.create(email='manager@example.com', username='manager')
+        manager.groups.add(Group.objects.create(name=MANAGERS_GROUP))
+        self.client.force_login(manager)
+        context = self.get()
+        self.assertEqual(
+            (context['total_mailings'], context['total_attempts'], context['successful_attempts']), (3, 6, 4)
+        )
+
+
+class KeysetPaginationTests(TestCase):
+    """Листание по курсору (время, id) без пропусков и повторов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        mailing = create_mailing(['a@example.com'])
+        recipient = mailing.recipients.get()
+        now = timezone.now()
+        # Несколько попыток с одинаковым временем: порядок внутри него задает id
+        moments = [now, now, now, now - timezone.timedelta(minutes=1), now - timezone.timedelta(minutes=1),
+                   now - timezone.timedelta(minutes=2), now - timezone.timedelta(minutes=3)]
+        MailingAttempt.objects.bulk_create([
+            MailingAttempt(mailing=mailing, recipient=recipient, status='Успешно', attempt_time=moment)
+            for moment in moments
+        ])
+        cls.attempts = MailingAttempt.objects.filter(mailing=mailing)
+        cls.expected = list(cls.attempts.order_by('-attempt_time', '-pk').values_list('pk', flat=True))
+
+    def ids(self, page):
+        return [attempt.pk for attempt in page]
+
+    def test_forward_and_back(self):
+        pages = [keyset_page(self.attempts, per_page=3)]
+        self.assertFalse(pages[0].has_previous)
+        while pages[-1].has_next:
+            pages.append(keyset_page(self.attempts, after=pages[-1].next_cursor, per_page=3))
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([pk for page in pages for pk in self.ids(page)], self.expected)
+
+        # Назад от последней страницы - те же страницы, на первой нет ссылки назад
+        back = keyset_page(self.attempts, before=pages[-1].previous_cursor, per_page=3)
+        self.assertEqual(self.ids(back), self.ids(pages[1]))
+        self.assertTrue(back.has_next and back.has_previous)
+        first = keyset_page(self.attempts, before=back.previous_cursor, per_page=3)
+        self.assertEqual(self.ids(first), self.ids(pages[0]))
+        self.assertFalse(first.has_previous)
+        self.assertEqual(first.next_cursor, pages[0].next_cursor)
+
+    def test_exact_page_boundary(self):
+        page = keyset_page(self.attempts, per_page=len(self.expected))
+        self.assertEqual(self.ids(page), self.expected)
+        self.assertFalse(page.has_next)
+
+        last = keyset_page(self.attempts, after=keyset_page(self.attempts, per_page=6).next_cursor, per_page=1)
+        self.assertEqual(self.ids(last), self.expected[6:])
+        self.assertFalse(last.has_next)
+
+    def test_bad_cursor_and_empty_queryset(self):
+        # Не base64 и base64 от 'foo|bar': первая страница, а не ошибка
+        for cursor in ('garbage', 'Zm9vfGJhcg'):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.ids(keyset_page(self.attempts, after=cursor, per_page=3)), self.expected[:3])
+        empty = keyset_page(self.attempts.none(), per_page=3)
+        self.assertEqual((len(empty), empty.has_next, empty.has_previous), (0, False, False))
+
+
+class AttemptExportTests(TestCase):
+    """Выгрузка попыток читается обратно в те же строки"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.mailing = create_mailing(['a@example.com', 'b@example.com', 'c@example.com'], subject='Тема, "с кавычками"')
+        other = create_mailing(['other@example.com'])
+        now = timezone.now()
+        responses = ['ok', 'ответ, с запятой', 'две\nстроки "и кавычки"']
+        for i, recipient in enumerate(cls.mailing.recipients.order_by('email')):
+            MailingAttempt.objects.create(
+                mailing=cls.mailing, recipient=recipient, status='Успешно' if i else 'Не успешно',
+                server_response=responses[i], attempt_time=now - timezone.timedelta(minutes=10 - i),
+            )
+        MailingAttempt.objects.create(
+            mailing=other, recipient=other.recipients.get(), status='Успешно', attempt_time=now
+        )
+
+    def expected(self, attempts):
+        return [
+            {
+                'id': attempt.pk,
+                'attempt_time': timezone.localtime(attempt.attempt_time).isoformat(),
+                'mailing_id': attempt.mailing_id,
+                'subject': attempt.mailing.message.subject,
+                'recipient': attempt.recipient.email,
+                'status': attempt.status,
+                'server_response': attempt.server_response,
+            }
+            for attempt in attempts.order_by('attempt_time', 'pk')
+        ]
+
+    def read_csv(self, text):
+        rows = list(csv.DictReader(io.StringIO(text)))
+        for row in rows:
+            row['id'] = int(row['id'])
+            row['mailing_id'] = int(row['mailing_id'])
+        return rows
+
+    def test_csv_view(self):
+        self.client.force_login(self.mailing.owner)
+        response = self.client.get(reverse('mailings:attempt_export'))
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        text = b''.join(response.streaming_content).decode()
+        # Попытки чужой рассылки в выгрузку не попадают
+        self.assertEqual(self.read_csv(text), self.expected(MailingAttempt.objects.filter(mailing=self.mailing)))
+
+        response = self.client.get(reverse('mailings:attempt_export'), {'status': 'Не успешно', 'format': 'jsonl'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, self.expected(MailingAttempt.objects.filter(mailing=self.mailing, status='Не успешно')))
+
+    def test_small_chunks(self):
+        text = ''.join(export_lines(MailingAttempt.objects.all(), 'csv', chunk_size=1))
+        self.assertEqual(self.read_csv(text), self.expected(MailingAttempt.objects.all()))
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.jsonl', encoding='utf-8') as output:
+            call_command('export_attempts', format='jsonl', mailing=[self.mailing.pk], output=output.name, stderr=io.StringIO())
+            rows = [json.loads(line) for line in output]
+        self.assertEqual(rows, self.expected(MailingAttempt.objects.filter(mailing=self.mailing)))
+
+
+class RecipientImportTests(TestCase):
+    """Загрузка получателей из CSV"""
+
+    def setUp(self):
+        self.owner = User.objects.create(email='owner@example.com', username='owner')
+        Recipient.objects.create(email='old@example.com', full_name='Старый', comment='был', owner=self.owner)
+
+    def write_csv(self, rows, delimiter=','):
+        output = io.StringIO()
+        writer = csv.writer(output, delimiter=delimiter)
+        writer.writerow(['email', 'full_name', 'comment'])
+        writer.writerows(rows)
+        return output.getvalue()
+
+    def stored(self):
+        return {
+            email: (full_name, comment)
+            for email, full_name, comment in Recipient.objects.filter(owner=self.owner).values_list(
+                'email', 'full_name', 'comment'
+            )
+        }
+
+    def test_round_trip(self):
+        rows = [
+            ['a@Example.COM', 'Иванов; Иван', 'комментарий, с "кавычками"\nи переводом строки'],
+            ['b@example.com', 'Петров', ''],
+            ['old@example.com', 'Новое имя', 'новый'],
+            ['not-an-email', 'Кто-то', ''],
+            ['c@example.com', '', ''],
+            ['b@example.com', 'Петров второй', ''],
+            ['d@example.com', 'Сидоров', ''],
+        ]
+        # Точка с запятой, как сохраняет CSV русский Excel. Пачки по две строки:
+        # повтор b@example.com попадает в следующую пачку и пропускается как существующий
+        report = import_recipients(self.owner, io.StringIO(self.write_csv(rows, ';'), newline=''), batch_size=2)
+        self.assertEqual(
+            (report.rows, report.created, report.updated, report.skipped, report.rejected), (7, 3, 0, 2, 2)
+        )
+        # Номера строк файла: комментарий первой записи занимает две строки
+        self.assertEqual([line for line, email, reason in report.rejected_rows], [6, 7])
+        self.assertEqual(self.stored(), {
+            'a@example.com': ('Иванов; Иван', 'комментарий, с "кавычками"\nи переводом строки'),
+            'b@example.com': ('Петров', ''),
+            'd@example.com': ('Сидоров', ''),
+            'old@example.com': ('Старый', 'был'),
+        })
+
+        report = import_recipients(
+            self.owner, io.StringIO(self.write_csv(rows[1:3]), newline=''), update_existing=True
+        )
+        self.assertEqual((report.created, report.updated), (0, 2))
+        self.assertEqual(self.stored()['old@example.com'], ('Новое имя', 'новый'))
+
+    def test_missing_header(self):
+        with self.assertRaises(ImportFileError):
+            import_recipients(self.owner, io.StringIO('a@example.com,Имя\n'))
+
+    def test_upload(self):
+        self.client.force_login(self.owner)
+        content = self.write_csv([['e@example.com', 'Егоров', '']]).encode('utf-8-sig')
+        response = self.client.post(
+            reverse('mailings:recipient_import'), {'file': SimpleUploadedFile('recipients.csv', content)}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'добавлено 1')
+        self.assertIn('e@example.com', self.stored())
+
+    def test_managers_cannot_import(self):
+        manager = User.objects.create(email='manager@example.com', username='manager')
+        manager.groups.add(Group.objects.create(name='Менеджеры'))
+        self.client.force_login(manager)
+        response = self.client.get(reverse('mailings:recipient_import'))
+        self.assertRedirects(response, reverse('mailings:recipient_list'), fetch_redirect_response=False)
+
+
+@override_settings(ROLE_CACHE_ENABLED=True)
+class RoleCacheTests(TestCase):
+    """Закешированная роль менеджера сбрасывается при любом изменении групп"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email='user@example.com', username='user')
+        self.group = Group.objects.create(name=MANAGERS_GROUP)
+
+    def assertManager(self, expected):
+        # Свежий объект: на экземпляре пользователя ничего не кешируется
+        self.assertEqual(is_manager(User.objects.get(pk=self.user.pk)), expected)
+
+    def test_user_side(self):
+        self.assertManager(False)
+        self.user.groups.add(self.group)
+        self.assertManager(True)
+        self.user.groups.remove(self.group)
+        self.assertManager(False)
+        self.user.groups.set([self.group])
+        self.assertManager(True)
+        self.user.groups.clear()
+        self.assertManager(False)
+
+    def test_group_side(self):
+        self.assertManager(False)
+        self.group.user_set.add(self.user)
+        self.assertManager(True)
+        self.group.user_set.remove(self.user)
+        self.assertManager(False)
+        self.group.user_set.add(self.user)
+        self.assertManager(True)
+        self.group.user_set.clear()
+        self.assertManager(False)
+
+    def test_group_renamed_or_deleted(self):
+        self.user.groups.add(self.group)
+        self.assertManager(True)
+        self.group.name = 'Бывшие менеджеры'
+        self.group.save()
+        self.assertManager(False)
+        self.group.name = MANAGERS_GROUP
+        self.group.save()
+        self.assertManager(True)
+        self.group.delete()
+        self.assertManager(False)
+
+    def test_one_query_per_request(self):
+        self.user.groups.add(self.group)
+        cache.clear()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse('mailings:recipient_list'))
+        group_queries = [query['sql'] for query in captured.captured_queries if 'auth_group' in query['sql']]
+        self.assertEqual(len(group_queries), 1, group_queries)
+        # Следующий запрос берет роль из кеша
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse('mailings:message_list'))
+        self.assertFalse([query for query in captured.captured_queries if 'auth_group' in query['sql']])
+
+    @override_settings(ROLE_CACHE_ENABLED=False)
+    def test_local_cache_is_not_used(self):
+        # Локальный кеш другого процесса не узнал бы об отзыве роли
+        self.assertFalse(settings.SHARED_CACHE)
+        self.user.groups.add(self.group)
+        self.assertManager(True)
+        self.assertIsNone(cache.get(role_cache_key(self.user.pk)))
+        self.client.force_login(self.user)
+        for name in ('mailings:recipient_list', 'mailings:message_list'):
+            with CaptureQueriesContext(connection) as captured:
+                self.client.get(reverse(name))
+            group_queries = [query for query in captured.captured_queries if 'auth_group' in query['sql']]
+            self.assertEqual(len(group_queries), 1)
@@ -0,0 +1,164 @@
+import asyncio
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+
+
+def recipient_domain(email):
+    return email.rpartition('@')[2].lower()
+
+
+def is_temporary_error(error):
+    """Временная ошибка: сервер просит повторить позже (4xx) или оборвал сессию"""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    return isinstance(error, (
+        smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, asyncio.TimeoutError
+    ))
+
+
+class DomainState:
+    """Скорость (token bucket) и окно параллельных отправок для одного домена"""
+
+    def __init__(self, rate, concurrency):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        # (цикл событий, asyncio.Event) корутин, ждущих слот в acquire_async
+        self.waiters = []
+
+    def refill(self, now):
+        # Запас токенов не больше секунды отправки на текущей скорости
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, now):
+        """Занять токен и слот. Возвращает 0 при успехе или сколько ждать."""
+        self.refill(now)
+        if self.in_flight >= int(self.concurrency):
+            return None
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.in_flight += 1
+        return 0
+
+
+class DomainThrottle:
+    """Адаптивное ограничение отправки по доменам получателей.
+
+    Для каждого домена своя скорость (писем в секунду) и свое число
+    одновременных отправок. Оба значения растут аддитивно после успешных
+    отправок и уменьшаются вдвое после временных ошибок (AIMD), так что
+    отправка держится около скорости, которую домен готов принимать.
+    """
+
+    def __init__(self, rate=None, max_rate=None, concurrency=None, max_concurrency=None):
+        self.initial_rate = rate or settings.MAILING_THROTTLE_RATE
+        self.max_rate = max_rate or settings.MAILING_THROTTLE_MAX_RATE
+        self.initial_concurrency = concurrency or settings.MAILING_THROTTLE_CONCURRENCY
+        self.max_concurrency = max_concurrency or settings.MAILING_THROTTLE_MAX_CONCURRENCY
+        self.min_rate = 0.1
+        self.domains = {}
+        self.condition = threading.Condition()
+
+    def state(self, domain):
+        state = self.domains.get(domain)
+        if state is None:
+            state = self.domains[domain] = DomainState(self.initial_rate, self.initial_concurrency)
+        return state
+
+    def try_acquire(self, domain):
+        with self.condition:
+            return self.state(domain).try_acquire(time.monotonic())
+
+    def domain_concurrency(self, domain):
+        """Сколько писем в домен сейчас разрешено отправлять одновременно"""
+        with self.condition:
+            return int(self.state(domain).concurrency)
+
+    def acquire(self, domain):
+        """Дождаться разрешения на отправку письма в домен (блокирующе)"""
+        with self.condition:
+            while True:
+                wait = self.state(domain).try_acquire(time.monotonic())
+                if wait == 0:
+                    return
+                # None - все слоты заняты, ждем освобождения слота
+                self.condition.wait(wait)
+
+    async def acquire_async(self, domain):
+        """То же, что acquire, для асинхронного движка.
+
+        Пока все слоты домена заняты, корутина не опрашивает ограничитель,
+        а ждет события, которое release выставляет из любого потока.
+        Недостаток токенов ждется по таймауту.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            waiter = (loop, asyncio.Event())
+            with self.condition:
+                state = self.state(domain)
+                wait = state.try_acquire(time.monotonic())
+                if wait == 0:
+                    return
+                state.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1].wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self.condition:
+                    state.waiters.remove(waiter)
+
+    def wake(self, state):
+        """Разбудить ждущих слот домена: потоки в acquire и корутины в acquire_async"""
+        self.condition.notify_all()
+        for loop, event in state.waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def release(self, domain, error=None):
+        """Вернуть слот и подстроить скорость по результату отправки"""
+        with self.condition:
+            state = self.state(domain)
+            state.in_flight -= 1
+            if error is None:
+                state.rate = min(self.max_rate, state.rate + 1 / state.rate)
+                state.concurrency = min(self.max_concurrency, state.concurrency + 1 / state.concurrency)
+            elif is_temporary_error(error):
+                state.rate = max(self.min_rate, state.rate / 2)
+                state.concurrency = max(1, state.concurrency / 2)
+                state.tokens = min(state.tokens, 0)
+            self.wake(state)
+
+    def cancel(self, domain):
+        """Вернуть слот, не подстраивая скорость: письмо так и не отправлялось"""
+        with self.condition:
+            state = self.state(domain)
+            state.in_flight -= 1
+            self.wake(state)
+
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+
+def get_throttle():
+    """Общий для процесса ограничитель, если он включен в настройках.
+
+    Состояние доменов живет все время работы процесса, поэтому следующие
+    рассылки начинают с уже подобранной скорости.
+    """
+    global _throttle
+    if not settings.MAILING_THROTTLE:
+        return None
+    with _throttle_lock:
+        if _throttle is None:
+            _throttle = DomainThrottle()
+        return _throttle
@@ -10,6 +10,7 @@ urlpatterns = [
     # Получатели
     path('recipients/', views.recipient_list, name='recipient_list'),
     path('recipients/create/', views.recipient_create, name='recipient_create'),
+    path('recipients/import/', views.recipient_import, name='recipient_import'),
     path('recipients/<int:pk>/update/', views.recipient_update, name='recipient_update'),
     path('recipients/<int:pk>/delete/', views.recipient_delete, name='recipient_delete'),
     
@@ -29,7 +30,10 @@ urlpatterns = [
     
     # Попытки и статистика
     path('attempts/', views.attempt_list, name='attempt_list'),
+    path('attempts/export/', views.attempt_export, name='attempt_export'),
     path('statistics/', views.statistics, name='statistics'),
+    path('statistics/series/', views.statistics_series, name='statistics_series'),
+    path('statistics/page-cache/', views.page_cache_statistics, name='page_cache_statistics'),
     
     # Детальные страницы
     path('recipients/<int:pk>/', views.recipient_detail, name='recipient_detail'),
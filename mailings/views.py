@@ -1,54 +1,77 @@
+import io
+
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required, permission_required
-from django.core.mail import send_mail
 from django.utils import timezone
-from django.db.models import Count, Q
-from django.core.cache import cache
-from django.views.decorators.cache import cache_page
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.core.paginator import Paginator
 from django.views.decorators.vary import vary_on_headers
-from .models import Recipient, Message, Mailing, MailingAttempt
-from .forms import RecipientForm, MessageForm, MailingForm
-
-
-def get_user_queryset(model, user):
+from .models import (
+    DeliveryRollup, Recipient, Message, Mailing, MailingAttempt, OwnerDeliveryCounter, status_condition
+)
+from .forms import (
+    AttemptFilterForm, RecipientForm, RecipientImportForm, MessageForm, MailingForm, StatisticsFilterForm
+)
+from .conditional import conditional, mailing_stamp, stamp
+from .export import FORMATS, export_lines
+from .generations import ALL, bump, cached, scope_of
+from .imports import ImportFileError, import_recipients
+from .outbox import enqueue_mailing
+from .page_cache import page_cache, page_cache_stats
+from .pagination import keyset_page
+from .roles import get_roles
+from .rollups import HOURLY_SERIES_LIMIT, series
+from .scheduler import notify_schedule_changed
+
+
+def filter_query(request):
+    """Параметры фильтров из запроса без курсора, для ссылок на соседние страницы"""
+    query = request.GET.copy()
+    for key in ('after', 'before'):
+        query.pop(key, None)
+    return query.urlencode()
+
+
+def get_user_attempts(request):
+    """Попытки и рассылки, доступные пользователю"""
+    if get_roles(request).can_view_all:
+        return MailingAttempt.objects.all(), Mailing.objects.all()
+    return MailingAttempt.objects.filter(mailing__owner=request.user), Mailing.objects.filter(owner=request.user)
+
+
+def get_user_queryset(model, request):
     """Получить QuerySet с учетом прав доступа пользователя"""
-    if user.is_staff or user.groups.filter(name='Менеджеры').exists():
+    if get_roles(request).can_view_all:
         return model.objects.all()
-    return model.objects.filter(owner=user)
+    return model.objects.filter(owner=request.user)
 
 
-@cache_page(60 * 5)  # Кеширование на 5 минут
+@page_cache(60 * 5)
 def index(request):
     """Главная страница со статистикой"""
-    cache_key = 'index_stats'
-    stats = cache.get(cache_key)
-    
-    if stats is None:
-        total_mailings = Mailing.objects.count()
-        now = timezone.now()
-        active_mailings = Mailing.objects.filter(
-            start_time__lte=now,
-            end_time__gte=now,
-            status='Запущена'
-        ).count()
-        unique_recipients = Recipient.objects.distinct().count()
-        
-        stats = {
-            'total_mailings': total_mailings,
-            'active_mailings': active_mailings,
-            'unique_recipients': unique_recipients,
+    def compute():
+        return {
+            'total_mailings': Mailing.objects.count(),
+            'active_mailings': Mailing.objects.in_status('Запущена').count(),
+            'unique_recipients': Recipient.objects.distinct().count(),
         }
-        cache.set(cache_key, stats, 300)  # Кеш на 5 минут
-    
+
+    # Сводка по всем рассылкам, кеш сбрасывается при любом изменении данных
+    stats = cached(ALL, 'index_stats', compute)
     return render(request, 'mailings/index.html', stats)
 
 
 # CRUD для получателей (Recipients)
 @login_required
+@page_cache(60 * 5)
+@conditional(lambda request: stamp(get_user_queryset(Recipient, request)))
 def recipient_list(request):
     """Список получателей"""
-    recipients = get_user_queryset(Recipient, request.user)
+    recipients = get_user_queryset(Recipient, request)
     return render(request, 'mailings/recipient_list.html', {'recipients': recipients})
 
 
@@ -68,13 +91,44 @@ def recipient_create(request):
     return render(request, 'mailings/recipient_form.html', {'form': form, 'title': 'Создать получателя'})
 
 
+@login_required
+def recipient_import(request):
+    """Загрузка получателей из CSV-файла"""
+    if get_roles(request).is_read_only:
+        messages.error(request, 'У вас нет прав на добавление получателей.')
+        return redirect('mailings:recipient_list')
+
+    report = None
+    if request.method == 'POST':
+        form = RecipientImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            # Файл читается построчно, не загружаясь в память целиком
+            lines = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+            try:
+                report = import_recipients(
+                    request.user, lines, update_existing=form.cleaned_data['update_existing']
+                )
+            except ImportFileError as error:
+                report = error.report
+                messages.error(request, str(error))
+            else:
+                messages.success(
+                    request,
+                    f'Загрузка завершена: добавлено {report.created}, обновлено {report.updated}, '
+                    f'пропущено {report.skipped}, отклонено {report.rejected}.'
+                )
+    else:
+        form = RecipientImportForm()
+    return render(request, 'mailings/recipient_import.html', {'form': form, 'report': report})
+
+
 @login_required
 def recipient_update(request, pk):
     """Редактирование получателя"""
-    recipient = get_object_or_404(get_user_queryset(Recipient, request.user), pk=pk)
+    recipient = get_object_or_404(get_user_queryset(Recipient, request), pk=pk)
     
     # Проверка прав: менеджеры могут только просматривать
-    if request.user.groups.filter(name='Менеджеры').exists() and not request.user.is_staff:
+    if get_roles(request).is_read_only:
         messages.error(request, 'У вас нет прав на редактирование.')
         return redirect('mailings:recipient_list')
     
@@ -92,10 +146,10 @@ def recipient_update(request, pk):
 @login_required
 def recipient_delete(request, pk):
     """Удаление получателя"""
-    recipient = get_object_or_404(get_user_queryset(Recipient, request.user), pk=pk)
+    recipient = get_object_or_404(get_user_queryset(Recipient, request), pk=pk)
     
     # Проверка прав: менеджеры могут только просматривать
-    if request.user.groups.filter(name='Менеджеры').exists() and not request.user.is_staff:
+    if get_roles(request).is_read_only:
         messages.error(request, 'У вас нет прав на удаление.')
         return redirect('mailings:recipient_list')
     
@@ -107,9 +161,10 @@ def recipient_delete(request, pk):
 
 
 @login_required
+@page_cache(60 * 5)
 def recipient_detail(request, pk):
     """Детальная информация о получателе"""
-    recipient = get_object_or_404(get_user_queryset(Recipient, request.user), pk=pk)
+    recipient = get_object_or_404(get_user_queryset(Recipient, request), pk=pk)
     mailings = Mailing.objects.filter(recipients=recipient)
     attempts = MailingAttempt.objects.filter(recipient=recipient).order_by('-attempt_time')[:10]
     return render(request, 'mailings/recipient_detail.html', {
@@ -121,9 +176,11 @@ def recipient_detail(request, pk):
 
 # CRUD для сообщений (Messages)
 @login_required
+@page_cache(60 * 5)
+@conditional(lambda request: stamp(get_user_queryset(Message, request)))
 def message_list(request):
     """Список сообщений"""
-    messages_list = get_user_queryset(Message, request.user)
+    messages_list = get_user_queryset(Message, request)
     return render(request, 'mailings/message_list.html', {'messages_list': messages_list})
 
 
@@ -146,10 +203,10 @@ def message_create(request):
 @login_required
 def message_update(request, pk):
     """Редактирование сообщения"""
-    message = get_object_or_404(get_user_queryset(Message, request.user), pk=pk)
+    message = get_object_or_404(get_user_queryset(Message, request), pk=pk)
     
     # Проверка прав: менеджеры могут только просматривать
-    if request.user.groups.filter(name='Менеджеры').exists() and not request.user.is_staff:
+    if get_roles(request).is_read_only:
         messages.error(request, 'У вас нет прав на редактирование.')
         return redirect('mailings:message_list')
     
@@ -167,10 +224,10 @@ def message_update(request, pk):
 @login_required
 def message_delete(request, pk):
     """Удаление сообщения"""
-    message = get_object_or_404(get_user_queryset(Message, request.user), pk=pk)
+    message = get_object_or_404(get_user_queryset(Message, request), pk=pk)
     
     # Проверка прав: менеджеры могут только просматривать
-    if request.user.groups.filter(name='Менеджеры').exists() and not request.user.is_staff:
+    if get_roles(request).is_read_only:
         messages.error(request, 'У вас нет прав на удаление.')
         return redirect('mailings:message_list')
     
@@ -182,9 +239,10 @@ def message_delete(request, pk):
 
 
 @login_required
+@page_cache(60 * 5)
 def message_detail(request, pk):
     """Детальная информация о сообщении"""
-    message = get_object_or_404(get_user_queryset(Message, request.user), pk=pk)
+    message = get_object_or_404(get_user_queryset(Message, request), pk=pk)
     mailings = Mailing.objects.filter(message=message)
     return render(request, 'mailings/message_detail.html', {
         'message': message,
@@ -194,16 +252,15 @@ def message_detail(request, pk):
 
 # CRUD для рассылок (Mailings)
 @login_required
+@page_cache(60)
+@conditional(lambda request: mailing_stamp(get_user_queryset(Mailing, request)))
 def mailing_list(request):
     """Список рассылок"""
-    mailings_list = get_user_queryset(Mailing, request.user).prefetch_related('recipients', 'message')
-    # Обновляем статусы динамически без валидации
-    for mailing in mailings_list:
-        current_status = mailing.get_status()
-        if mailing.status != current_status:
-            # Используем update() для обхода валидации
-            Mailing.objects.filter(pk=mailing.pk).update(status=current_status)
-            mailing.status = current_status  # Обновляем объект в памяти
+    # Статус вычисляется в запросе по времени рассылки, сохраненное поле
+    # приводит в порядок планировщик (Mailing.objects.reconcile_status)
+    mailings_list = get_user_queryset(Mailing, request).with_current_status().prefetch_related(
+        'recipients', 'message'
+    )
     return render(request, 'mailings/mailing_list.html', {'mailings_list': mailings_list})
 
 
@@ -228,10 +285,10 @@ def mailing_create(request):
 @login_required
 def mailing_update(request, pk):
     """Редактирование рассылки"""
-    mailing = get_object_or_404(get_user_queryset(Mailing, request.user), pk=pk)
+    mailing = get_object_or_404(get_user_queryset(Mailing, request), pk=pk)
     
     # Проверка прав: менеджеры могут только просматривать
-    if request.user.groups.filter(name='Менеджеры').exists() and not request.user.is_staff:
+    if get_roles(request).is_read_only:
         messages.error(request, 'У вас нет прав на редактирование.')
         return redirect('mailings:mailing_list')
     
@@ -239,12 +296,10 @@ def mailing_update(request, pk):
         form = MailingForm(request.POST, instance=mailing, user=request.user)
         if form.is_valid():
             mailing = form.save(commit=False)
-            current_status = mailing.get_status()  # Получаем текущий статус
             mailing.save()
             form.save_m2m()
-            # Обновляем статус без валидации, если изменился
-            if mailing.status != current_status:
-                Mailing.objects.filter(pk=mailing.pk).update(status=current_status)
+            # Статус по новым датам записываем без валидации
+            Mailing.objects.filter(pk=mailing.pk).reconcile_status()
             messages.success(request, 'Рассылка успешно обновлена!')
             return redirect('mailings:mailing_list')
     else:
@@ -264,10 +319,13 @@ def mailing_disable(request, pk):
         # Используем update() для обхода валидации
         Mailing.objects.filter(pk=mailing.pk).update(
             end_time=new_end_time,
-            status='Завершена'
+            status='Завершена',
+            updated_at=timezone.now()
         )
+        bump([mailing.owner_id])
         mailing.end_time = new_end_time
         mailing.status = 'Завершена'
+        notify_schedule_changed()
         messages.success(request, f'Рассылка #{mailing.id} отключена.')
         return redirect('mailings:mailing_detail', pk=mailing.pk)
     
@@ -277,10 +335,10 @@ def mailing_disable(request, pk):
 @login_required
 def mailing_delete(request, pk):
     """Удаление рассылки"""
-    mailing = get_object_or_404(get_user_queryset(Mailing, request.user), pk=pk)
+    mailing = get_object_or_404(get_user_queryset(Mailing, request), pk=pk)
     
     # Проверка прав: менеджеры могут только просматривать
-    if request.user.groups.filter(name='Менеджеры').exists() and not request.user.is_staff:
+    if get_roles(request).is_read_only:
         messages.error(request, 'У вас нет прав на удаление.')
         return redirect('mailings:mailing_list')
     
@@ -292,27 +350,32 @@ def mailing_delete(request, pk):
 
 
 @login_required
+@page_cache(60)
+@conditional(lambda request, pk: mailing_stamp(get_user_queryset(Mailing, request).filter(pk=pk)))
 def mailing_detail(request, pk):
     """Детальная информация о рассылке"""
-    mailing = get_object_or_404(get_user_queryset(Mailing, request.user), pk=pk)
-    # Обновляем статус динамически без валидации
-    current_status = mailing.get_status()
-    if mailing.status != current_status:
-        # Используем update() для обхода валидации при обновлении статуса
-        Mailing.objects.filter(pk=mailing.pk).update(status=current_status)
-        mailing.status = current_status  # Обновляем объект в памяти
-    
-    attempts = MailingAttempt.objects.filter(mailing=mailing).order_by('-attempt_time')
+    mailing = get_object_or_404(get_user_queryset(Mailing, request).with_current_status(), pk=pk)
+    attempt_filter = AttemptFilterForm(request.GET or None)
+    attempts = keyset_page(
+        attempt_filter.filter(MailingAttempt.objects.filter(mailing=mailing).select_related('recipient')),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        per_page=20
+    )
+    last_job = mailing.jobs.first()
     return render(request, 'mailings/mailing_detail.html', {
         'mailing': mailing,
-        'attempts': attempts
+        'attempts': attempts,
+        'attempt_filter': attempt_filter,
+        'filter_query': filter_query(request),
+        'last_job': last_job
     })
 
 
 @login_required
 def send_mailing(request, pk):
     """Отправка рассылки вручную"""
-    mailing = get_object_or_404(get_user_queryset(Mailing, request.user), pk=pk)
+    mailing = get_object_or_404(get_user_queryset(Mailing, request), pk=pk)
     
     # Проверка времени рассылки
     now = timezone.now()
@@ -324,111 +387,178 @@ def send_mailing(request, pk):
         return redirect('mailings:mailing_detail', pk=mailing.pk)
     
     if request.method == 'POST':
-        recipients = mailing.recipients.all()
-        success_count = 0
-        fail_count = 0
-        
-        for recipient in recipients:
-            try:
-                send_mail(
-                    subject=mailing.message.subject,
-                    message=mailing.message.body,
-                    from_email=None,
-                    recipient_list=[recipient.email],
-                    fail_silently=False,
-                )
-                MailingAttempt.objects.create(
-                    mailing=mailing,
-                    recipient=recipient,
-                    status='Успешно',
-                    server_response='Сообщение успешно отправлено'
-                )
-                success_count += 1
-            except Exception as e:
-                MailingAttempt.objects.create(
-                    mailing=mailing,
-                    recipient=recipient,
-                    status='Не успешно',
-                    server_response=str(e)
-                )
-                fail_count += 1
-        
-        # Обновляем статус рассылки без валидации
-        current_status = mailing.get_status()
-        if mailing.status != current_status:
-            Mailing.objects.filter(pk=mailing.pk).update(status=current_status)
-            mailing.status = current_status
-        
-        messages.success(
-            request,
-            f'Рассылка отправлена! Успешно: {success_count}, Неудачно: {fail_count}'
-        )
+        # Отправка выполняется обработчиком очереди (run_delivery_worker)
+        job, created = enqueue_mailing(mailing)
+        if created:
+            messages.success(request, 'Рассылка поставлена в очередь на отправку.')
+        else:
+            messages.info(request, f'Рассылка уже в очереди на отправку (задание #{job.id}).')
         return redirect('mailings:mailing_detail', pk=mailing.pk)
     
     return render(request, 'mailings/mailing_send_confirm.html', {'mailing': mailing})
 
 
 @login_required
+@page_cache(60)
 def attempt_list(request):
-    """Список попыток рассылок"""
-    if request.user.is_staff or request.user.groups.filter(name='Менеджеры').exists():
-        attempts = MailingAttempt.objects.all().select_related('mailing', 'recipient')
-    else:
-        attempts = MailingAttempt.objects.filter(
-            mailing__owner=request.user
-        ).select_related('mailing', 'recipient')
-    
-    attempts = attempts.order_by('-attempt_time')
-    return render(request, 'mailings/attempt_list.html', {'attempts': attempts})
+    """Список попыток рассылок, постранично по курсору (время, id)"""
+    attempts, mailings = get_user_attempts(request)
+    filter_form = AttemptFilterForm(request.GET or None, mailings=mailings)
+    period_form = StatisticsFilterForm(request.GET or None)
+    attempts = filter_form.filter(attempts).filter(period_form.attempt_filter())
+    page = keyset_page(
+        attempts.select_related('mailing__message', 'recipient'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before')
+    )
+    return render(request, 'mailings/attempt_list.html', {
+        'attempts': page,
+        'filter_form': filter_form,
+        'period_form': period_form,
+        'filter_query': filter_query(request),
+    })
 
 
 @login_required
+def attempt_export(request):
+    """Выгрузка попыток в CSV или JSON Lines с теми же фильтрами, что у списка, и периодом"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in FORMATS:
+        return HttpResponseBadRequest('Неизвестный формат выгрузки')
+    attempts, mailings = get_user_attempts(request)
+    filter_form = AttemptFilterForm(request.GET or None, mailings=mailings)
+    period_form = StatisticsFilterForm(request.GET or None)
+    attempts = filter_form.filter(attempts).filter(period_form.attempt_filter())
+
+    response = StreamingHttpResponse(export_lines(attempts, export_format), content_type=FORMATS[export_format])
+    filename = f'attempts-{timezone.localdate():%Y%m%d}.{export_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+@page_cache(60)
+@conditional(lambda request: mailing_stamp(get_user_queryset(Mailing, request)))
 def statistics(request):
-    """Статистика и отчеты по рассылкам пользователя"""
-    if request.user.is_staff or request.user.groups.filter(name='Менеджеры').exists():
+    """Статистика и отчеты по рассылкам пользователя.
+
+    Все цифры считаются в БД: сводка по рассылкам - одним агрегатом,
+    попытки за все время берутся из счетчиков рассылок и владельцев.
+    Попытки можно ограничить периодом, тогда они считаются агрегатами
+    по таблице попыток (один запрос с GROUP BY на страницу рассылок).
+    """
+    show_all = get_roles(request).can_view_all
+    if show_all:
         mailings = Mailing.objects.all()
         attempts = MailingAttempt.objects.all()
     else:
         mailings = Mailing.objects.filter(owner=request.user)
         attempts = MailingAttempt.objects.filter(mailing__owner=request.user)
-    
-    # Статистика по рассылкам
-    total_mailings = mailings.count()
-    active_mailings = mailings.filter(
-        start_time__lte=timezone.now(),
-        end_time__gte=timezone.now(),
-        status='Запущена'
-    ).count()
-    completed_mailings = mailings.filter(status='Завершена').count()
-    
-    # Статистика по попыткам
-    total_attempts = attempts.count()
-    successful_attempts = attempts.filter(status='Успешно').count()
-    failed_attempts = attempts.filter(status='Не успешно').count()
-    
-    # Статистика по сообщениям
-    total_messages_sent = successful_attempts
-    
-    # Детальная статистика по каждой рассылке
-    mailing_stats = []
-    for mailing in mailings:
-        mailing_attempts = attempts.filter(mailing=mailing)
-        mailing_stats.append({
-            'mailing': mailing,
-            'total_attempts': mailing_attempts.count(),
-            'successful': mailing_attempts.filter(status='Успешно').count(),
-            'failed': mailing_attempts.filter(status='Не успешно').count(),
-        })
-    
+
+    filter_form = StatisticsFilterForm(request.GET or None)
+    period = filter_form.attempt_filter()
+    attempts_period = filter_form.attempt_filter('attempts__')
+
+    def compute_totals():
+        # Статистика по рассылкам
+        mailing_totals = mailings.aggregate(
+            total=Count('pk'),
+            active=Count('pk', filter=status_condition('Запущена')),
+            completed=Count('pk', filter=status_condition('Завершена')),
+        )
+
+        # Статистика по попыткам: за период - агрегатом по попыткам,
+        # за все время - из счетчиков, без чтения таблицы попыток
+        if period:
+            attempt_totals = attempts.filter(period).aggregate(
+                total=Count('pk'),
+                successful=Count('pk', filter=Q(status='Успешно')),
+                failed=Count('pk', filter=Q(status='Не успешно')),
+            )
+        elif not show_all:
+            counter = OwnerDeliveryCounter.objects.filter(owner=request.user).first()
+            attempt_totals = {
+                'total': counter.attempts_total if counter else 0,
+                'successful': counter.attempts_successful if counter else 0,
+                'failed': counter.attempts_failed if counter else 0,
+            }
+        else:
+            attempt_totals = mailings.aggregate(
+                total=Coalesce(Sum('attempts_total'), 0),
+                successful=Coalesce(Sum('attempts_successful'), 0),
+                failed=Coalesce(Sum('attempts_failed'), 0),
+            )
+        return mailing_totals, attempt_totals
+
+    # Сводка кешируется по владельцу (или по всем для менеджеров) и периоду
+    start, end = filter_form.bounds()
+    mailing_totals, attempt_totals = cached(
+        scope_of(request), f'statistics:{start and start.isoformat()}:{end and end.isoformat()}', compute_totals
+    )
+
+    # Детальная статистика по рассылкам, постранично
+    mailing_stats = mailings.select_related('message').with_current_status()
+    if period:
+        mailing_stats = mailing_stats.annotate(
+            total_attempts=Count('attempts', filter=attempts_period),
+            successful=Count('attempts', filter=attempts_period & Q(attempts__status='Успешно')),
+            failed=Count('attempts', filter=attempts_period & Q(attempts__status='Не успешно')),
+        )
+    else:
+        mailing_stats = mailing_stats.annotate(
+            total_attempts=F('attempts_total'),
+            successful=F('attempts_successful'),
+            failed=F('attempts_failed'),
+        )
+    mailing_stats = mailing_stats.order_by('-start_time', '-pk')
+    page_obj = Paginator(mailing_stats, 50).get_page(request.GET.get('page'))
+
+    # Параметры периода сохраняются в ссылках на страницы
+    query = request.GET.copy()
+    query.pop('page', None)
+
     context = {
-        'total_mailings': total_mailings,
-        'active_mailings': active_mailings,
-        'completed_mailings': completed_mailings,
-        'total_attempts': total_attempts,
-        'successful_attempts': successful_attempts,
-        'failed_attempts': failed_attempts,
-        'total_messages_sent': total_messages_sent,
-        'mailing_stats': mailing_stats,
+        'total_mailings': mailing_totals['total'],
+        'active_mailings': mailing_totals['active'],
+        'completed_mailings': mailing_totals['completed'],
+        'total_attempts': attempt_totals['total'],
+        'successful_attempts': attempt_totals['successful'],
+        'failed_attempts': attempt_totals['failed'],
+        'total_messages_sent': attempt_totals['successful'],
+        'page_obj': page_obj,
+        'filter_form': filter_form,
+        'filter_query': query.urlencode(),
     }
-    
+
     return render(request, 'mailings/statistics.html', context)
+
+
+@login_required
+@page_cache(60)
+def statistics_series(request):
+    """Ряд попыток по времени для графика на странице статистики (JSON).
+
+    Строится по почасовым итогам DeliveryRollup. Без периода - последние
+    7 дней по часам, период длиннее недели показывается по дням.
+    Параметр mailing ограничивает ряд одной рассылкой.
+    """
+    if get_roles(request).can_view_all:
+        rollups = DeliveryRollup.objects.all()
+    else:
+        rollups = DeliveryRollup.objects.filter(owner=request.user)
+    mailing_id = request.GET.get('mailing')
+    if mailing_id and mailing_id.isdigit():
+        rollups = rollups.filter(mailing_id=mailing_id)
+
+    start, end = StatisticsFilterForm(request.GET or None).bounds()
+    if end is None:
+        end = timezone.localtime().replace(minute=0, second=0, microsecond=0) + timezone.timedelta(hours=1)
+    if start is None:
+        start = end - HOURLY_SERIES_LIMIT
+    return JsonResponse(series(rollups, start, end))
+
+
+@staff_member_required
+def page_cache_statistics(request):
+    """Попадания и промахи кеша страниц (JSON, для персонала)"""
+    return JsonResponse(page_cache_stats())